@@ -7,6 +7,7 @@
 import config
 import argparse
 import os
+import time
 
 from flask import Flask, g, session
 from flask_migrate import Migrate
@@ -84,15 +85,16 @@
 
 @app.before_request
 def cleanup_expired_sessions():
+    # 只删除长时间未更新的会话文件，其他会话(包括并发请求中的)不受影响
     session_folder = app.config['SESSION_FILE_DIR']
+    expire_time = time.time() - config.SESSION_FILE_MAX_AGE
     for filename in os.listdir(session_folder):
         file_path = os.path.join(session_folder, filename)
-        if os.path.isfile(file_path):
-            try:
-                # 删除过期的会话文件
+        try:
+            if os.path.isfile(file_path) and os.path.getmtime(file_path) < expire_time:
                 os.remove(file_path)
-            except Exception as e:
-                print(f"Error deleting session file {file_path}: {e}")
+        except Exception as e:
+            print(f"Error deleting session file {file_path}: {e}")
 
 
 def test_database_connection():
@@ -1,6 +1,10 @@
 
+import io
+import logging
+
 import imgviz
-from flask import Blueprint, request, render_template, g, redirect, session
+import config
+from flask import Blueprint, request, render_template, g, redirect, session, send_file, url_for
 import datetime
 from flask_jwt_extended import jwt_required
 from database_models import (WeightModel, TaskTypeModel, TaskModel, FlowModel, ReleaseModel,
@@ -8,8 +12,12 @@
 from utils.backend_utils.response_utils import response
 from utils.backend_utils.colorprinter import *
 from work_flow.engines.model_manager import ModelManager
-
-from work_flow.utils.canvas import Canvas
+from work_flow.engines.result_cache import ResultCache
+from work_flow.engines.batch_scheduler import get_batching_metrics
+from work_flow.engines import text_feature_cache
+from work_flow.flows.embedding_store import embedding_store
+from utils.backend_utils.image_store import image_store
+from utils.backend_utils.result_renderer import result_renderer, RENDER_FORMATS
 
 '''
 前后端code约定：
@@ -24,8 +32,9 @@
 code: 206 前端通知弹窗Warning
 code: 207 前端通知弹窗Info
 '''
-model_manager = ModelManager()
-predict_drawer = Canvas()
+model_manager = ModelManager(max_pool_memory=config.MODEL_POOL_MAX_MEMORY,
+                             result_cache=ResultCache(config.RESULT_CACHE_SIZE, config.RESULT_CACHE_DIR),
+                             batching=config.INFER_BATCHING)
 LABEL_COLORMAP = imgviz.label_colormap()
 bp = Blueprint(name='online/infer', import_name=__name__)
 
@@ -217,6 +226,39 @@ def switch_param():
     return response(code=0, message='配置修改成功')
 
 
+def get_session_model_source():
+    """返回按会话中的装载参数重新生成装载配置的回调，供本进程未装载该模型时使用"""
+    pool_source = session.get('pool_source')
+    if pool_source is None:
+        return None
+
+    def source():
+        release = ReleaseModel.query.filter_by(id=pool_source['release']).first()
+        if release is None:
+            return None
+        try:
+            return pool_source['release'], build_release_config(release, pool_source['weight'], pool_source['param'])
+        except ValueError as e:
+            logging.warning(f"Could not rebuild model config of release {pool_source['release']}: {e}")
+            return None
+    return source
+
+
+def build_release_config(release, weight_ids, params=None):
+    """按选中的权重与静态参数生成版本的装载配置"""
+    model_config = release.to_config  # 用于装载模型
+    for key in release.weights:
+        if key not in weight_ids:
+            raise ValueError(f'权重选择不完整，缺少{key}')
+        weight = WeightModel.query.filter_by(id=weight_ids[key]).first()
+        model_config[key] = weight.to_config
+    if release.params is not None and release.params:
+        if params is None:
+            raise ValueError('未设置配置')
+        model_config.update(params)
+    return model_config
+
+
 @bp.route('/model/load')
 @jwt_required(refresh=True)
 def load_model():
@@ -226,23 +268,71 @@ def load_model():
     if 'weight' not in session:
         return response(code=1, message='模型装载失败，未选择权重')
     release = ReleaseModel.query.filter_by(id=release_id).first()
-    config = release.to_config  # 用于装载模型
-    for key in release.weights:
-        if key not in session['weight']:
-            return response(code=1, message=f'模型装载失败，权重选择不完整，缺少{key}')
-        weight = WeightModel.query.filter_by(id=session['weight'][key]).first()
-        config[key] = weight.to_config
-    if release.params is not None and release.params:
-        if 'param' not in session:
-            return response(code=1, message='模型装载失败，未设置配置')
-        config.update(session['param'])
-    model_manager.load_model(release_id, config)
+    try:
+        model_config = build_release_config(release, session['weight'], session.get('param'))
+    except ValueError as e:
+        return response(code=1, message=f'模型装载失败，{e}')
+    loaded_model_config = model_manager.load_model(release_id, model_config, weight_ids=session['weight'])
+    if loaded_model_config is None:
+        return response(code=1, message=f'{release.name}模型装载失败')
+    session['pool_key'] = loaded_model_config['pool_key']  # 每个会话使用各自装载的模型
+    # serve.py下其他工作进程没有该模型，据此在处理推理请求的进程中重新装载
+    session['pool_source'] = {'release': release_id, 'weight': session['weight'], 'param': session.get('param')}
     data = release.to_hypers
     session['hyper'] = release.hypers  # 存初始值
     print_cyan(f'模型装载成功')
     return response(code=200, message=f'{release.name}模型装载成功', data=data)
 
 
+@bp.route('/model/pool')
+@jwt_required(refresh=True)
+def get_model_pool():
+    data = model_manager.get_model_pool_info()
+    return response(code=0, message='获取常驻模型池成功', data=data)
+
+
+@bp.route('/model/cache')
+@jwt_required(refresh=True)
+def get_result_cache():
+    data = model_manager.result_cache.get_info()
+    return response(code=0, message='获取推理结果缓存状态成功', data=data)
+
+
+@bp.route('/model/cache/clear', methods=['POST'])
+@jwt_required(refresh=True)
+def clear_result_cache():
+    model_manager.result_cache.clear()
+    return response(code=200, message='推理结果缓存已清空')
+
+
+@bp.route('/model/embeddings')
+@jwt_required(refresh=True)
+def get_embedding_cache():
+    data = embedding_store.get_info()
+    return response(code=0, message='获取图像编码缓存状态成功', data=data)
+
+
+@bp.route('/model/embeddings/clear', methods=['POST'])
+@jwt_required(refresh=True)
+def clear_embedding_cache():
+    embedding_store.clear(disk=request.args.get('disk') == '1')
+    return response(code=200, message='图像编码缓存已清空')
+
+
+@bp.route('/model/text_features')
+@jwt_required(refresh=True)
+def get_text_feature_cache():
+    data = text_feature_cache.get_info()
+    return response(code=0, message='获取CLIP文本特征缓存状态成功', data=data)
+
+
+@bp.route('/model/batching')
+@jwt_required(refresh=True)
+def get_model_batching():
+    data = get_batching_metrics()
+    return response(code=0, message='获取动态批处理指标成功', data=data)
+
+
 @bp.route('/hyper/current', methods=['POST'])
 @jwt_required(refresh=True)
 def get_current_hyper():
@@ -265,19 +355,91 @@ def switch_hyper():
     return response(code=0, message='配置修改成功')
 
 
+IMAGE_ROLES = ['origin', 'mask', 'minor']  # 对应超参数 origin_image / mask_image / minor_image
+
+
+@bp.route('/image/upload', methods=['POST'])
+@jwt_required(refresh=True)
+def upload_image():
+    """上传图像：multipart字段image或原始请求体，按内容落盘后在会话中只保存引用"""
+    role = request.args.get('role', 'origin').strip()
+    if role not in IMAGE_ROLES:
+        return response(code=1, message=f'图像上传失败，未知的图像类型{role}')
+    if 'hyper' not in session:
+        return response(code=1, message='图像上传失败，模型未装载')
+    file = request.files.get('image')
+    try:
+        image_ref = image_store.put_stream(file.stream if file is not None else request.stream)
+    except ValueError as e:
+        return response(code=1, message=f'图像上传失败，{e}')
+    session['hyper'][f'{role}_image'] = image_ref
+    session.modified = True
+    return response(code=0, message='图像上传成功', data={'imageHash': image_ref})
+
+
+@bp.route('/image/refer', methods=['POST'])
+@jwt_required(refresh=True)
+def refer_image():
+    """引用已上传过的图像，命中时无需重复上传"""
+    role = request.json.get('role', 'origin').strip()
+    image_ref = request.json.get('imageHash', '').strip()
+    if role not in IMAGE_ROLES:
+        return response(code=1, message=f'图像引用失败，未知的图像类型{role}')
+    if 'hyper' not in session:
+        return response(code=1, message='图像引用失败，模型未装载')
+    if not image_store.exists(image_ref):
+        return response(code=1, message='图像引用失败，图像不存在，请重新上传')
+    session['hyper'][f'{role}_image'] = image_ref
+    session.modified = True
+    return response(code=0, message='图像引用成功', data={'imageHash': image_ref})
+
+
 @bp.route('/model/predict', methods=['GET'])
 def predict_model():
-    predict_drawer.remove_results()
-    model_manager.set_model_hyper(session['hyper'])
+    context = model_manager.build_context(session['hyper'], session.get('pool_key'), get_session_model_source())
+    if context.model_config is None:
+        return response(code=1, message='模型推断失败，模型未装载')
     start_time = datetime.datetime.now()
-    auto_labeling_result = model_manager.predict_shapes()
+    model_manager.predict_shapes(context)
     end_time = datetime.datetime.now()
-    predict_drawer.load_results(auto_labeling_result)
-    result_base64 = predict_drawer.get_result_img_base64()
+    if request.args.get('lean', type=int):  # 精简模式：结果图改为短时地址，按需渲染
+        return lean_predict_response(context, (end_time - start_time).total_seconds())
+    result_base64 = context.canvas.get_result_img_base64()
     data = {
         'resultBase64': result_base64,
-        'inferResult': predict_drawer.get_shape_dict(),
-        'inferDescription': predict_drawer.description,
+        'inferResult': context.canvas.get_shape_dict(),
+        'inferDescription': context.canvas.description,
         'inferPeriod': (end_time - start_time).total_seconds()
     }
-    return response(code=0, message='模型推断已完成', data=data)
\ No newline at end of file
+    return response(code=0, message='模型推断已完成', data=data)
+
+
+def lean_predict_response(context, period):
+    image_num, crop_num = result_renderer.get_image_num(context.canvas)
+    token = result_renderer.register(context.canvas, (context.hyper or {}).get('origin_image'))
+    data = {
+        'resultUrls': [url_for('.get_result_image', token=token, kind='image', index=i)
+                       for i in range(image_num)],
+        'cropUrls': [url_for('.get_result_image', token=token, kind='crop', index=i)
+                     for i in range(crop_num)],
+        'expiresIn': result_renderer.ttl,
+        'inferResult': context.canvas.get_shape_dict(),
+        'inferDescription': context.canvas.description,
+        'inferPeriod': period,
+    }
+    return response(code=0, message='模型推断已完成', data=data)
+
+
+@bp.route('/result/<token>/<kind>/<int:index>', methods=['GET'])
+@jwt_required(refresh=True)
+def get_result_image(token, kind, index):
+    """渲染结果图，format: webp/jpeg，maxSize限制长边；地址短时有效，访问时与推理接口一样需要登录"""
+    fmt = request.args.get('format', 'webp').lower()
+    max_size = request.args.get('maxSize', None, type=int)
+    if kind not in ['image', 'crop'] or fmt not in RENDER_FORMATS:
+        return response(code=1, message='获取结果图失败，参数错误'), 400
+    result = result_renderer.render(token, kind, index, fmt, max_size)
+    if result is None:
+        return response(code=1, message='获取结果图失败，结果已过期'), 404
+    data, mimetype = result
+    return send_file(io.BytesIO(data), mimetype=mimetype, max_age=result_renderer.ttl)
@@ -4,6 +4,8 @@
 
 
 bp = Blueprint('server', __name__, url_prefix='/server')
+# 服务就绪状态：开发模式直接就绪，生产入口(serve.py)在模型预热完成前置为未就绪
+readiness = {'ready': True, 'stage': 'serving', 'models': []}
 
 
 # 查看服务端Session
@@ -18,3 +20,11 @@ def session_data():
 def logout():
     session.clear()
     return response(code=200, message='清除session成功')
+
+
+# 就绪检查，未就绪时返回503供负载均衡/探针判断
+@bp.route('/ready', methods=['GET'])
+def ready():
+    if not readiness['ready']:
+        return response(code=1, data=readiness, message='服务未就绪'), 503
+    return response(code=0, data=readiness, message='服务已就绪')
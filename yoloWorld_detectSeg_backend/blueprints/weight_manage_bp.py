@@ -7,6 +7,7 @@
 from extensions import db
 from utils.backend_utils.response_utils import response
 from utils.backend_utils.colorprinter import *
+from work_flow.engines.artifact_registry import find_artifact, register_weight
 
 '''
 前后端code约定：
@@ -48,7 +49,8 @@ def get_weights():
         total = pagination.total  # 获取总数据量
     # 构造返回数据
     data = {
-        'list': [weight.to_dict_detail() for weight in weights],  # 转换为字典形式
+        'list': [dict(weight.to_dict_detail(), artifact=find_artifact(weight.local_path))
+                 for weight in weights],  # 转换为字典形式，附带文件登记信息
         'total': total,  # 总数据量
     }
     return response(code=0, data=data, message='获取权重列表成功')
@@ -68,7 +70,7 @@ def add_weight():
     weight = WeightModel(name=name, local_path=local_path, online_url=online_url, enable=enable)
     db.session.add(weight)
     db.session.commit()
-    return response(code=0, message='添加权重成功')
+    return artifact_response(weight, '添加权重成功')
 
 
 @bp.route('/delete/<int:weight_id>', methods=['DELETE'])
@@ -103,5 +105,24 @@ def update_weight():
     weight.online_url = online_url
     weight.enable = enable
     db.session.commit()
-    return response(code=0, message='修改权重成功')
+    return artifact_response(weight, '修改权重成功')
+
+
+@bp.route('/verify/<int:weight_id>', methods=['POST'])
+@jwt_required(refresh=True)
+def verify_weight(weight_id):
+    weight = WeightModel.query.get(weight_id)
+    if weight is None:
+        return response(code=1, message='校验失败，权重不存在')
+    return artifact_response(weight, '权重文件校验通过', force=True)
+
+
+def artifact_response(weight, message, force=False):
+    """登记并校验权重的本地文件，文件校验结果随响应返回"""
+    artifact = register_weight(weight, force=force)
+    if artifact is None:
+        return response(code=202, message=f'{message}，但本地文件不存在，未登记')
+    if not artifact['valid']:
+        return response(code=202, message=f"{message}，但文件校验失败：{artifact['error']}", data=artifact)
+    return response(code=0, message=message, data=artifact)
 
@@ -1,5 +1,6 @@
 import base64
 import time
+import config
 from platform import release
 
 import cv2
@@ -8,7 +9,9 @@
 from flask_jwt_extended import jwt_required
 from database_models import (WorkOrderModel, ReleaseModel, ExecuteModel, WeightModel, ServiceModel, ServiceLogModel, FlowModel)
 from utils.backend_utils.response_utils import response
-from work_flow.engines.model_manager import ModelManager
+from utils.backend_utils.image_fetcher import image_fetcher
+from utils.backend_utils.image_store import image_store
+from utils.backend_utils.clip_index import clip_retriever
 from utils.backend_utils.colorprinter import *
 import onnxruntime as ort
 import numpy as np
@@ -20,6 +23,7 @@
 from work_flow.flows.ppocr_v4_lama import PPOCRv4LAMA
 from work_flow.solutions import load_handler_class
 from work_flow.solutions.cook_handler import CookHandler
+from work_flow.solutions.audit_job import AuditJobManager
 from math import ceil
 '''
 前后端code约定：
@@ -37,8 +41,13 @@
 
 bp = Blueprint(name='work_order', import_name=__name__,url_prefix='/work_order')
 from work_flow.utils.canvas import Canvas
-predict_drawer = Canvas()
-model_manager = ModelManager()
+audit_job_manager = AuditJobManager(max_workers=config.AUDIT_WORKER_NUM, max_flow_sets=config.AUDIT_WORKER_FLOW_SETS,
+                                  dispatching=config.AUDIT_DISPATCH_IN_WEB)
+
+
+@bp.record_once
+def recover_audit_jobs(state):
+    audit_job_manager.init_app(state.app)
 
 @bp.route('/list')
 @jwt_required(refresh=True)
@@ -126,37 +135,103 @@ def switch_order(order_id):
     session['order'] = (order_id, service.name)
     return response(code=0, message='切换模型成功', data=data)
 
-@bp.route('/order/handler/infer',  methods=['GET'])
-@jwt_required(refresh=True)
-def infer():
-    # 从订单表中获取订单信息
-    #print(session['release'])
-    config = {}
+def build_handler_config():
+    """按会话中选择的版本/权重/参数组装各工作流的装载配置"""
+    handler_config = {}
     for flow_id, release_id in session['release'].items():
         flow = FlowModel.query.filter_by(id=flow_id).first()
         release = ReleaseModel.query.filter_by(id=release_id).first()
-        config[flow.name] = release.to_config
+        handler_config[flow.name] = release.to_config
         for key in release.weights:
             if key not in session['weight'][flow_id]:
-                return response(code=1, message=f'模型装载失败，权重选择不完整，缺少{key}')
-            #print(session['weight'][key])
+                raise ValueError(f'模型装载失败，权重选择不完整，缺少{key}')
             weight = WeightModel.query.filter_by(id=session['weight'][flow_id][key]).first()
-            config[flow.name][key] = weight.to_config
+            handler_config[flow.name][key] = weight.to_config
         if release.params is not None and release.params:
             if 'param' not in session or flow_id not in session['param']:
-                return response(code=1, message='模型装载失败，未设置配置')
-            #print(session['param'][flow_id])
-            config[flow.name].update(session['param'][flow_id])
+                raise ValueError('模型装载失败，未设置配置')
+            handler_config[flow.name].update(session['param'][flow_id])
+    return handler_config
 
-    handler = load_handler_class(session['order'][1])(config)
-    # handler.field_grab(session['order'][0])
-    # base = handler.origin['start_img'][0]
+
+@bp.route('/order/handler/infer',  methods=['GET'])
+@jwt_required(refresh=True)
+def infer():
+    # 从订单表中获取订单信息
+    try:
+        handler_config = build_handler_config()
+    except ValueError as e:
+        return response(code=1, message=str(e))
+
+    handler = load_handler_class(session['order'][1])(handler_config)
     log = handler.run(session['order'][0])
-    # log = {
-    #     'result': [{'field': 'field', 'msg': '测试1', 'type': 'warning'}],
-    #     # 'origin': [{'stage': 'start_img', 'id': 0, 'base64': base}]
-    # }
-    print(log)
+    return response(code=0, message='模型推断已完成', data=log)
+
+
+@bp.route('/order/similar', methods=['POST'])
+@jwt_required(refresh=True)
+def search_similar_orders():
+    """以图搜单：multipart字段image、已上传图像的imageHash或图像url三选一，返回语义最相似的k个历史工单"""
+    if not clip_retriever.enabled:
+        return response(code=1, message='未配置CLIP检索模型')
+    params = request.form if request.files else (request.get_json(silent=True) or {})
+    file = request.files.get('image')
+    try:
+        k = int(params.get('k', config.CLIP_INDEX_TOP_K))
+        exclude_order = int(params['orderId']) if params.get('orderId') not in (None, '') else None
+        if file is not None:
+            image = image_store.get(image_store.put_stream(file.stream))
+        elif params.get('imageHash'):
+            image = image_store.get(params['imageHash'].strip())
+        elif params.get('url'):
+            image = image_fetcher.load(params['url'].strip())
+        else:
+            return response(code=1, message='检索失败，缺少查询图像')
+        feats = clip_retriever.embed([image])
+        matches = clip_retriever.search(feats, k, exclude_order=exclude_order)[0]
+    except Exception as e:
+        return response(code=1, message=f'检索失败，{e}')
+    return response(code=0, message='检索成功', data=matches)
+
+
+@bp.route('/order/similar/info', methods=['GET'])
+@jwt_required(refresh=True)
+def get_similar_index_info():
+    return response(code=0, message='获取索引信息成功', data=clip_retriever.get_info())
+
+
+@bp.route('/order/handler/submit', methods=['POST'])
+@jwt_required(refresh=True)
+def submit_audit_job():
+    if 'order' not in session:
+        return response(code=1, message='提交审核失败，未选择工单')
+    try:
+        handler_config = build_handler_config()
+    except ValueError as e:
+        return response(code=1, message=str(e))
+    order_id, service_name = session['order']
+    job = audit_job_manager.submit(order_id, service_name, handler_config)
+    return response(code=0, message='审核任务已提交', data=job.to_dict())
+
+
+@bp.route('/order/handler/job/<int:job_id>', methods=['GET'])
+@jwt_required(refresh=True)
+def get_audit_job(job_id):
+    job = audit_job_manager.get_job(job_id)
+    if job is None:
+        return response(code=1, message='查询审核任务失败，该任务不存在')
+    return response(code=0, message='查询审核任务成功', data=job.to_dict())
+
+
+@bp.route('/order/handler/job/<int:job_id>/log', methods=['GET'])
+@jwt_required(refresh=True)
+def get_audit_job_log(job_id):
+    job = audit_job_manager.get_job(job_id)
+    if job is None:
+        return response(code=1, message='获取审核日志失败，该任务不存在')
+    log = audit_job_manager.get_job_log(job)
+    if log is None:
+        return response(code=1, message=f'获取审核日志失败，任务状态: {job.status}', data=job.to_dict())
     return response(code=0, message='模型推断已完成', data=log)
 
 @bp.route('/release/switch/<string:release_name>', methods=['POST'])
@@ -270,18 +345,12 @@ def get_current_param():
 
 # 下载图片并加载
 def load_image_from_url(image_url):
-    response = requests.get(image_url)
-    img = Image.open(BytesIO(response.content))
-    return img
+    return Image.fromarray(image_fetcher.load(image_url))
 
 # 预处理图片
 def preprocess_image(img):
-    response = requests.get(img)
-    # 使用 OpenCV 直接解码图像
-    image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-    # 将 BGR 转换为 RGB
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # 下载(或命中本地缓存)并解码为 RGB
+    image = image_fetcher.load(img)
     # 转换为 (3, H, W) 的形状
     image_input = np.transpose(image, (2, 0, 1))
     # 添加批量维度，变为 (1, 3, H, W)
@@ -330,12 +399,11 @@ def get_work_orderByid(order_id,service_id):
 
 # 推理图片
 def infer_picture(url,model):
-    resp = requests.get(url)
-    img = Image.open(BytesIO(resp.content))
-    img=np.array(img)
+    img = image_fetcher.load(url)
     start_time = datetime.datetime.now()
     result = model.predict_shapes(img)
     end_time = datetime.datetime.now()
+    predict_drawer = Canvas()  # 每次推理独占画布
     predict_drawer.load_results(result)
     resultImage = predict_drawer.draw()
     image = Image.fromarray(resultImage)
@@ -35,6 +35,73 @@
     'remote': REMOTE_DB_URI
 }
 
+# 常驻模型池内存预算（字节），超出后按最近最少使用淘汰
+MODEL_POOL_MAX_MEMORY = 8 * 1024 ** 3
+# 在线推理的动态微批：同一工作进程内并发请求的单图推理合并为一批（batch_window单位毫秒），
+# 默认不开启，由版本配置中的batching按模型开启(如 {'max_batch_size': 8, 'batch_window': 2})；
+# 此处设置后作为未配置batching的版本的默认值
+INFER_BATCHING = None
+
+# 工单审核任务工作进程数，以及每个工作进程常驻的工作流配置套数(超出后卸载最久未使用的一套)
+AUDIT_WORKER_NUM = 2
+AUDIT_WORKER_FLOW_SETS = 1
+# web进程是否自己执行审核任务：app.py单进程运行时为True；serve.py启动时置为False，由唯一的调度进程执行
+AUDIT_DISPATCH_IN_WEB = True
+
+# 生产部署（serve.py）：预装载的版本id列表（使用各权重键的首个权重与默认静态参数）与web工作进程数
+PRELOAD_RELEASES = []
+SERVE_WORKER_NUM = 4
+# 会话文件超过该时长(秒)未更新时删除；会话为共享文件，不能在请求中删除其他会话
+SESSION_FILE_MAX_AGE = 24 * 3600
+
+# 上传图像按内容寻址的存储目录与内存中常驻的已解码图像数
+IMAGE_STORE_DIR = './image_store'
+IMAGE_CACHE_NUM = 8
+
+# 工单图像下载：并发数、(连接, 读取)超时(秒)、失败重试次数，以及是否每次向服务器重新验证(ETag/Last-Modified)
+IMAGE_FETCH_WORKERS = 8
+IMAGE_FETCH_TIMEOUT = (5, 30)
+IMAGE_FETCH_RETRIES = 3
+IMAGE_FETCH_REVALIDATE = False
+
+# 服务者/服务对象人脸库目录与每个身份保留的特征数
+FACE_GALLERY_DIR = './face_gallery'
+FACE_GALLERY_MAX_PER_IDENTITY = 32
+# 默认只有头像入库；开启后工单中与身份高度相似且质量足够的人脸也会入库(origin='order'，可用FaceIndex.purge单独清除)，
+# 阈值须明显高于核验阈值，避免把误匹配的人脸写成该身份的基准
+FACE_ENROLL_FROM_ORDERS = False
+FACE_ENROLL_SIM_THRESHOLD = 0.85
+FACE_ENROLL_QUALITY_THRESHOLD = 0.75
+
+# 历史工单图像近重复索引目录与判定阈值(pHash、dHash的汉明距离均不超过该值)
+DUPLICATE_INDEX_DIR = './duplicate_index'
+DUPLICATE_MAX_DISTANCE = 8
+
+# 历史工单图像CLIP语义检索：索引目录、clip工作流配置文件(None为不启用)、编码批量、返回的工单数与判定为复用的相似度
+CLIP_INDEX_DIR = './clip_index'
+CLIP_INDEX_CONFIG = None
+CLIP_INDEX_BATCH_SIZE = 32
+CLIP_INDEX_TOP_K = 5
+CLIP_SIM_THRESHOLD = 0.92
+
+# 精简推理响应中结果图地址的有效期（秒）、渲染输入与结果的暂存目录(各web进程共享)与渲染线程数
+RESULT_URL_TTL = 60
+RESULT_RENDER_DIR = './result_render'
+RESULT_RENDER_WORKERS = 4
+
+# 推理结果缓存：内存中保留的结果数与磁盘层目录（None为不启用磁盘层）
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_DIR = None
+
+# SAM系列图像编码结果缓存：磁盘层目录、内存层与磁盘层的字节预算（磁盘预算为0时不落盘）
+EMBEDDING_CACHE_DIR = './embedding_cache'
+EMBEDDING_MEMORY_BYTES = 1 << 30
+EMBEDDING_DISK_BYTES = 8 << 30
+
+# CLIP文本特征缓存：目录与每个编码器保留的文本数（超出后按最近使用压缩）
+TEXT_FEATURE_CACHE_DIR = './text_feature_cache'
+TEXT_FEATURE_CACHE_MAX_TEXTS = 100000
+
 # 邮箱配置
 # 未配置邮箱账号以及授权码 如需使用请自行更改
 MAIL_SERVER = 'smtp.qq.com'
@@ -344,6 +344,35 @@ def to_dict(self):
             'dynamic': self.dynamic,
         }
 
+class AuditJobModel(db.Model):
+    __tablename__ = 'audit_job'
+    __bind_key__ = 'local'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True, comment='审核任务ID')
+    order_id = db.Column(db.Integer, nullable=False, comment='工单ID')
+    service_name = db.Column(db.String(100), nullable=False, comment='服务名称')
+    config = db.Column(db.JSON, nullable=False, comment='工作流装载配置')
+    status = db.Column(db.String(20), nullable=False, default='queued', comment='任务状态')
+    stage = db.Column(db.String(100), nullable=True, comment='当前阶段')
+    progress = db.Column(db.JSON, nullable=True, comment='各阶段进度')
+    result_path = db.Column(db.Text, nullable=True, comment='审核日志保存路径')
+    error = db.Column(db.Text, nullable=True, comment='错误信息')
+    create_time = db.Column(db.DateTime, default=datetime.now, comment='创建时间')
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, comment='更新时间')
+
+    def to_dict(self):
+        return {
+            'jobId': self.id,
+            'orderId': self.order_id,
+            'serviceName': self.service_name,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'error': self.error,
+            'createTime': self.create_time.strftime('%Y-%m-%d %H:%M:%S') if self.create_time else None,
+            'updateTime': self.update_time.strftime('%Y-%m-%d %H:%M:%S') if self.update_time else None,
+        }
+
+
 class ServiceModel(db.Model):
     __tablename__ = 'service'
     __bind_key__ = 'remote'
@@ -0,0 +1,105 @@
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+import config
+from utils.backend_utils.clip_index import clip_retriever
+from utils.backend_utils.duplicate_index import get_order_path, iter_order_images
+
+'''
+历史工单图像CLIP语义检索索引管理，在后端根目录下执行(需在config.CLIP_INDEX_CONFIG中配置clip工作流)：
+python -m scripts.clip_index build [--root 本地工单目录] [--stages middle_img] [--batch-size 64]
+python -m scripts.clip_index search --image a.jpg [--k 5]
+python -m scripts.clip_index info
+build遍历本地工单目录(默认BaseHandler.local_order_addr)下的 工单id/阶段/图像，已收录的工单跳过；
+多个工单的图像凑满一批后合并编码，再按工单、阶段追加写入索引
+'''
+
+
+def get_default_root():
+    from work_flow.solutions.base_handler import BaseHandler
+    return BaseHandler.local_order_addr
+
+
+def read_image(path):
+    """读取为RGB，与审核流程送入CLIP编码器的格式一致"""
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return None if image is None else cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def flush(pending):
+    """pending为 [(工单id, 阶段, 图像序号, 图像)]，合并编码后按 (工单, 阶段) 分组写入"""
+    if not pending:
+        return 0
+    feats = clip_retriever.embed([item[3] for item in pending])
+    groups = {}
+    for (order_id, stage, index, _), feat in zip(pending, feats):
+        groups.setdefault((order_id, stage), ([], []))
+        groups[(order_id, stage)][0].append(index)
+        groups[(order_id, stage)][1].append(feat)
+    return sum(clip_retriever.add(order_id, stage, indices, np.stack(group_feats))
+               for (order_id, stage), (indices, group_feats) in groups.items())
+
+
+def build(args):
+    root = args.root or get_default_root()
+    indexed = set() if args.rebuild else clip_retriever.load()[1].get_orders()
+    orders = sorted(name for name in os.listdir(root) if name.isdigit() and int(name) not in indexed)
+    start, num_images, pending = time.perf_counter(), 0, []
+    for i, order_id in enumerate(orders):
+        for stage in args.stages:
+            for index, (_, _, image) in enumerate(iter_order_images(get_order_path(root, order_id, stage))):
+                pending.append((int(order_id), stage, index, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+        if len(pending) >= args.batch_size:
+            num_images += flush(pending)
+            pending = []
+        if (i + 1) % 100 == 0:
+            print(f"{i + 1}/{len(orders)} 工单 {num_images} 张图像")
+    num_images += flush(pending)
+    period = time.perf_counter() - start
+    print(f"新增工单: {len(orders)} 图像: {num_images} 耗时: {period:.1f}s")
+    print(clip_retriever.get_info())
+
+
+def search(args):
+    image = read_image(args.image)
+    if image is None:
+        raise SystemExit(f"Could not read image: {args.image}")
+    feats = clip_retriever.embed([image])
+    clip_retriever.load()[1].refresh()  # 载入索引的时间不计入检索耗时
+    start = time.perf_counter()
+    matches = clip_retriever.search(feats, args.k)[0]
+    period = time.perf_counter() - start
+    for match in matches:
+        print(match)
+    print(f"检索耗时: {period * 1000:.2f}ms 索引信息: {clip_retriever.get_info()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the CLIP semantic index of order images")
+    parser.add_argument("command", choices=["build", "search", "info"])
+    parser.add_argument("--root", default=None, type=str, help="local order directory, default: BaseHandler.local_order_addr")
+    parser.add_argument("--stages", nargs="*", default=["middle_img"])
+    parser.add_argument("--batch-size", default=64, type=int, help="images embedded per flush")
+    parser.add_argument("--rebuild", action="store_true", help="also visit orders already in the index")
+    parser.add_argument("--image", default=None, type=str, help="query image of search")
+    parser.add_argument("--k", default=config.CLIP_INDEX_TOP_K, type=int)
+    args = parser.parse_args()
+
+    if not clip_retriever.enabled:
+        raise SystemExit("config.CLIP_INDEX_CONFIG is not set")
+    if args.command == "build":
+        build(args)
+    elif args.command == "search":
+        if not args.image:
+            raise SystemExit("--image is required for search")
+        search(args)
+    else:
+        print(clip_retriever.get_info())
+
+
+if __name__ == "__main__":
+    main()
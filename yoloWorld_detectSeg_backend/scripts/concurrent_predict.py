@@ -0,0 +1,91 @@
+import argparse
+import glob
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+'''
+并发推理正确性检查，在后端根目录下执行，无需启动服务：
+python -m scripts.concurrent_predict --config work_flow/configs/auto_labeling/yolov8s.yaml --images "data/*.jpg" --conf 0.25 0.5 0.7
+在进程内装载模型，为每个 (图像, 置信度阈值) 组合先串行推理得到参照结果，
+再用多个线程打乱顺序同时推理这些不同的输入，每个结果都须与自己的参照一致；
+若某个请求的超参数或输入串到了另一个请求上，结果就会与参照不同
+'''
+
+
+def put_images(pattern, limit):
+    from utils.backend_utils.image_store import image_store
+    refs = []
+    for path in sorted(glob.glob(pattern))[:limit]:
+        with open(path, 'rb') as f:
+            refs.append(image_store.put_bytes(f.read()))
+    return refs
+
+
+def build_inputs(refs, confs, output_modes):
+    inputs = []
+    for ref in refs:
+        for conf in confs:
+            for output_mode in output_modes:
+                hyper = {'origin_image': ref, 'conf_threshold': conf}
+                if output_mode:
+                    hyper['output_mode'] = output_mode
+                inputs.append(hyper)
+    return inputs
+
+
+def predict(model_manager, pool_key, hyper):
+    context = model_manager.build_context(dict(hyper), pool_key)
+    results = model_manager.predict_shapes(context)
+    return json.dumps([shape.to_dict() for shape in results.shapes], sort_keys=True, default=str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent predictions with different inputs do not interfere")
+    parser.add_argument("--config", required=True, type=str, help="model config yaml")
+    parser.add_argument("--images", required=True, type=str, help="glob of input images")
+    parser.add_argument("--limit", default=4, type=int)
+    parser.add_argument("--conf", nargs="*", type=float, default=[0.25, 0.5, 0.7], help="conf thresholds mixed across requests")
+    parser.add_argument("--output-modes", nargs="*", default=[""], help="output modes mixed across requests")
+    parser.add_argument("-n", "--num", default=8, type=int, help="number of threads")
+    parser.add_argument("--rounds", default=5, type=int, help="shuffled passes over all inputs")
+    args = parser.parse_args()
+
+    from work_flow.engines.model_manager import ModelManager
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        model_config = yaml.safe_load(f)
+    model_manager = ModelManager()
+    model_manager.model_configs[0] = model_config
+    pool_key = model_manager.load_model(0)['pool_key']
+    refs = put_images(args.images, args.limit)
+    if not refs:
+        raise SystemExit(f"No images matched: {args.images}")
+    inputs = build_inputs(refs, args.conf, args.output_modes)
+
+    start = time.perf_counter()
+    expected = [predict(model_manager, pool_key, hyper) for hyper in inputs]
+    serial = time.perf_counter() - start
+    print(f"输入组合数: {len(inputs)} 不同参照结果数: {len(set(expected))} 串行耗时: {serial:.2f}s")
+
+    rng = random.Random(0)
+    jobs = [i for _ in range(args.rounds) for i in range(len(inputs))]
+    rng.shuffle(jobs)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.num) as executor:
+        outputs = list(executor.map(lambda i: predict(model_manager, pool_key, inputs[i]), jobs))
+    period = time.perf_counter() - start
+    mismatched = [i for i, output in zip(jobs, outputs) if output != expected[i]]
+    print(f"并发请求数: {len(jobs)} 线程数: {args.num} 耗时: {period:.2f}s "
+          f"(串行等价 {serial * args.rounds:.2f}s) 与参照不一致: {len(mismatched)}")
+    for i in sorted(set(mismatched))[:10]:
+        print(f"  不一致的输入: conf={inputs[i]['conf_threshold']} output_mode={inputs[i].get('output_mode')}")
+    if mismatched:
+        raise SystemExit("并发推理结果与串行参照不一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import config
+
+'''
+推理接口并发正确性检查，在后端根目录下执行，无需数据库与模型文件：
+python -m scripts.concurrent_predict_app -n 8 --rounds 5
+在ModelManager中注册一个桩工作流，经Flask测试客户端请求 /infer/model/predict：
+每个线程持有自己的客户端与会话，会话中为不同的 (图像, 置信度阈值, 输出模式)，
+先串行请求得到每个组合的参照响应，再多线程打乱顺序同时请求，每个响应都须与自己的参照一致
+桩工作流的结果只取决于输入图像与阈值，并在推理中途休眠让请求交错：阈值、输出模式或图像串到另一个请求上时结果就会不同
+真实模型的并发检查见 scripts.concurrent_predict
+'''
+
+STUB_TYPE = 'concurrency_stub'
+STUB_MODEL_ID = -1  # 不与数据库中的版本id冲突
+GRID = 4
+
+
+class StubFlow:
+    """桩工作流：将图像分为GRID×GRID格，均值不低于阈值的格子输出为矩形，标签中带上推理开始时读到的阈值与输出模式"""
+
+    class Meta:
+        output_modes = {'rectangle': 'Rectangle', 'polygon': 'Polygon'}
+        default_output_mode = 'rectangle'
+
+    def __init__(self, model_config, on_message=None):
+        self.config = model_config
+        self.conf_thres = 0.5
+        self.output_mode = self.Meta.default_output_mode
+        self.delay = model_config.get('delay', 0.01)
+
+    def set_auto_labeling_conf(self, value):
+        self.conf_thres = value
+
+    def set_output_mode(self, mode):
+        self.output_mode = mode
+
+    def predict_shapes(self, image=None, **kwargs):
+        from work_flow.engines.types import AutoLabelingResult
+        from work_flow.utils.shape import Shape
+
+        conf, output_mode = self.conf_thres, self.output_mode
+        time.sleep(self.delay)  # 其他请求在此期间修改共享状态时，下面读到的值会与开始时不同
+        height, width = image.shape[:2]
+        shapes = []
+        for row in range(GRID):
+            for col in range(GRID):
+                y1, y2 = row * height // GRID, (row + 1) * height // GRID
+                x1, x2 = col * width // GRID, (col + 1) * width // GRID
+                score = float(image[y1:y2, x1:x2].mean()) / 255
+                if score < self.conf_thres:
+                    continue
+                shape = Shape(label=f'{row}-{col}@{conf}/{output_mode}', score=score, shape_type=self.output_mode)
+                for x, y in [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]:
+                    shape.add_point(x, y)
+                shapes.append(shape)
+        return AutoLabelingResult(shapes, replace=True)
+
+    def unload(self):
+        pass
+
+
+def register_stub(model_manager, delay):
+    """在ModelManager中装载桩工作流，返回其模型池主键"""
+    from work_flow.engines import model_module_map
+    from work_flow.engines.constant import conf_model_list
+
+    model_module_map[STUB_TYPE] = (__name__, 'StubFlow')
+    if STUB_TYPE not in conf_model_list:
+        conf_model_list.append(STUB_TYPE)
+    model_manager.model_configs[STUB_MODEL_ID] = {
+        'type': STUB_TYPE, 'name': STUB_TYPE, 'display_name': 'Concurrency stub', 'delay': delay}
+    model_manager.result_cache = None  # 结果缓存会掩盖并发推理中的串扰
+    return model_manager.load_model(STUB_MODEL_ID)['pool_key']
+
+
+def put_images(num, seed=0):
+    """生成不同尺寸与亮度的随机图像存入图像存储，返回引用"""
+    from utils.backend_utils.image_store import image_store
+
+    rng = np.random.default_rng(seed)
+    refs = []
+    for i in range(num):
+        height, width = rng.integers(64, 256, size=2)
+        image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        image = cv2.GaussianBlur(image, (0, 0), 8)  # 格子均值拉开差距，不同阈值得到不同结果
+        refs.append(image_store.put_bytes(cv2.imencode('.png', image)[1].tobytes()))
+    return refs
+
+
+def build_inputs(refs, confs, output_modes):
+    return [{'origin_image': ref, 'conf_threshold': conf, 'output_mode': output_mode}
+            for ref in refs for conf in confs for output_mode in output_modes]
+
+
+class Requester:
+    """每个线程一个测试客户端，请求前把该输入的超参数写入自己的会话"""
+
+    def __init__(self, app, pool_key):
+        self.app = app
+        self.pool_key = pool_key
+        self.local = threading.local()
+
+    def __call__(self, hyper):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['hyper'] = dict(hyper)
+            session['pool_key'] = self.pool_key
+        resp = client.get('/infer/model/predict')
+        body = resp.get_json()
+        if resp.status_code != 200 or body is None or body['code'] != 0:
+            return f'HTTP {resp.status_code}: {resp.get_data(as_text=True)[:200]}'
+        return json.dumps({'inferResult': body['data']['inferResult'],
+                           'resultBase64': body['data']['resultBase64']}, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent /infer/model/predict requests do not interfere")
+    parser.add_argument("--images", default=4, type=int, help="number of generated images")
+    parser.add_argument("--conf", nargs="*", type=float, default=[0.3, 0.5, 0.7], help="conf thresholds mixed across requests")
+    parser.add_argument("--output-modes", nargs="*", default=['rectangle', 'polygon'], help="output modes mixed across requests")
+    parser.add_argument("--delay", default=0.01, type=float, help="seconds the stub sleeps inside each inference")
+    parser.add_argument("-n", "--num", default=8, type=int, help="number of threads")
+    parser.add_argument("--rounds", default=5, type=int, help="shuffled passes over all inputs")
+    args = parser.parse_args()
+
+    config.AUDIT_DISPATCH_IN_WEB = False  # 须在导入app之前设置：检查不需要审核调度线程
+    from app import app
+    from blueprints.infer_bp import model_manager
+
+    pool_key = register_stub(model_manager, args.delay)
+    inputs = build_inputs(put_images(args.images), args.conf, args.output_modes)
+    requester = Requester(app, pool_key)
+
+    start = time.perf_counter()
+    expected = [requester(hyper) for hyper in inputs]
+    serial = time.perf_counter() - start
+    failed = [output for output in expected if output.startswith('HTTP')]
+    if failed:
+        raise SystemExit(f"串行请求失败: {failed[0]}")
+    print(f"输入组合数: {len(inputs)} 不同参照结果数: {len(set(expected))} 串行耗时: {serial:.2f}s")
+
+    rng = random.Random(0)
+    jobs = [i for _ in range(args.rounds) for i in range(len(inputs))]
+    rng.shuffle(jobs)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.num) as executor:
+        outputs = list(executor.map(lambda i: requester(inputs[i]), jobs))
+    period = time.perf_counter() - start
+    mismatched = [i for i, output in zip(jobs, outputs) if output != expected[i]]
+    print(f"并发请求数: {len(jobs)} 线程数: {args.num} 耗时: {period:.2f}s "
+          f"(串行等价 {serial * args.rounds:.2f}s) 与参照不一致: {len(mismatched)}")
+    for i in sorted(set(mismatched))[:10]:
+        print(f"  不一致的输入: conf={inputs[i]['conf_threshold']} output_mode={inputs[i]['output_mode']}")
+    if mismatched:
+        raise SystemExit("并发推理响应与串行参照不一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.backend_utils.duplicate_index import compute_hashes, duplicate_index, get_order_path, iter_order_images
+
+'''
+历史工单图像近重复索引管理，在后端根目录下执行：
+python -m scripts.duplicate_index build [--root 本地工单目录] [--stages middle_img] [--lama-config ppocr_v4_lama.yaml]
+python -m scripts.duplicate_index search --image a.jpg [--max-distance 8]
+python -m scripts.duplicate_index info
+build遍历本地工单目录(默认BaseHandler.local_order_addr)下的 工单id/阶段/图像，已收录的工单跳过；
+审核时检索的是去水印后的图像，指定--lama-config时入库前同样先去水印，否则按原图计算哈希
+'''
+
+
+def get_default_root():
+    from work_flow.solutions.base_handler import BaseHandler
+    return BaseHandler.local_order_addr
+
+
+def read_image(path):
+    return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def build(args):
+    root = args.root or get_default_root()
+    remover = None
+    if args.lama_config:
+        import logging
+        from work_flow.flows.ppocr_v4_lama import PPOCRv4LAMA
+        remover = PPOCRv4LAMA(args.lama_config, logging.info)
+
+    def hash_image(image):
+        if remover is not None:
+            result = remover.predict_shapes(image)
+            if result.image is not None:
+                image = result.image
+        return compute_hashes(image)
+
+    indexed = set() if args.rebuild else duplicate_index.get_orders()
+    orders = sorted(name for name in os.listdir(root) if name.isdigit() and int(name) not in indexed)
+    # 去水印模型不在线程间共享，只在纯哈希时并发
+    workers = 1 if remover is not None else args.workers
+    start, num_images = time.perf_counter(), 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, order_id in enumerate(orders):
+            for stage in args.stages:
+                images = [image for _, _, image in iter_order_images(get_order_path(root, order_id, stage))]
+                items = list(enumerate(executor.map(hash_image, images)))
+                num_images += duplicate_index.add(int(order_id), stage, items)
+            if (i + 1) % 100 == 0:
+                print(f"{i + 1}/{len(orders)} 工单 {num_images} 张图像")
+    period = time.perf_counter() - start
+    print(f"新增工单: {len(orders)} 图像: {num_images} 耗时: {period:.1f}s")
+    print(duplicate_index.get_info())
+
+
+def search(args):
+    image = read_image(args.image)
+    if image is None:
+        raise SystemExit(f"Could not read image: {args.image}")
+    hashes = compute_hashes(image)
+    duplicate_index.refresh()  # 载入索引的时间不计入检索耗时
+    start = time.perf_counter()
+    matches = duplicate_index.search(hashes=hashes, max_distance=args.max_distance)
+    period = time.perf_counter() - start
+    for match in matches[:args.top]:
+        print(match)
+    print(f"匹配数: {len(matches)} 检索耗时: {period * 1000:.2f}ms 索引记录数: {len(duplicate_index.records)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local near-duplicate index of order images")
+    parser.add_argument("command", choices=["build", "search", "info"])
+    parser.add_argument("--root", default=None, type=str, help="local order directory, default: BaseHandler.local_order_addr")
+    parser.add_argument("--stages", nargs="*", default=["middle_img"])
+    parser.add_argument("--lama-config", default=None, type=str, help="ppocr_v4_lama config, remove watermarks before hashing")
+    parser.add_argument("--workers", default=8, type=int)
+    parser.add_argument("--rebuild", action="store_true", help="also visit orders already in the index")
+    parser.add_argument("--image", default=None, type=str, help="query image of search")
+    parser.add_argument("--max-distance", default=None, type=int)
+    parser.add_argument("--top", default=20, type=int)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build(args)
+    elif args.command == "search":
+        if not args.image:
+            raise SystemExit("--image is required for search")
+        search(args)
+    else:
+        print(duplicate_index.get_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import glob
+import math
+import random
+import time
+
+import numpy as np
+
+'''
+工单人脸核验基准测试，在后端根目录下执行：
+python -m scripts.face_bench                                             只对比相似度计算(随机特征，无需模型)
+python -m scripts.face_bench --images "data/persons/*.jpg" --detector-config work_flow/configs/auto_labeling/yolov6lite_l_face.yaml --arcface-config arcface.yaml
+按工单模拟人脸数：每个工单3个阶段，每阶段若干图像，每张图像1~4个人物框，与服务者/服务对象两张头像比对
+loop为原实现(逐裁剪检测、逐人脸提取特征、512次循环的余弦相似度)，batch为FaceVerificationStage
+'''
+
+
+def sample_face_counts(orders, max_images, max_faces, seed=0):
+    """每个工单的人物框数：3个阶段 × 1~max_images张图像 × 1~max_faces个人物框"""
+    rng = random.Random(seed)
+    return [sum(rng.randint(1, max_faces) for _ in range(3 * rng.randint(1, max_images))) for _ in range(orders)]
+
+
+def loop_similarity(feat1, feat2):
+    """原ArcFace.predict_embeddings的逐元素循环"""
+    total, len1, len2 = 0.0, 0.0, 0.0
+    for i in range(512):
+        total += feat1[i] * feat2[i]
+        len1 += feat1[i] * feat1[i]
+        len2 += feat2[i] * feat2[i]
+    return total / math.sqrt(len1) / math.sqrt(len2)
+
+
+def bench_similarity(counts, repeat):
+    from work_flow.__base__.arcface import ArcFace
+
+    rng = np.random.default_rng(0)
+    orders = [(rng.standard_normal((n, 512)).astype(np.float32), rng.standard_normal((2, 512)).astype(np.float32))
+              for n in counts]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for feats, gallery in orders:
+            [[loop_similarity(avatar, feat) for avatar in gallery] for feat in feats]
+    loop_period = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for feats, gallery in orders:
+            ArcFace.similarity_matrix(feats, gallery)
+    batch_period = time.perf_counter() - start
+    pairs = sum(counts) * 2 * repeat
+    print(f"相似度 工单数: {len(counts)} 人脸数: {sum(counts)} 比对次数: {pairs}")
+    print(f"{'方式':<10}{'耗时':>11}{'比对/秒':>14}")
+    for name, period in (('loop', loop_period), ('batch', batch_period)):
+        print(f"{name:<10}{period:>10.4f}s{pairs / period:>14.0f}")
+
+
+def load_crops(pattern, limit):
+    import cv2
+    crops = []
+    for path in sorted(glob.glob(pattern))[:limit]:
+        image = cv2.imread(path)
+        if image is not None:
+            crops.append(image)
+    return crops
+
+
+def loop_pipeline(detector, embedder, crops):
+    """原实现：逐裁剪检测，取第一个人脸逐个提取特征"""
+    feats = []
+    for crop in crops:
+        results = detector.predict_shapes(crop)
+        if type(results) is not list and len(results.avatars) > 0:
+            feats.append(embedder.get_embedding(results.avatars[0]))
+    return feats
+
+
+def batch_pipeline(stage, crops):
+    faces = [face for face, _ in filter(None, stage.detect(crops))]
+    return stage.embed(faces)
+
+
+def bench_pipeline(args, counts):
+    from work_flow.flows.arcface import Arc_Face
+    from work_flow.flows.yolov6_face import YOLOv6Face
+    from work_flow.solutions.face_stage import FaceVerificationStage
+
+    crops = load_crops(args.images, args.limit)
+    if not crops:
+        raise SystemExit(f"No images matched: {args.images}")
+    detector = YOLOv6Face(args.detector_config, print)
+    embedder = Arc_Face(args.arcface_config, print)
+    stage = FaceVerificationStage(detector, embedder, max_crops=args.max_crops)
+    # 每个工单从裁剪集合中循环取出对应数量的人物框
+    orders = [[crops[(offset + i) % len(crops)] for i in range(n)] for offset, n in enumerate(counts)]
+    loop_pipeline(detector, embedder, orders[0])
+    batch_pipeline(stage, orders[0])
+    print(f"检测+特征 工单数: {len(orders)} 人物框数: {sum(counts)}")
+    print(f"{'方式':<10}{'人脸数':>8}{'耗时':>11}{'框/秒':>12}")
+    for name, run in (('loop', lambda order: loop_pipeline(detector, embedder, order)),
+                      ('batch', lambda order: batch_pipeline(stage, order))):
+        start = time.perf_counter()
+        num_faces = sum(len(run(order)) for order in orders)
+        period = time.perf_counter() - start
+        print(f"{name:<10}{num_faces:>8}{period:>10.2f}s{sum(counts) / period:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark order face verification: per-face loop vs batched stage")
+    parser.add_argument("--orders", default=20, type=int, help="number of simulated orders")
+    parser.add_argument("--max-images", default=3, type=int, help="max images per stage")
+    parser.add_argument("--max-faces", default=4, type=int, help="max person boxes per image")
+    parser.add_argument("--repeat", default=5, type=int, help="passes of the similarity benchmark")
+    parser.add_argument("--images", default=None, type=str, help="glob of person crops, enables the model benchmark")
+    parser.add_argument("--limit", default=64, type=int)
+    parser.add_argument("--detector-config", default="work_flow/configs/auto_labeling/yolov6lite_l_face.yaml")
+    parser.add_argument("--arcface-config", default=None, type=str)
+    parser.add_argument("--max-crops", default=16, type=int)
+    args = parser.parse_args()
+
+    counts = sample_face_counts(args.orders, args.max_images, args.max_faces)
+    bench_similarity(counts, args.repeat)
+    if args.images:
+        if not args.arcface_config:
+            raise SystemExit("--arcface-config is required with --images")
+        bench_pipeline(args, counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import glob
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+import requests
+from PIL import Image
+
+'''
+工单图像下载基准测试，在后端根目录下执行：
+python -m scripts.image_fetch_bench serve --root data --latency 0.1 --port 8765     只启动本地模拟图床
+python -m scripts.image_fetch_bench bench --images "data/*.jpg" --latency 0.1       启动模拟图床并对比各下载方式
+模拟图床为每个请求增加固定延迟(可加随机抖动与503失败率)，返回ETag并支持304，用于离线测试吞吐
+'''
+
+
+def build_handler(root, latency, jitter, fail_rate):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency + random.uniform(0, jitter))
+            path = os.path.join(root, os.path.basename(self.path.split('?')[0]))
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            if random.random() < fail_rate:
+                self.send_error(503)
+                return
+            with open(path, 'rb') as f:
+                data = f.read()
+            etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandInHandler
+
+
+def serve(root, latency, port=0, jitter=0.0, fail_rate=0.0):
+    """后台线程启动模拟图床，返回 (server, 根地址)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), build_handler(root, latency, jitter, fail_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def sequential_load(urls):
+    """原实现：逐个requests.get，无连接复用"""
+    images = []
+    for url in urls:
+        response = requests.get(url)
+        response.raise_for_status()
+        images.append(np.array(Image.open(BytesIO(response.content))))
+    return images
+
+
+def timed(name, func, urls):
+    start = time.perf_counter()
+    images = func(urls)
+    period = time.perf_counter() - start
+    print(f"{name:<24}{len(images):>8}{period:>10.2f}s{len(urls) / period:>12.1f}")
+    return period
+
+
+def bench(args):
+    from utils.backend_utils.image_fetcher import ImageFetcher
+    from utils.backend_utils.image_store import ImageStore
+
+    paths = sorted(glob.glob(args.images))[:args.limit]
+    if not paths:
+        raise SystemExit(f"No images matched: {args.images}")
+    root = tempfile.mkdtemp(prefix='image_fetch_bench_')
+    try:
+        served = os.path.join(root, 'served')
+        os.makedirs(served)
+        for path in paths:
+            shutil.copy(path, served)
+        server, base_url = serve(served, args.latency, jitter=args.jitter, fail_rate=args.fail_rate)
+        urls = [f"{base_url}/{os.path.basename(path)}" for path in paths]
+
+        store = ImageStore(os.path.join(root, 'store'), cache_num=len(urls))
+        fetcher = ImageFetcher(store, os.path.join(root, 'urls'), max_workers=args.workers,
+                               retries=args.retries)
+        print(f"图像数: {len(urls)} 延迟: {args.latency}s 并发数: {args.workers}")
+        print(f"{'方式':<24}{'成功数':>8}{'耗时':>11}{'张/秒':>12}")
+        if args.fail_rate == 0:  # 原实现没有重试，存在失败率时不参与对比
+            timed('sequential requests', sequential_load, urls)
+        timed('fetcher cold', fetcher.load_many, urls)
+        store.decoded = type(store.decoded)(maxsize=len(urls))  # 清空已解码缓存，只保留磁盘内容
+        timed('fetcher disk cache', fetcher.load_many, urls)
+        fetcher.revalidate = True
+        timed('fetcher revalidate', fetcher.load_many, urls)
+        print(fetcher.get_info())
+        server.shutdown()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark order image fetching against a local stand-in server")
+    parser.add_argument("command", choices=["serve", "bench"])
+    parser.add_argument("--root", default=".", type=str, help="directory served by the stand-in server")
+    parser.add_argument("--images", default="data/*.jpg", type=str, help="glob of images to serve in bench")
+    parser.add_argument("--limit", default=64, type=int)
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--latency", default=0.1, type=float, help="seconds added to every request")
+    parser.add_argument("--jitter", default=0.0, type=float, help="extra random latency upper bound")
+    parser.add_argument("--fail-rate", default=0.0, type=float, help="probability of answering 503")
+    parser.add_argument("--workers", default=8, type=int)
+    parser.add_argument("--retries", default=3, type=int)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server, base_url = serve(args.root, args.latency, args.port, args.jitter, args.fail_rate)
+        print(f"Serving {os.path.abspath(args.root)} at {base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import os
+import time
+
+from work_flow.engines import OnnxBaseModel, model_module_map
+from work_flow.engines.ort_cache import ORT_CACHE_DIR, clear_cache, list_cache
+
+'''
+ORT优化图缓存管理，在后端根目录下执行：
+python -m scripts.ort_cache info                       查看缓存
+python -m scripts.ort_cache clear [--model a.onnx]     清空全部或指定模型的缓存
+python -m scripts.ort_cache bench [--model a.onnx]     对比冷/热装载耗时，不指定模型时按数据库中各工作流版本的onnx权重测试
+'''
+
+
+def get_release_models():
+    """从本地数据库收集 model_module_map 中已注册工作流所用的onnx权重"""
+    from flask import Flask
+    import config
+    from extensions import db
+    from database_models import ReleaseModel, FlowModel, WeightModel
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    models = []
+    with app.app_context():
+        for release in ReleaseModel.query.all():
+            flow = FlowModel.query.get(release.flow_id)
+            if flow is None or flow.name not in model_module_map:
+                continue
+            for release_weight in release.release_weights:
+                weight = WeightModel.query.get(release_weight.weight_id)
+                if weight is not None and weight.local_path and weight.local_path.lower().endswith('.onnx') \
+                        and os.path.isfile(weight.local_path):
+                    models.append((f"{flow.name}/{release.name}/{release_weight.name}", weight.local_path))
+    return models
+
+
+def time_load(model_path, device, use_cache=True):
+    start = time.perf_counter()
+    net = OnnxBaseModel(model_path, device, use_cache=use_cache)
+    period = time.perf_counter() - start
+    del net
+    return period
+
+
+def bench(models, device, repeat):
+    print(f"{'模型':<60}{'无缓存':>10}{'冷启动':>10}{'热启动':>10}{'加速比':>10}")
+    for name, model_path in models:
+        no_cache = time_load(model_path, device, use_cache=False)
+        clear_cache(model_path)
+        cold = time_load(model_path, device)  # 本次装载同时写入缓存
+        warm = min(time_load(model_path, device) for _ in range(repeat))
+        print(f"{name:<60}{no_cache:>9.2f}s{cold:>9.2f}s{warm:>9.2f}s{no_cache / warm:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the ORT optimized graph cache")
+    parser.add_argument("command", choices=["info", "clear", "bench"])
+    parser.add_argument("--model", nargs="*", default=None, help="onnx model paths, default: all")
+    parser.add_argument("--device", default="CPU", type=str, help="CPU or GPU")
+    parser.add_argument("--repeat", default=3, type=int, help="warm load repeats")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        caches = list_cache()
+        for cache in caches:
+            print(f"{cache['file']}  {cache['size'] / 1024 ** 2:.1f}MB")
+        print(f"缓存目录: {ORT_CACHE_DIR} 共{len(caches)}个")
+    elif args.command == "clear":
+        if args.model:
+            removed = sum(clear_cache(model_path) for model_path in args.model)
+        else:
+            removed = clear_cache()
+        print(f"已删除{removed}个缓存")
+    else:
+        models = [(os.path.basename(p), p) for p in args.model] if args.model else get_release_models()
+        bench(models, args.device, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+'''
+全图自动分割基准测试，在后端根目录下执行：
+python -m scripts.sam_amg_bench --encoder enc.onnx --decoder dec.onnx --images "data/*.jpg"
+numpy为新的SamAutomaticMaskEngine，torch为原SamAutomaticMaskGenerator
+每种实现在独立子进程中运行，峰值内存(RSS)互不影响
+'''
+
+ENGINES = ["numpy", "torch"]
+
+
+def load_images(pattern, limit):
+    import cv2
+    images = []
+    for path in sorted(glob.glob(pattern))[:limit]:
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((os.path.basename(path), cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+    return images
+
+
+def build_engine(engine, args):
+    kwargs = dict(points_per_side=args.points_per_side, crop_n_layers=args.crop_n_layers)
+    if engine == "numpy":
+        from work_flow.__base__.sam_amg import SamAutomaticMaskEngine
+        return SamAutomaticMaskEngine(args.encoder, args.decoder, num_workers=args.workers, **kwargs)
+    from work_flow.__base__.sam import SamAutomaticMaskGenerator
+    return SamAutomaticMaskGenerator(args.encoder, args.decoder, **kwargs)
+
+
+def run_engine(engine, args):
+    """子进程内执行：先预热一张图，再计时全部图像，输出一行json"""
+    images = load_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"no image matched {args.images}")
+    model = build_engine(engine, args)
+    model.predict_masks(images[0][1])
+    num_masks = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for _, image in images:
+            num_masks += len(model.predict_masks(image))
+    period = time.perf_counter() - start
+    # Linux下ru_maxrss单位为KB
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"engine": engine, "images": len(images) * args.repeat, "masks": num_masks,
+                      "seconds": period, "peak_rss_mb": peak_rss}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark automatic mask generation engines")
+    parser.add_argument("--encoder", required=True, type=str, help="SAM encoder onnx path")
+    parser.add_argument("--decoder", required=True, type=str, help="SAM decoder onnx path")
+    parser.add_argument("--images", required=True, type=str, help="image glob pattern, e.g. 'data/*.jpg'")
+    parser.add_argument("--limit", default=10, type=int, help="max number of images")
+    parser.add_argument("--repeat", default=1, type=int, help="passes over the image set")
+    parser.add_argument("--points-per-side", default=32, type=int)
+    parser.add_argument("--crop-n-layers", default=0, type=int)
+    parser.add_argument("--workers", default=None, type=int, help="worker threads of the numpy engine")
+    parser.add_argument("--engine", choices=ENGINES + ["both"], default="both")
+    args = parser.parse_args()
+
+    if args.engine != "both":
+        run_engine(args.engine, args)
+        return
+
+    print(f"{'实现':<10}{'图像数':>8}{'掩码数':>8}{'耗时':>10}{'掩码/秒':>10}{'峰值RSS':>12}")
+    for engine in ENGINES:
+        cmd = [sys.executable, "-m", "scripts.sam_amg_bench", "--engine", engine] + \
+            [arg for arg in sys.argv[1:] if arg not in ("--engine", "both")]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{engine:<10}{result['images']:>8}{result['masks']:>8}{result['seconds']:>9.2f}s"
+              f"{result['masks'] / result['seconds']:>10.1f}{result['peak_rss_mb']:>10.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+
+# 须在导入推理后端之前设置：预装载后fork，各工作进程以单线程推理，并行度来自进程数
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+os.environ.setdefault('ORT_INTRA_OP_NUM_THREADS', '1')
+
+import argparse
+import logging
+import signal
+import socketserver
+import threading
+
+from werkzeug.serving import make_server
+
+import config
+
+config.AUDIT_DISPATCH_IN_WEB = False  # 须在导入app之前设置：web工作进程只落库审核任务，由唯一的调度进程执行
+
+from app import app, test_database_connection
+from extensions import db
+from database_models import ReleaseModel
+from blueprints.server_bp import readiness
+from blueprints.infer_bp import model_manager, build_release_config
+from blueprints.work_order_bp import audit_job_manager
+
+'''
+生产部署入口（仅限支持fork的系统）
+1. 监听端口并开始响应，预热完成前 /server/ready 返回503
+2. 主进程通过ModelManager预装载配置中的版本，并以空白图像预热
+3. fork出N个web工作进程，模型权重所在内存页按写时复制在进程间共享
+4. 另fork一个审核调度进程，持有唯一的审核进程池；web工作进程提交审核只落库，由调度进程轮询执行，
+   审核并发数在整个部署内不超过AUDIT_WORKER_NUM
+模型池在各工作进程内存中，会话为共享文件：fork后经/model/load装载的模型只存在于处理该请求的工作进程，
+会话同时记录版本id、权重id与静态参数，推理请求落到没有该模型的工作进程时按这些参数在该进程中装载(首次请求较慢)，
+常用版本应加入预装载列表
+开发调试仍使用 python app.py
+'''
+
+
+def preload(release_ids):
+    """预装载并预热版本，返回各版本的装载结果"""
+    results = []
+    with app.app_context():
+        for release_id in release_ids:
+            release = ReleaseModel.query.get(release_id)
+            if release is None:
+                logging.warning(f"Preload skipped, release {release_id} not found")
+                continue
+            readiness['stage'] = f'loading {release.name}'
+            model_manager.load_model_config(release)
+            weight_ids = {key: ids[0] for key, ids in release.weights.items()}
+            try:
+                model_config = build_release_config(release, weight_ids, release.params)
+            except ValueError as e:
+                logging.warning(f"Preload of {release.name} skipped: {e}")
+                continue
+            loaded_model_config = model_manager.load_model(release_id, model_config, weight_ids=weight_ids)
+            if loaded_model_config is None:
+                results.append({'releaseId': release_id, 'name': release.name, 'loaded': False, 'warm': False})
+                continue
+            readiness['stage'] = f'warming {release.name}'
+            warm = model_manager.warm_up(loaded_model_config['pool_key'])
+            results.append({'releaseId': release_id, 'name': release.name, 'loaded': True, 'warm': warm})
+    return results
+
+
+def reset_child():
+    """子进程：恢复默认信号处理并重建数据库连接"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)  # 父进程的连接不能跨进程复用
+
+
+def serve_worker(server):
+    """web工作进程：处理请求"""
+    reset_child()
+    server.serve_forever()
+
+
+def serve_dispatcher():
+    """审核调度进程：轮询web工作进程落库的审核任务，交给审核进程池执行"""
+    reset_child()
+    audit_job_manager.serve_forever(app)
+
+
+def fork_process(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            target(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Production server: preload models, then fork workers")
+    parser.add_argument("--host", default="0.0.0.0", type=str, help="bind address")
+    parser.add_argument("--port", default=5555, type=int, help="port number")
+    parser.add_argument("--workers", default=config.SERVE_WORKER_NUM, type=int, help="web worker processes")
+    parser.add_argument("--release", nargs="*", type=int, default=None,
+                        help="release ids to preload, default: config.PRELOAD_RELEASES")
+    args = parser.parse_args()
+    if not hasattr(os, 'fork'):
+        raise SystemExit("serve.py requires fork(), use app.py on this platform")
+    logging.basicConfig(level=logging.INFO)
+
+    test_database_connection()
+    server = make_server(args.host, args.port, app, threaded=True)
+    # 预热期间由临时线程响应就绪检查；调用socketserver原始的serve_forever，避免werkzeug退出时关闭监听套接字
+    readiness.update(ready=False, stage='starting')
+    warmup_thread = threading.Thread(
+        target=socketserver.BaseServer.serve_forever, args=(server,), daemon=True)
+    warmup_thread.start()
+
+    release_ids = args.release if args.release is not None else config.PRELOAD_RELEASES
+    readiness['models'] = preload(release_ids)
+    server.shutdown()
+    warmup_thread.join()  # fork前只保留主线程
+    readiness.update(ready=True, stage='serving')
+    logging.info(f"Preloaded {len(readiness['models'])} releases, forking {args.workers} workers")
+
+    workers = {fork_process(serve_worker, server) for _ in range(args.workers)}
+    dispatcher = fork_process(serve_dispatcher)
+    workers.add(dispatcher)
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if stopping:
+            continue
+        logging.warning(f"Worker {pid} exited with status {status}, restarting")
+        if pid == dispatcher:
+            dispatcher = fork_process(serve_dispatcher)
+            workers.add(dispatcher)
+        else:
+            workers.add(fork_process(serve_worker, server))
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1049,6 +1049,26 @@ INSERT INTO `argument` VALUES (1009, 'origin_image', 'base64', 'null', 'null', 1
 INSERT INTO `argument` VALUES (1010, 'minor_image', 'base64', 'null', 'null', 1, 157);
 INSERT INTO `argument` VALUES (1011, 'mode', 'select', '\"hash\"', '{\"options\": [\"hash\", \"saturation\"], \"multiple\": false, \"clearable\": false}', 1, 157);
 
+-- ----------------------------
+-- Table structure for audit_job
+-- ----------------------------
+DROP TABLE IF EXISTS `audit_job`;
+CREATE TABLE `audit_job`  (
+  `id` int NOT NULL AUTO_INCREMENT COMMENT '审核任务ID',
+  `order_id` int NOT NULL COMMENT '工单ID',
+  `service_name` varchar(100) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL COMMENT '服务名称',
+  `config` json NOT NULL COMMENT '工作流装载配置',
+  `status` varchar(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL COMMENT '任务状态',
+  `stage` varchar(100) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL DEFAULT NULL COMMENT '当前阶段',
+  `progress` json NULL COMMENT '各阶段进度',
+  `result_path` text CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL COMMENT '审核日志保存路径',
+  `error` text CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL COMMENT '错误信息',
+  `create_time` datetime NULL DEFAULT NULL COMMENT '创建时间',
+  `update_time` datetime NULL DEFAULT NULL COMMENT '更新时间',
+  PRIMARY KEY (`id`) USING BTREE,
+  INDEX `audit_job_status`(`status` ASC) USING BTREE
+) ENGINE = InnoDB AUTO_INCREMENT = 1 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = DYNAMIC;
+
 -- ----------------------------
 -- Table structure for captcha
 -- ----------------------------
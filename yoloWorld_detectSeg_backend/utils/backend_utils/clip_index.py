@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+import config
+from utils.backend_utils.file_lock import FileLock
+
+'''
+历史工单图像的CLIP语义检索
+- 图像特征(归一化后)以float16矩阵追加写入vectors.f16，查询时以内存映射方式打开，分块转为float32做矩阵乘法
+- ids.bin与特征矩阵逐行对应，记录 (工单id, 阶段, 图像序号)；两个文件在跨进程文件锁内追加，读取时取两者行数的较小值
+- 每张图像取所在工单作为结果单位：相似度最高的若干图像按工单去重后返回top-k工单及其最相似的图像
+- 索引按图像编码器权重的sha256分目录，更换模型后不会与旧特征混用
+'''
+
+ID_DTYPE = np.dtype([
+    ('order_id', '<i8'),
+    ('stage', 'u1'),
+    ('index', '<u2'),
+])
+STAGES = ('start_img', 'middle_img', 'end_img')
+
+
+class ClipImageIndex:
+    CHUNK_ROWS = 65536  # 分块读取特征矩阵的行数
+
+    def __init__(self, root, dim, stages=STAGES):
+        self.root = root
+        self.dim = dim
+        self.stages = list(stages)
+        self.vectors_path = os.path.join(root, 'vectors.f16')
+        self.ids_path = os.path.join(root, 'ids.bin')
+        self.lock_path = os.path.join(root, 'lock')
+        self.lock = threading.RLock()
+        self.num = 0
+        self.vectors = None  # 内存映射的特征矩阵[num, dim]
+        self.ids = np.zeros(0, dtype=ID_DTYPE)
+        self.keys = set()
+
+    def count_rows(self):
+        row_bytes = self.dim * 2
+        num_vectors = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        num_ids = os.path.getsize(self.ids_path) // ID_DTYPE.itemsize if os.path.exists(self.ids_path) else 0
+        return num_vectors, num_ids
+
+    def refresh(self):
+        """读取其他进程追加的行"""
+        with self.lock:
+            num = min(self.count_rows())
+            if num == self.num:
+                return
+            if num < self.num:  # 索引被清空或重建
+                self.num, self.ids, self.keys = 0, np.zeros(0, dtype=ID_DTYPE), set()
+            with open(self.ids_path, 'rb') as f:
+                f.seek(self.num * ID_DTYPE.itemsize)
+                ids = np.frombuffer(f.read((num - self.num) * ID_DTYPE.itemsize), dtype=ID_DTYPE)
+            self.ids = np.concatenate([self.ids, ids])
+            self.keys.update(zip(ids['order_id'].tolist(), ids['stage'].tolist(), ids['index'].tolist()))
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(num, self.dim))
+            self.num = num
+
+    def add(self, order_id, stage, indices, feats):
+        """追加一个工单某阶段的图像特征，indices为图像序号，feats[N, dim]；已收录的图像跳过"""
+        stage_code = self.stages.index(stage)
+        feats = np.atleast_2d(np.asarray(feats, dtype=np.float32))
+        feats = feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+        with self.lock, FileLock(self.lock_path):
+            self.refresh()
+            keep = [i for i, index in enumerate(indices) if (int(order_id), stage_code, int(index)) not in self.keys]
+            if not keep:
+                return 0
+            num_vectors, num_ids = self.count_rows()
+            if num_vectors != num_ids:  # 上次写入中断，丢弃未配对的行
+                self.vectors = None
+                row_bytes = self.dim * 2
+                os.truncate(self.vectors_path, num_ids * row_bytes)
+                os.truncate(self.ids_path, num_ids * ID_DTYPE.itemsize)
+            ids = np.zeros(len(keep), dtype=ID_DTYPE)
+            ids['order_id'] = int(order_id)
+            ids['stage'] = stage_code
+            ids['index'] = [int(indices[i]) for i in keep]
+            with open(self.vectors_path, 'ab') as f:
+                f.write(feats[keep].astype(np.float16).tobytes())
+            with open(self.ids_path, 'ab') as f:
+                f.write(ids.tobytes())
+            self.refresh()
+        return len(keep)
+
+    def scores(self, feats):
+        """feats[Q, dim]与全部历史图像的相似度[Q, num]"""
+        with self.lock:
+            self.refresh()
+            vectors, num = self.vectors, self.num
+        feats = np.atleast_2d(np.asarray(feats, dtype=np.float32))
+        feats = feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+        scores = np.empty((len(feats), num), dtype=np.float32)
+        for start in range(0, num, self.CHUNK_ROWS):
+            block = np.asarray(vectors[start:start + self.CHUNK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = feats @ block.T
+        return scores
+
+    def search(self, feats, k=5, exclude_order=None):
+        """每个查询特征返回最相似的k个历史工单 [[{'order_id', 'stage', 'index', 'score'}]]，按相似度降序"""
+        scores = self.scores(feats)
+        with self.lock:
+            ids = self.ids[:scores.shape[1]]
+        if exclude_order is not None:
+            scores[:, ids['order_id'] == int(exclude_order)] = -np.inf
+        return [self.top_orders(row, ids, k) for row in scores]
+
+    def top_orders(self, scores, ids, k):
+        """先取相似度最高的若干图像按工单去重，工单数不足k时扩大候选范围"""
+        num = len(scores)
+        if num == 0:
+            return []
+        size = min(num, k * 16)
+        while True:
+            top = np.argpartition(-scores, size - 1)[:size]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            top = top[np.isfinite(scores[top])]
+            _, first = np.unique(ids['order_id'][top], return_index=True)
+            if len(first) >= k or size == num:
+                break
+            size = min(num, size * 4)
+        return [{
+            'order_id': int(ids['order_id'][i]),
+            'stage': self.stages[ids['stage'][i]],
+            'index': int(ids['index'][i]),
+            'score': float(scores[i]),
+        } for i in top[np.sort(first)][:k]]
+
+    def get_orders(self):
+        with self.lock:
+            self.refresh()
+            return set(np.unique(self.ids['order_id']).tolist())
+
+    def get_info(self):
+        with self.lock:
+            self.refresh()
+            return {
+                'images': self.num,
+                'orders': len(np.unique(self.ids['order_id'])),
+                'dim': self.dim,
+                'bytes': self.num * (self.dim * 2 + ID_DTYPE.itemsize),
+            }
+
+
+class ClipRetriever:
+    """部署级的CLIP检索：按配置装载clip工作流，图像编码与索引读写都经由这里"""
+
+    def __init__(self, root, model_config=None, max_batch_size=32):
+        self.root = root
+        self.model_config = model_config
+        self.max_batch_size = max_batch_size
+        self.model = None
+        self.index = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.model_config is not None
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                from work_flow.engines import load_model_class
+                from work_flow.engines.artifact_registry import file_sha256
+                model = load_model_class('clip')(self.model_config, logging.info)
+                img_net = model.model.img_net
+                dim = img_net.ort_session.get_outputs()[0].shape[-1]
+                if not isinstance(dim, int):  # 输出维度为动态时以配置为准
+                    dim = model.config.get('embedding_dim', 512)
+                namespace = file_sha256(img_net.model_path)[:16]
+                self.index = ClipImageIndex(os.path.join(self.root, namespace), dim)
+                self.model = model
+        return self.model, self.index
+
+    def embed(self, images):
+        """RGB图像列表合并推理，返回归一化特征[N, D]"""
+        model, _ = self.load()
+        return model.model.img_batch_pipeline(images, self.max_batch_size)
+
+    def search(self, feats, k=5, exclude_order=None):
+        _, index = self.load()
+        return index.search(feats, k, exclude_order)
+
+    def add(self, order_id, stage, indices, feats):
+        _, index = self.load()
+        return index.add(order_id, stage, indices, feats)
+
+    def get_info(self):
+        if not self.enabled:
+            return {'enabled': False}
+        _, index = self.load()
+        return dict(index.get_info(), enabled=True)
+
+
+clip_retriever = ClipRetriever(config.CLIP_INDEX_DIR, config.CLIP_INDEX_CONFIG, config.CLIP_INDEX_BATCH_SIZE)
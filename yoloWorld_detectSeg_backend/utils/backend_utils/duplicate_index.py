@@ -0,0 +1,213 @@
+import itertools
+import logging
+import os
+import threading
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+
+import config
+
+'''
+历史工单图像的近重复检索(替代远程相似图检索接口)
+- 每张图像保存64位pHash与64位dHash，连同工单id、阶段、图像序号为一条定长记录，追加写入records.bin
+- pHash按16位分为4段建立多索引哈希：汉明距离不超过r的两个哈希至少有一段距离不超过r//4，
+  每段枚举该半径内的全部取值后在排序数组上二分查找候选，再用完整的pHash与dHash距离复核
+- 新记录先放在未排序的尾部，查询时直接比较，累计到一定数量后并入排序表
+- 多进程共享同一文件，查询前按文件大小读取其他进程追加的记录
+'''
+
+RECORD_DTYPE = np.dtype([
+    ('phash', '<u8'),
+    ('dhash', '<u8'),
+    ('order_id', '<i8'),
+    ('stage', 'u1'),
+    ('index', '<u2'),
+])
+NUM_CHUNKS = 4
+CHUNK_BITS = 16
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hash_to_int(image_hash):
+    return int(str(image_hash), 16)
+
+
+def compute_hashes(image):
+    """BGR图像的 (pHash, dHash)，与PixelAnalysis相同使用imagehash计算"""
+    pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return hash_to_int(imagehash.phash(pil_image)), hash_to_int(imagehash.dhash(pil_image))
+
+
+def hamming(hashes, value):
+    """hashes[N](uint64)与value的汉明距离[N]"""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return POPCOUNT[xor.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def chunk_variants(value, radius):
+    """与16位value汉明距离不超过radius的全部取值"""
+    variants = [value]
+    frontier = [(value, -1)]
+    for _ in range(radius):
+        next_frontier = []
+        for current, last in frontier:
+            for bit in range(last + 1, CHUNK_BITS):
+                flipped = current ^ (1 << bit)
+                variants.append(flipped)
+                next_frontier.append((flipped, bit))
+        frontier = next_frontier
+    return np.asarray(variants, dtype=np.uint64)
+
+
+class DuplicateIndex:
+    MERGE_SIZE = 4096  # 未排序尾部达到该数量后并入排序表
+
+    def __init__(self, root, stages=('start_img', 'middle_img', 'end_img'), max_distance=8):
+        self.path = os.path.join(root, 'records.bin')
+        self.stages = list(stages)
+        self.max_distance = max_distance
+        self.lock = threading.RLock()
+        self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        self.offset = 0
+        self.inode = None
+        self.sorted_num = 0  # records[:sorted_num]已建立分段排序表
+        self.tables = []  # 每段 (排序后的段值, 对应的记录下标)
+
+    def refresh(self):
+        with self.lock:
+            if not os.path.exists(self.path):
+                return
+            stat = os.stat(self.path)
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.records, self.offset, self.inode = np.zeros(0, dtype=RECORD_DTYPE), 0, stat.st_ino
+                self.sorted_num, self.tables = 0, []
+            size = (stat.st_size - self.offset) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize
+            if size <= 0:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size)
+            self.records = np.concatenate([self.records, np.frombuffer(data, dtype=RECORD_DTYPE)])
+            self.offset += size
+            if len(self.records) - self.sorted_num >= self.MERGE_SIZE:
+                self.build_tables()
+
+    def build_tables(self):
+        self.tables = []
+        for chunk in range(NUM_CHUNKS):
+            values = (self.records['phash'] >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)
+            order = np.argsort(values, kind='stable')
+            self.tables.append((values[order], order))
+        self.sorted_num = len(self.records)
+
+    def candidates(self, phash, radius):
+        """多索引哈希召回pHash距离可能不超过radius的记录下标"""
+        rows = [np.arange(self.sorted_num, len(self.records))]
+        if self.sorted_num:
+            chunk_radius = radius // NUM_CHUNKS
+            for chunk, (values, order) in enumerate(self.tables):
+                variants = chunk_variants((phash >> (chunk * CHUNK_BITS)) & 0xFFFF, chunk_radius)
+                lefts = np.searchsorted(values, variants, side='left')
+                rights = np.searchsorted(values, variants, side='right')
+                rows.extend(order[left:right] for left, right in zip(lefts, rights) if right > left)
+        return np.unique(np.concatenate(rows))
+
+    def search(self, image=None, hashes=None, max_distance=None, exclude_order=None):
+        """返回近重复的历史图像 [{'order_id', 'stage', 'index', 'phash_distance', 'dhash_distance'}]，按距离升序"""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        phash, dhash = hashes if hashes is not None else compute_hashes(image)
+        with self.lock:
+            self.refresh()
+            rows = self.candidates(phash, max_distance)
+            records = self.records[rows]
+        if len(records) == 0:
+            return []
+        phash_distance = hamming(records['phash'], phash)
+        dhash_distance = hamming(records['dhash'], dhash)
+        keep = (phash_distance <= max_distance) & (dhash_distance <= max_distance)
+        if exclude_order is not None:
+            keep &= records['order_id'] != int(exclude_order)
+        matches = []
+        for i in np.flatnonzero(keep)[np.argsort((phash_distance + dhash_distance)[keep], kind='stable')]:
+            matches.append({
+                'order_id': int(records['order_id'][i]),
+                'stage': self.stages[records['stage'][i]],
+                'index': int(records['index'][i]),
+                'phash_distance': int(phash_distance[i]),
+                'dhash_distance': int(dhash_distance[i]),
+            })
+        return matches
+
+    def add(self, order_id, stage, items):
+        """追加一个工单某阶段的图像，items为 [(图像序号, 图像或(pHash, dHash))]，已收录的 (工单, 阶段, 序号) 跳过"""
+        stage_code = self.stages.index(stage)
+        with self.lock:
+            self.refresh()
+            existing = self.records[(self.records['order_id'] == int(order_id)) & (self.records['stage'] == stage_code)]
+            known = set(existing['index'].tolist())
+            records = []
+            for index, value in items:
+                if index in known:
+                    continue
+                phash, dhash = value if isinstance(value, tuple) else compute_hashes(value)
+                records.append((phash, dhash, int(order_id), stage_code, index))
+            if not records:
+                return 0
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # 定长记录一次追加写入，读取方按整条记录截断
+            with open(self.path, 'ab') as f:
+                f.write(np.asarray(records, dtype=RECORD_DTYPE).tobytes())
+            self.refresh()
+        return len(records)
+
+    def get_orders(self):
+        with self.lock:
+            self.refresh()
+            return set(np.unique(self.records['order_id']).tolist())
+
+    def get_info(self):
+        with self.lock:
+            self.refresh()
+            return {
+                'records': len(self.records),
+                'sorted': self.sorted_num,
+                'bytes': self.offset,
+                'maxDistance': self.max_distance,
+            }
+
+
+def iter_order_images(path):
+    """按文件名顺序逐个读取目录中的图像，产出 (文件名, 原始字节, BGR图像)，无法解码的文件跳过
+    工单图像的序号即在此序列中的位置：审核流程(BaseHandler.get_local_image)、索引构建与按序号读取共用，编号一致
+    """
+    if not os.path.isdir(path):
+        return
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS or not os.path.isfile(file_path):
+            continue
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            logging.warning(f"Could not read order image {file_path}")
+            continue
+        yield name, data, image
+
+
+def get_order_path(root, order_id, stage):
+    return os.path.join(root, str(order_id), stage)
+
+
+def load_index_image(root, order_id, stage, index):
+    """按 (工单, 阶段, 序号) 读取本地工单图像，只解码到该序号为止"""
+    for _, _, image in itertools.islice(iter_order_images(get_order_path(root, order_id, stage)), index, None):
+        return image
+    return None
+
+
+duplicate_index = DuplicateIndex(config.DUPLICATE_INDEX_DIR, max_distance=config.DUPLICATE_MAX_DISTANCE)
@@ -0,0 +1,265 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import config
+from utils.backend_utils.file_lock import FileLock
+
+'''
+服务者/服务对象的人脸库
+- 按 (身份类型, id) 保存归一化后的ArcFace特征，每条记录附带来源(头像地址或工单阶段图像)与质量分
+- 每个特征模型一个命名空间，对应一个追加写入的entries.jsonl文件，审核完成后增量追加，多进程下读取时按文件大小增量刷新
+- 查询在内存中的特征矩阵上一次矩阵乘法完成，同一身份的多条特征取最大相似度，再按身份取top-k
+- 头像特征(origin='avatar')是身份的基准，始终保留且不占保留名额；工单人脸每个身份只保留质量分最高的若干条
+- 工单人脸(origin='order')仅在config.FACE_ENROLL_FROM_ORDERS开启时入库，可按来源类型单独清除
+- 追加与压缩重写在跨进程文件锁内进行，web进程与审核进程池同时写入时不会丢失记录；失效记录在累计到一定数量后压缩重写
+'''
+
+IDENTITY_KINDS = ('employee', 'member')
+
+
+def encode_vector(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def decode_vector(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class FaceIndex:
+    def __init__(self, path, dim=512, max_per_identity=32):
+        self.path = path
+        self.lock_path = os.path.join(os.path.dirname(path), 'entries.lock')
+        self.dim = dim
+        self.max_per_identity = max_per_identity
+        self.lock = threading.RLock()
+        self.entries = []  # 文件中的全部记录(含超出保留数量的记录)
+        self.offset = 0  # 已读取的文件字节数
+        self.inode = None
+        self.identities = []  # 身份序号 -> (身份类型, id)
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.rows = []  # vectors的行 -> entries下标，按身份排列，同一身份连续
+        self.starts = np.zeros(0, dtype=np.int64)  # 每个身份在vectors中的起始行
+        self.skipped = set()
+        self.dirty = True
+
+    def refresh(self):
+        """读取其他进程追加的记录；文件被压缩替换后整体重新加载"""
+        with self.lock:
+            if not os.path.exists(self.path):
+                return
+            stat = os.stat(self.path)
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.entries, self.offset, self.inode, self.dirty = [], 0, stat.st_ino, True
+            if stat.st_size == self.offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+            end = data.rfind(b'\n') + 1  # 只处理完整的行，写入中途的行留到下次
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                    entry['vector'] = decode_vector(entry['vector'])
+                except Exception as e:  # noqa
+                    logging.warning(f"Could not read face gallery entry in {self.path}: {e}")
+                    continue
+                if entry['vector'].shape[0] == self.dim:
+                    self.entries.append(entry)
+            self.offset += end
+            self.dirty = True
+
+    def rebuild(self):
+        """按身份分组，每个身份保留全部头像记录与质量分最高的max_per_identity条工单记录，拼成连续的特征矩阵"""
+        groups = {}
+        for index, entry in enumerate(self.entries):
+            groups.setdefault((entry['kind'], entry['id']), []).append(index)
+        self.identities, self.rows, starts = [], [], []
+        for identity, indices in groups.items():
+            avatars = [i for i in indices if self.entries[i].get('origin') == 'avatar']
+            others = [i for i in indices if self.entries[i].get('origin') != 'avatar']
+            indices = avatars + sorted(others, key=lambda i: -self.entries[i]['quality'])[:self.max_per_identity]
+            self.identities.append(identity)
+            starts.append(len(self.rows))
+            self.rows.extend(indices)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        if self.rows:
+            self.vectors = np.stack([self.entries[i]['vector'] for i in self.rows])
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.dirty = False
+
+    def snapshot(self):
+        with self.lock:
+            self.refresh()
+            if self.dirty:
+                self.rebuild()
+            return self.identities, self.vectors, self.starts, self.rows
+
+    def get_entries(self, kind, id):
+        identities, _, starts, rows = self.snapshot()
+        identity = (kind, str(id))
+        if identity not in identities:
+            return []
+        index = identities.index(identity)
+        end = starts[index + 1] if index + 1 < len(starts) else len(rows)
+        return [self.entries[row] for row in rows[starts[index]:end]]
+
+    def has(self, kind, id, source=None):
+        """库中是否有该身份(指定source时为该来源)的记录，本进程内确认没有人脸的来源也视为已有"""
+        if source is not None and (kind, str(id), source) in self.skipped:
+            return True
+        with self.lock:
+            self.refresh()
+            return any(entry['kind'] == kind and entry['id'] == str(id) and source in (None, entry['source'])
+                       for entry in self.entries)
+
+    def skip(self, kind, id, source):
+        """记录没有可用人脸的来源(如身份证背面)，本进程内不再重复检测"""
+        with self.lock:
+            self.skipped.add((kind, str(id), source))
+
+    def add(self, kind, id, feats, qualities, sources, **provenance):
+        """追加一个身份的若干条特征，sources为每条特征的来源标识，已存在的来源不重复写入"""
+        if kind not in IDENTITY_KINDS:
+            raise ValueError(f"Unknown identity kind: {kind}")
+        feats = np.atleast_2d(np.asarray(feats, dtype=np.float32))
+        feats = feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+        lines = []
+        with self.lock, FileLock(self.lock_path):
+            self.refresh()
+            known = {entry['source'] for entry in self.entries if entry['kind'] == kind and entry['id'] == str(id)}
+            for feat, quality, source in zip(feats, qualities, sources):
+                if source in known:
+                    continue
+                known.add(source)
+                entry = dict(provenance, kind=kind, id=str(id), source=source, quality=float(quality),
+                             time=int(time.time()), vector=encode_vector(feat))
+                lines.append(json.dumps(entry, ensure_ascii=False))
+            if not lines:
+                return 0
+            # 一次追加写入全部行，其他进程只会读到完整的行
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            self.refresh()
+            if len(self.entries) > 2 * max(len(self.rows), 1) + 1024:
+                self._compact()
+        return len(lines)
+
+    def compact(self):
+        """只保留每个身份的有效记录，写入临时文件后替换"""
+        with self.lock, FileLock(self.lock_path):
+            self._compact()
+
+    def _compact(self):
+        """须持有self.lock与文件锁；先读入其他进程追加的记录再重写，避免丢失"""
+        self.refresh()
+        self.rebuild()
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for row in self.rows:
+                    entry = dict(self.entries[row], vector=encode_vector(self.entries[row]['vector']))
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+        except Exception as e:  # noqa
+            logging.warning(f"Could not compact face gallery {self.path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.entries, self.offset, self.inode = [], 0, None
+        self.refresh()
+
+    def purge(self, origin='order'):
+        """删除指定来源类型的全部记录(如误入库的工单人脸)，返回删除条数"""
+        with self.lock, FileLock(self.lock_path):
+            self.refresh()
+            kept = [entry for entry in self.entries if entry.get('origin') != origin]
+            removed = len(self.entries) - len(kept)
+            if removed == 0:
+                return 0
+            tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in kept:
+                    f.write(json.dumps(dict(entry, vector=encode_vector(entry['vector'])), ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+            self.entries, self.offset, self.inode = [], 0, None
+            self.refresh()
+        return removed
+
+    def scores(self, feats, kind=None):
+        """feats[N, D]与库中每个身份的最大相似度，返回 (身份列表, 相似度[N, 身份数])"""
+        identities, vectors, starts, _ = self.snapshot()
+        feats = np.atleast_2d(np.asarray(feats, dtype=np.float32))
+        if len(identities) == 0 or len(feats) == 0:
+            return [], np.zeros((len(feats), 0), dtype=np.float32)
+        feats = feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+        scores = np.maximum.reduceat(feats @ vectors.T, starts, axis=1)
+        if kind is not None:
+            mask = np.asarray([identity[0] == kind for identity in identities])
+            identities = [identity for identity in identities if identity[0] == kind]
+            scores = scores[:, mask]
+        return identities, scores
+
+    def search(self, feats, k=5, kind=None):
+        """每个查询特征返回相似度最高的k个身份 [[(身份类型, id, 相似度)]]"""
+        identities, scores = self.scores(feats, kind)
+        if not identities:
+            return [[] for _ in range(len(scores))]
+        k = min(k, len(identities))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        return [[(*identities[j], float(scores[i, j])) for j in row] for i, row in enumerate(top)]
+
+    def verify(self, feats, kind, id):
+        """feats[N, D]与指定身份的最大相似度[N]，库中没有该身份时返回None"""
+        identities, vectors, starts, rows = self.snapshot()
+        identity = (kind, str(id))
+        if identity not in identities:
+            return None
+        index = identities.index(identity)
+        end = starts[index + 1] if index + 1 < len(starts) else len(rows)
+        feats = np.atleast_2d(np.asarray(feats, dtype=np.float32))
+        if len(feats) == 0:
+            return np.zeros(0, dtype=np.float32)
+        feats = feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+        return (feats @ vectors[starts[index]:end].T).max(axis=1)
+
+    def get_info(self):
+        identities, vectors, _, _ = self.snapshot()
+        return {
+            'identities': len(identities),
+            'vectors': len(vectors),
+            'entries': len(self.entries),
+            'bytes': self.offset,
+        }
+
+
+class FaceGallery:
+    def __init__(self, root, dim=512, max_per_identity=32):
+        self.root = root
+        self.dim = dim
+        self.max_per_identity = max_per_identity
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get_index(self, namespace):
+        """每个特征模型一个索引，不同模型的特征不可比较"""
+        with self.lock:
+            if namespace not in self.indexes:
+                path = os.path.join(self.root, namespace, 'entries.jsonl')
+                self.indexes[namespace] = FaceIndex(path, self.dim, self.max_per_identity)
+            return self.indexes[namespace]
+
+    def get_info(self):
+        with self.lock:
+            indexes = dict(self.indexes)
+        return {namespace: index.get_info() for namespace, index in indexes.items()}
+
+
+face_gallery = FaceGallery(config.FACE_GALLERY_DIR, max_per_identity=config.FACE_GALLERY_MAX_PER_IDENTITY)
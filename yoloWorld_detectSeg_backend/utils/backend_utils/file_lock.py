@@ -0,0 +1,40 @@
+import os
+
+'''
+跨进程文件锁
+- 同一台机器上fork出的web进程与审核进程池共享的本地文件(登记表、索引、缓存)在锁内读改写
+- 锁文件只用于互斥，不写入内容
+'''
+
+
+class FileLock:
+    """跨进程互斥：Linux下使用fcntl，Windows下使用msvcrt"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a+b')
+        if os.name == 'nt':
+            import msvcrt
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
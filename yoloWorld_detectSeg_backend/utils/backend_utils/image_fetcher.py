@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from utils.backend_utils.image_store import image_store, is_image_ref
+
+'''
+工单图像的并发获取
+- 每个线程持有一个长连接Session，超时、失败重试(含429/5xx)由连接适配器统一处理
+- 下载内容按sha256存入ImageStore，URL索引记录 URL -> (ETag, Last-Modified, 图像引用)，同一URL不再重复下载
+- 开启重新验证时带If-None-Match/If-Modified-Since发送条件请求，304直接使用本地内容
+- 批量获取在有界线程池中并发下载和解码，线程池按调用创建，不跨进程fork共享
+'''
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+def hash_url(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class ImageFetcher:
+    def __init__(self, store, index_dir, max_workers=8, timeout=(5, 30), retries=3, revalidate=False):
+        self.store = store
+        self.index_dir = index_dir
+        self.max_workers = max_workers
+        self.timeout = tuple(timeout)
+        self.retries = retries
+        self.revalidate = revalidate
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.downloads = 0
+        self.not_modified = 0
+        self.hits = 0
+        self.failures = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset_after_fork)
+
+    def reset_after_fork(self):
+        """子进程不沿用父进程的连接"""
+        self.local = threading.local()
+
+    def get_session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=RETRY_STATUS,
+                          allowed_methods=['GET'], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return session
+
+    def get_index_path(self, url):
+        digest = hash_url(url)
+        return os.path.join(self.index_dir, digest[:2], f'{digest}.json')
+
+    def read_index(self, url):
+        path = self.get_index_path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except Exception as e:  # noqa
+            logging.warning(f"Could not read image index of {url}: {e}")
+            return None
+        if entry.get('url') != url or not self.store.exists(entry.get('ref')):
+            return None
+        return entry
+
+    def write_index(self, url, entry):
+        path = self.get_index_path(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except Exception as e:  # noqa
+            logging.warning(f"Could not write image index of {url}: {e}")
+
+    def fetch(self, url):
+        """获取图像并返回图像引用，本地已有时不再下载"""
+        if is_image_ref(url):
+            return url
+        entry = self.read_index(url)
+        if entry is not None and not self.revalidate:
+            with self.lock:
+                self.hits += 1
+            return entry['ref']
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        resp = self.get_session().get(url, headers=headers, timeout=self.timeout)
+        if resp.status_code == 304 and entry is not None:
+            with self.lock:
+                self.not_modified += 1
+            return entry['ref']
+        resp.raise_for_status()
+        ref = self.store.put_bytes(resp.content)
+        self.write_index(url, {
+            'url': url,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'ref': ref,
+        })
+        with self.lock:
+            self.downloads += 1
+        return ref
+
+    def load(self, url):
+        """获取并解码图像，返回RGB图像"""
+        return self.store.get(self.fetch(url))
+
+    def load_many(self, urls):
+        """并发获取并解码多张图像，返回 {url: RGB图像}，失败的图像记录日志后跳过"""
+        urls = list(dict.fromkeys(url for url in urls if url))
+        images = {}
+        if not urls:
+            return images
+
+        def load(url):
+            try:
+                return url, self.load(url)
+            except Exception as e:  # noqa
+                with self.lock:
+                    self.failures += 1
+                logging.warning(f"Error downloading or processing image from {url}: {e}")
+                return url, None
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            for url, image in executor.map(load, urls):
+                if image is not None:
+                    images[url] = image
+        return images
+
+    def get_info(self):
+        with self.lock:
+            return {
+                'downloads': self.downloads,
+                'notModified': self.not_modified,
+                'hits': self.hits,
+                'failures': self.failures,
+            }
+
+
+image_fetcher = ImageFetcher(
+    image_store,
+    os.path.join(config.IMAGE_STORE_DIR, 'urls'),
+    max_workers=config.IMAGE_FETCH_WORKERS,
+    timeout=config.IMAGE_FETCH_TIMEOUT,
+    retries=config.IMAGE_FETCH_RETRIES,
+    revalidate=config.IMAGE_FETCH_REVALIDATE,
+)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import re
+
+import config
+from work_flow.flows.lru_cache import LRUCache
+from work_flow.utils import bytes_to_rgb_cv_img
+
+'''
+按内容寻址的图像存储
+- 上传的原始编码字节按sha256落盘，会话中只保存引用 "sha256:<hex>"，不再保存像素数据
+- 最近使用的解码结果常驻内存，同一图像重复推理不再重复解码
+'''
+
+IMAGE_REF_PREFIX = 'sha256:'
+_ref_pattern = re.compile(r'^sha256:[0-9a-f]{64}$')
+
+
+def is_image_ref(value):
+    return isinstance(value, str) and _ref_pattern.match(value) is not None
+
+
+class ImageStore:
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, root, cache_num=8):
+        self.root = root
+        self.decoded = LRUCache(maxsize=cache_num)  # 引用 -> 解码后的图像
+
+    def get_path(self, ref):
+        digest = ref[len(IMAGE_REF_PREFIX):]
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, ref):
+        return is_image_ref(ref) and (self.decoded.find(ref) or os.path.exists(self.get_path(ref)))
+
+    def put_stream(self, stream):
+        """边读取边计算摘要，读完后直接在该缓冲区上解码，返回图像引用"""
+        buffer = bytearray()
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            buffer += chunk
+        return self.put_bytes(buffer, sha256.hexdigest())
+
+    def put_bytes(self, buffer, digest=None):
+        """保存已编码的图像字节并解码，返回图像引用"""
+        if not buffer:
+            raise ValueError('上传内容为空')
+        ref = IMAGE_REF_PREFIX + (digest or hashlib.sha256(buffer).hexdigest())
+        if self.decoded.find(ref):
+            return ref
+        image = bytes_to_rgb_cv_img(memoryview(buffer))  # 解码失败说明不是图像，不落盘
+        path = self.get_path(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer)
+            os.replace(tmp_path, path)
+        self.decoded.put(ref, image)
+        return ref
+
+    def get(self, ref):
+        """按引用取出解码后的图像，返回副本，推理流程可自由修改"""
+        if not is_image_ref(ref):
+            raise ValueError(f'无效的图像引用: {ref}')
+        image = self.decoded.get(ref)
+        if image is None:
+            path = self.get_path(ref)
+            if not os.path.exists(path):
+                raise ValueError(f'图像不存在: {ref}')
+            with open(path, 'rb') as f:
+                image = bytes_to_rgb_cv_img(f.read())
+            self.decoded.put(ref, image)
+        return image.copy()
+
+
+image_store = ImageStore(config.IMAGE_STORE_DIR, config.IMAGE_CACHE_NUM)
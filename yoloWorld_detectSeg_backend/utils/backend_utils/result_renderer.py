@@ -0,0 +1,156 @@
+import copy
+import os
+import pickle
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+
+import config
+from utils.backend_utils.image_store import image_store, is_image_ref
+from work_flow.utils.image import encode_image, crop_polygon_object
+
+'''
+推理结果图延迟渲染
+- 精简响应只返回矢量结果与短时有效的结果图地址，渲染所需的画布落盘暂存，不常驻内存
+- 画布底图与输入图像相同时只记录图像存储中的引用，其余内容(形状、头像等)序列化为 <令牌>.pkl
+- serve.py下各web进程共享暂存目录，地址被路由到任一进程都能渲染
+- 访问地址时才在线程池中绘制并编码(WebP/JPEG，可限制长边)，编码结果同样落盘，同一参数的结果复用
+- 过期的暂存文件在登记新结果时清理
+'''
+
+RENDER_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+_token_pattern = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ResultRenderer:
+    STATE_SUFFIX = '.pkl'
+
+    def __init__(self, root, ttl=60, max_workers=4):
+        self.root = root
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='result-render')
+        self.renders = {}  # (令牌, 参数) -> future，本进程内并发访问同一结果时共享一次渲染
+        self.lock = Lock()
+        self.last_purge = 0
+
+    def get_state_path(self, token):
+        return os.path.join(self.root, token + self.STATE_SUFFIX)
+
+    def get_render_path(self, token, kind, index, fmt, max_size):
+        return os.path.join(self.root, f'{token}.{kind}.{index}.{max_size or 0}.{fmt}')
+
+    @staticmethod
+    def write_file(path, data):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def purge(self):
+        """删除过期的暂存文件，每个ttl周期最多扫描一次目录"""
+        now = time.time()
+        if now - self.last_purge < self.ttl or not os.path.isdir(self.root):
+            return
+        self.last_purge = now
+        for entry in os.scandir(self.root):
+            try:
+                if entry.stat().st_mtime + self.ttl < now:
+                    os.remove(entry.path)
+            except OSError:  # 其他进程已删除
+                pass
+
+    @staticmethod
+    def get_image_num(canvas):
+        """返回 (结果图数量：标注图 + 头像, 裁剪图数量)"""
+        return 1 + len(canvas.avatars), len(canvas.shapes) if canvas.is_cropped else 0
+
+    def register(self, canvas, image_ref=None):
+        """暂存一次推理的画布，返回访问令牌；image_ref为输入图像的引用，底图未被修改时不重复保存像素"""
+        token = uuid.uuid4().hex
+        state = copy.copy(canvas)
+        state.shapes, state.avatars = list(canvas.shapes), list(canvas.avatars)
+        cropped, state.is_cropped = canvas.is_cropped, False  # 裁剪图改为按需渲染，绘制标注图时不再逐个编码
+        if is_image_ref(image_ref) and canvas.image is not None \
+                and np.array_equal(canvas.image, image_store.get(image_ref)):
+            state.image = None
+        else:
+            image_ref = None
+        os.makedirs(self.root, exist_ok=True)
+        self.write_file(self.get_state_path(token), pickle.dumps(
+            {'canvas': state, 'image_ref': image_ref, 'cropped': cropped}, protocol=pickle.HIGHEST_PROTOCOL))
+        self.purge()
+        return token
+
+    def is_alive(self, token):
+        if not _token_pattern.match(token):
+            return False
+        try:
+            return os.path.getmtime(self.get_state_path(token)) + self.ttl >= time.time()
+        except OSError:
+            return False
+
+    def load(self, token):
+        """读取暂存的画布，令牌无效或已过期时返回None"""
+        if not self.is_alive(token):
+            return None
+        try:
+            with open(self.get_state_path(token), 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        canvas = state['canvas']
+        if state['image_ref'] is not None:
+            canvas.image = image_store.get(state['image_ref'])
+        canvas.is_cropped = state['cropped']
+        return canvas
+
+    def render(self, token, kind='image', index=0, fmt='webp', max_size=None):
+        """返回 (编码后的字节, mimetype)，令牌失效或序号越界时返回None"""
+        mimetype = RENDER_FORMATS[fmt][1]
+        key = (token, kind, index, fmt, max_size)
+        with self.lock:
+            future = self.renders.get(key)
+            if future is None:
+                future = self.executor.submit(self._render, *key)
+                self.renders[key] = future
+        try:
+            data = future.result()
+        finally:
+            with self.lock:
+                if self.renders.get(key) is future:
+                    del self.renders[key]
+        return (data, mimetype) if data is not None else None
+
+    def _render(self, token, kind, index, fmt, max_size):
+        if not self.is_alive(token):
+            return None
+        render_path = self.get_render_path(token, kind, index, fmt, max_size)
+        try:  # 其他进程已渲染过同一参数
+            with open(render_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            pass
+        canvas = self.load(token)
+        if canvas is None:
+            return None
+        if kind == 'crop':
+            if not canvas.is_cropped or not 0 <= index < len(canvas.shapes):
+                return None
+            image = crop_polygon_object(canvas.image, canvas.shapes[index].points)
+        elif index == 0:
+            image = canvas.draw()
+        elif 0 < index <= len(canvas.avatars):
+            image = canvas.avatars[index - 1]
+        else:
+            return None
+        data = encode_image(image, fmt=RENDER_FORMATS[fmt][0], max_size=max_size, quality=85)
+        self.write_file(render_path, data)
+        return data
+
+
+result_renderer = ResultRenderer(config.RESULT_RENDER_DIR, ttl=config.RESULT_URL_TTL,
+                                 max_workers=config.RESULT_RENDER_WORKERS)
@@ -1,4 +1,3 @@
-import math
 import os
 import re
 import traceback
@@ -57,48 +56,60 @@ def __init__(self, config_path, on_message) -> None:
         self.net.load_state_dict(torch.load(model_abs_path, weights_only=True))
         self.net.eval()
         self.device = 'cuda' if __preferred_device__ == 'GPU' else 'cpu'
+        self.net.to(self.device)  # 只在加载时迁移一次
+        self.max_batch_size = self.config.get('max_batch_size', 64)
 
     def preprocess(self, image):
-        img = cv2.resize(image, (112, 112))
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = np.transpose(img, (2, 0, 1))
-        img = torch.from_numpy(img).unsqueeze(0).float()
-        img.div_(255).sub_(0.5).div_(0.5)
-        img = img.to(self.device)
-        return img
+        return self.preprocess_batch([image])
+
+    def preprocess_batch(self, images):
+        """多张人脸图像合并为一个输入张量[N, 3, 112, 112]"""
+        batch = np.stack([cv2.cvtColor(cv2.resize(image, (112, 112)), cv2.COLOR_BGR2RGB) for image in images])
+        batch = torch.from_numpy(np.ascontiguousarray(batch.transpose(0, 3, 1, 2))).float()
+        batch.div_(255).sub_(0.5).div_(0.5)
+        return batch.to(self.device)
 
     @torch.no_grad()
+    def get_embeddings(self, images):
+        """批量提取特征，每max_batch_size张人脸一次前向，返回L2归一化后的特征矩阵[N, 512]"""
+        if len(images) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+        feats = []
+        for start in range(0, len(images), self.max_batch_size):
+            blob = self.preprocess_batch(images[start:start + self.max_batch_size])
+            feats.append(self.net(blob).to('cpu').numpy())
+        return self.normalize(np.concatenate(feats, axis=0))
+
     def get_embedding(self, image):
-        self.net.to(self.device)
-        cv_img = self.preprocess(image)
-        return self.net(cv_img).to('cpu').numpy()[0]
+        return self.get_embeddings([image])[0]
+
+    @staticmethod
+    def normalize(feats):
+        feats = np.atleast_2d(np.asarray(feats, dtype=np.float32))
+        return feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+
+    @staticmethod
+    def similarity_matrix(feats1, feats2):
+        """余弦相似度矩阵：feats1[N, D]与feats2[M, D]，一次矩阵乘法得到[N, M]"""
+        if len(feats1) == 0 or len(feats2) == 0:
+            return np.zeros((len(feats1), len(feats2)), dtype=np.float32)
+        return ArcFace.normalize(feats1) @ ArcFace.normalize(feats2).T
+
+    def get_similarity_result(self, feat1, feat2, sim_threshold=0.5):
+        div = float(self.similarity_matrix(feat1, feat2)[0, 0])
+        flag = div > sim_threshold
+        description = f"Face Similarity: {div}\n Is the Same: {flag}"
+        return AutoLabelingResult([], description=description, replace=False)
 
-    @torch.no_grad()
     def predict_embeddings(self, feat1, feat2, sim_threshold=0.5):
         try:
-            self.net.to(self.device)
-            sum: float = 0
-            len1: float = 0
-            len2: float = 0
-            for i in range(512):
-                n1 = feat1[i]
-                n2 = feat2[i]
-                sum += n1 * n2
-                len1 += n1 * n1
-                len2 += n2 * n2
-            len1 = math.sqrt(len1)
-            len2 = math.sqrt(len2)
-            div = sum / len1 / len2
-            flag = div > sim_threshold
-            description = f"Face Similarity: {div}\n Is the Same: {flag}"
+            return self.get_similarity_result(feat1, feat2, sim_threshold)
         except Exception as e:  # noqa
             logging.warning("Could not inference model")
             logging.error(e)
             traceback.print_exc()
             return AutoLabelingResult([], replace=False)
 
-        return AutoLabelingResult([], description=description, replace=False)
-    @torch.no_grad()
     def predict_shapes(self, image, minor=None, sim_threshold=0.5):
         """
         Predict shapes from image
@@ -107,28 +118,10 @@ def predict_shapes(self, image, minor=None, sim_threshold=0.5):
             return AutoLabelingResult([], replace=False)
 
         try:
-            self.net.to(self.device)
-            feat1 = self.predict_shapes(image)
-            feat2 = self.predict_shapes(minor)
-            sum: float = 0
-            len1: float = 0
-            len2: float = 0
-            for i in range(512):
-                n1 = feat1[i]
-                n2 = feat2[i]
-                sum += n1 * n2
-                len1 += n1 * n1
-                len2 += n2 * n2
-            len1 = math.sqrt(len1)
-            len2 = math.sqrt(len2)
-            div = sum / len1 / len2
-            flag = div > sim_threshold
-            description = f"Face Similarity: {div}\n Is the Same: {flag}"
+            feat1, feat2 = self.get_embeddings([image, minor])
+            return self.get_similarity_result(feat1, feat2, sim_threshold)
         except Exception as e:  # noqa
             logging.warning("Could not inference model")
             logging.error(e)
             traceback.print_exc()
             return AutoLabelingResult([], replace=False)
-
-        return AutoLabelingResult([], description=description, replace=False)
-
@@ -8,6 +8,7 @@
 from functools import lru_cache
 
 from work_flow.engines import OnnxBaseModel
+from work_flow.engines.text_feature_cache import get_text_cache
 import logging
 
 
@@ -42,15 +43,19 @@ def __init__(
         model_arch: str,
         device: str = "cpu",
         context_length: int = 52,
+        batching=None,
+        max_batch_size: int = 32,
     ) -> None:
         # Load flows
-        self.txt_net = OnnxBaseModel(txt_model_path, device_type=device)
-        self.img_net = OnnxBaseModel(img_model_path, device_type=device)
+        self.txt_net = OnnxBaseModel(txt_model_path, device_type=device, batching=batching)
+        self.img_net = OnnxBaseModel(img_model_path, device_type=device, batching=batching)
         # Image settings
         self.image_size = _MODEL_INFO[model_arch]["input_resolution"]
         # Text settings
         self._tokenizer = FullTokenizer()
         self.context_length = context_length
+        self.max_batch_size = max_batch_size
+        self.text_cache = get_text_cache(txt_model_path, context_length)
 
     def __call__(self, image: np.ndarray, text: List[str]):
         txt_features = self.txt_pipeline(text)
@@ -62,15 +67,16 @@ def __call__(self, image: np.ndarray, text: List[str]):
         return probabilities
 
     def txt_pipeline(self, text: List[str]):
-        text = self.tokenize(text, context_length=self.context_length)
-        features = []
-        for i in range(len(text)):
-            blob = np.expand_dims(text[i], axis=0)
-            feature = self.txt_net.get_ort_inference(blob)
-            features.append(feature)
-        features = np.squeeze(np.stack(features), axis=1)
-        features = self.postprocess(features)
-        return features
+        """文本特征[N, D]，已编码过的文本直接取缓存"""
+        if isinstance(text, str):
+            text = [text]
+        return self.text_cache.get_or_encode(text, self.encode_texts)
+
+    def encode_texts(self, text: List[str]):
+        """全部文本拼成批次送入文本编码器"""
+        tokens = self.tokenize(text, context_length=self.context_length)
+        features = self.txt_net.get_ort_batch_inference(tokens, self.max_batch_size)
+        return self.postprocess(features)
 
     def img_pipeline(self, image: np.ndarray):
         blob = self.image_preprocess(image, image_size=self.image_size)
@@ -78,6 +84,34 @@ def img_pipeline(self, image: np.ndarray):
         features = self.postprocess(outputs)
         return features
 
+    def img_batch_pipeline(self, images: List[np.ndarray], max_batch_size: int = None):
+        """多张图像拼成批次送入图像编码器，返回归一化特征[N, D]"""
+        blob = np.concatenate(
+            [self.image_preprocess(image, image_size=self.image_size) for image in images]
+        )
+        outputs = self.img_net.get_ort_batch_inference(blob, max_batch_size or self.max_batch_size)
+        return self.postprocess(outputs)
+
+    def classify_batch(self, images: List[np.ndarray], text: List[str]):
+        """多张图像对同一组文本的概率[N, C]，图像编码一次批量推理，文本特征走缓存"""
+        if len(images) == 0:
+            return np.zeros((0, len(text)), dtype=np.float32)
+        txt_features = self.txt_pipeline(text)
+        img_features = self.img_batch_pipeline(images)
+        logits_per_image = 100 * np.dot(img_features, txt_features.T)
+        logits_per_image -= logits_per_image.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits_per_image)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def classify_crops(self, crops: List[np.ndarray], text: List[str]):
+        """多个图像区域合并分类，返回每个区域概率最高的文本，空区域为None"""
+        valid = [i for i, crop in enumerate(crops) if crop.size > 0]
+        labels = [None] * len(crops)
+        probabilities = self.classify_batch([crops[i] for i in valid], text)
+        for i, prob in zip(valid, probabilities):
+            labels[i] = text[int(np.argmax(prob))]
+        return labels
+
     @staticmethod
     def normalize(data, mean, std):
         if not isinstance(mean, np.ndarray):
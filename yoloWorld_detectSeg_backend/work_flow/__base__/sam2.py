@@ -10,6 +10,8 @@
 import onnxruntime as ort
 from numpy import ndarray
 
+from work_flow.utils.sam_batch import has_dynamic_batch, resize_masks
+
 
 class SegmentAnything2ONNX:
     """Segmentation model using Segment Anything 2 (SAM2)"""
@@ -63,6 +65,20 @@ def predict_masks(self, embedding, prompt) -> List[np.ndarray]:
 
         return masks
 
+    def predict_masks_batch(self, embedding, prompts):
+        """
+        Predict masks for several prompts on the same image.
+        prompts: [(points, labels), ...], returns the best mask of each prompt [B, 1, H, W].
+        """
+        self.decoder.set_image_size(embedding["original_size"])
+        return self.decoder.predict_batch(
+            embedding["image_embedding"],
+            embedding["high_res_feats_0"],
+            embedding["high_res_feats_1"],
+            [np.asarray(points) for points, _ in prompts],
+            [np.asarray(labels) for _, labels in prompts],
+        )
+
     def transform_masks(self, masks, original_size, transform_matrix):
         """Transform the masks back to the original image size."""
         output_masks = []
@@ -182,6 +198,8 @@ def __init__(
         # Get model info
         self.get_input_details()
         self.get_output_details()
+        # 解码器导出时提示的批次维为动态才能一次解码多组提示
+        self.batch_decoding = has_dynamic_batch(self.session, self.input_names[3])
 
     def __call__(
         self,
@@ -219,6 +237,30 @@ def predict(
 
         return self.process_output(outputs)
 
+    def predict_batch(
+        self,
+        image_embed: np.ndarray,
+        high_res_feats_0: np.ndarray,
+        high_res_feats_1: np.ndarray,
+        point_coords: List[np.ndarray],
+        point_labels: List[np.ndarray],
+    ) -> np.ndarray:
+        """Decode several prompt sets, returns the best mask of each [B, 1, H, W]"""
+        if self.batch_decoding:
+            chunks = [(point_coords, point_labels)]
+        else:
+            chunks = [([coords], [labels]) for coords, labels in zip(point_coords, point_labels)]
+        best_masks = []
+        for coords, labels in chunks:
+            inputs = self.prepare_inputs(
+                image_embed, high_res_feats_0, high_res_feats_1, coords, labels
+            )
+            masks, scores = self.forward_decoder(inputs)[:2]
+            scores = scores.reshape(len(masks), -1)
+            best_masks.append(masks[np.arange(len(masks)), scores.argmax(axis=1)])
+        best_masks = resize_masks(np.concatenate(best_masks), self.orig_im_size)
+        return best_masks[:, None]
+
     def prepare_inputs(
         self,
         image_embed: np.ndarray,
@@ -0,0 +1,102 @@
+import cv2
+
+'''
+SAM2视频流式分割
+- 直接从cv2.VideoCapture(视频路径/摄像头编号/已打开的对象)或内存中的帧迭代器逐帧读取，无需先抽帧为JPEG目录
+- 以生成器逐帧返回掩码，调用方处理完一帧再读取下一帧
+- 每帧跟踪后裁剪预测器的记忆库，只保留记忆注意力会用到的最近若干帧，内存占用与视频长度无关
+'''
+
+
+def iter_frames(source):
+    """逐帧返回RGB图像；source为路径、摄像头编号或VideoCapture时从视频读取，否则视为帧迭代器"""
+    if isinstance(source, (str, int)):
+        capture, owned = cv2.VideoCapture(source), True
+    elif isinstance(source, cv2.VideoCapture):
+        capture, owned = source, False
+    else:
+        yield from source
+        return
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        if owned:
+            capture.release()
+
+
+def add_prompts(predictor, prompts, frame_idx=0):
+    """在指定帧上为每个提示登记一个目标(目标id从1开始)，返回该帧的 (目标id, 掩码logits)"""
+    out_obj_ids, out_mask_logits = [], None
+    for i, prompt in enumerate(prompts):
+        if prompt["type"] == "rectangle":
+            _, out_obj_ids, out_mask_logits = predictor.add_new_prompt(
+                frame_idx=frame_idx,
+                obj_id=i + 1,
+                bbox=prompt["data"],
+            )
+        elif prompt["type"] == "point":
+            _, out_obj_ids, out_mask_logits = predictor.add_new_prompt(
+                frame_idx=frame_idx,
+                obj_id=i + 1,
+                points=prompt["data"]["point_coords"],
+                labels=prompt["data"]["point_labels"],
+            )
+    return out_obj_ids, out_mask_logits
+
+
+class SAM2VideoStream:
+    """Stream a video through a SAM2 camera predictor with a bounded memory bank."""
+
+    def __init__(self, predictor, window=None):
+        self.predictor = predictor
+        self.window = window or self.get_memory_window(predictor)
+
+    @staticmethod
+    def get_memory_window(predictor):
+        """记忆注意力回看的帧数：掩码记忆(num_maskmem×步长)与目标指针(max_obj_ptrs_in_encoder)取大者"""
+        num_maskmem = getattr(predictor, "num_maskmem", 7)
+        stride = getattr(predictor, "memory_temporal_stride_for_eval", 1)
+        max_obj_ptrs = getattr(predictor, "max_obj_ptrs_in_encoder", 16)
+        return max(num_maskmem * stride, max_obj_ptrs) + 1
+
+    def run(self, frames, prompts):
+        """逐帧生成 (帧序号, 目标id列表, 掩码logits numpy[N, 1, H, W])，首帧为加入提示后的结果"""
+        for frame_idx, frame in enumerate(frames):
+            if frame_idx == 0:
+                self.predictor.load_first_frame(frame)
+                out_obj_ids, out_mask_logits = add_prompts(self.predictor, prompts)
+            else:
+                out_obj_ids, out_mask_logits = self.predictor.track(frame)
+                self.prune(frame_idx)
+            if out_mask_logits is None:
+                yield frame_idx, [], None
+                continue
+            yield frame_idx, list(out_obj_ids), out_mask_logits.cpu().numpy()
+
+    def prune(self, frame_idx):
+        """删除记忆库中早于窗口的非条件帧输出，提示帧(条件帧)始终保留"""
+        state = getattr(self.predictor, "condition_state", None)
+        if not state:
+            return
+        frame_idx = getattr(self.predictor, "frame_idx", frame_idx)
+        oldest = frame_idx - self.window
+        outputs = [state.get("output_dict", {}).get("non_cond_frame_outputs")]
+        outputs += [
+            obj_outputs.get("non_cond_frame_outputs")
+            for obj_outputs in state.get("output_dict_per_obj", {}).values()
+        ]
+        outputs.append(state.get("frames_already_tracked"))
+        for frame_outputs in outputs:
+            if not frame_outputs:
+                continue
+            for idx in [idx for idx in frame_outputs if idx < oldest]:
+                del frame_outputs[idx]
+        consolidated = state.get("consolidated_frame_inds", {}).get("non_cond_frame_outputs")
+        if consolidated:
+            consolidated.difference_update([idx for idx in consolidated if idx < oldest])
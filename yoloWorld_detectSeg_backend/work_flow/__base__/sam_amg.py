@@ -0,0 +1,326 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from work_flow.__base__.sam import SegmentAnythingONNX
+from work_flow.utils.box import box_area, numpy_nms
+from work_flow.utils.sam_batch import pack_prompts, warp_masks
+from work_flow.utils.segment_anything.utils.amg import (
+    area_from_rle,
+    build_all_layer_point_grids,
+    coco_encode_rle,
+    generate_crop_boxes,
+    remove_small_regions,
+    rle_to_mask,
+)
+
+'''
+面向CPU的全图自动分割(SamAutomaticMaskGenerator的numpy实现)
+- 各裁剪块的图像编码提交到线程池并行执行，前一块解码时后续块已在编码
+- 同一裁剪块的点提示按批在线程池中解码，解码器支持批次维时一批只调用一次
+- 稳定性分数与面积在按位压缩(packbits)后的掩码上统计，仅对通过筛选的掩码变换回原图尺寸
+- RLE编码、外接框计算和NMS均为numpy向量化实现，不依赖torch
+'''
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def packed_area(packed):
+    """按位压缩掩码[N, H, ceil(W/8)]的前景像素数"""
+    return POPCOUNT[packed].sum(axis=(-2, -1), dtype=np.int64)
+
+
+def stability_scores(logits, mask_threshold, threshold_offset):
+    """高/低阈值二值化结果的IoU，高阈值掩码必然包含于低阈值掩码，IoU即面积之比"""
+    high = np.packbits(logits > (mask_threshold + threshold_offset), axis=-1)
+    low = np.packbits(logits > (mask_threshold - threshold_offset), axis=-1)
+    return packed_area(high) / np.maximum(packed_area(low), 1)
+
+
+def masks_to_boxes(masks):
+    """masks[N, H, W] -> XYXY外接框[N, 4]，空掩码为[0, 0, 0, 0]"""
+    boxes = np.zeros((len(masks), 4), dtype=np.int64)
+    if len(masks) == 0:
+        return boxes
+    height, width = masks.shape[1:]
+    rows = masks.any(axis=2)
+    cols = masks.any(axis=1)
+    valid = rows.any(axis=1)
+    boxes[valid, 0] = cols[valid].argmax(axis=1)
+    boxes[valid, 1] = rows[valid].argmax(axis=1)
+    boxes[valid, 2] = width - 1 - cols[valid][:, ::-1].argmax(axis=1)
+    boxes[valid, 3] = height - 1 - rows[valid][:, ::-1].argmax(axis=1)
+    return boxes
+
+
+def is_box_near_crop_edge(boxes, crop_box, orig_box, atol=20.0):
+    """靠近裁剪块边缘、但不靠近原图边缘的框，boxes为原图坐标"""
+    near_crop_edge = np.abs(boxes - np.array(crop_box)[None, :]) <= atol
+    near_image_edge = np.abs(boxes - np.array(orig_box)[None, :]) <= atol
+    return np.any(near_crop_edge & ~near_image_edge, axis=1)
+
+
+def mask_to_rle(masks):
+    """masks[N, H, W] bool -> 未压缩的COCO RLE(按列优先展开，首段为背景)"""
+    num, height, width = masks.shape
+    flat = masks.transpose(0, 2, 1).reshape(num, height * width)
+    rows, cols = np.nonzero(flat[:, 1:] != flat[:, :-1])
+    out = []
+    for i, change in enumerate(np.split(cols, np.searchsorted(rows, np.arange(1, num)))):
+        idxs = np.concatenate([[0], change + 1, [height * width]])
+        counts = [0] if flat[i, 0] else []
+        counts.extend(np.diff(idxs).tolist())
+        out.append({"size": [height, width], "counts": counts})
+    return out
+
+
+def uncrop_mask_to_rle(masks, crop_box, orig_h, orig_w, chunk_size=16):
+    """裁剪块坐标系下的掩码放回原图后编码为RLE，分块放回以限制内存"""
+    x0, y0, x1, y1 = crop_box
+    if x0 == 0 and y0 == 0 and x1 == orig_w and y1 == orig_h:
+        return mask_to_rle(masks)
+    rles = []
+    for start in range(0, len(masks), chunk_size):
+        chunk = masks[start: start + chunk_size]
+        full = np.zeros((len(chunk), orig_h, orig_w), dtype=bool)
+        full[:, y0:y1, x0:x1] = chunk
+        rles.extend(mask_to_rle(full))
+    return rles
+
+
+def box_xyxy_to_xywh(box):
+    x0, y0, x1, y1 = box
+    return [x0, y0, x1 - x0, y1 - y0]
+
+
+def filter_data(data, keep):
+    """keep为布尔掩码或下标"""
+    keep = np.flatnonzero(keep) if np.asarray(keep).dtype == bool else np.asarray(keep, dtype=np.int64)
+    return {key: value[keep] if isinstance(value, np.ndarray) else [value[i] for i in keep]
+            for key, value in data.items()}
+
+
+def cat_data(data_list):
+    data_list = [data for data in data_list if len(data["iou_preds"])]
+    if not data_list:
+        return {"iou_preds": np.zeros(0, dtype=np.float32), "points": np.zeros((0, 2)),
+                "stability_score": np.zeros(0), "boxes": np.zeros((0, 4), dtype=np.int64),
+                "crop_boxes": np.zeros((0, 4), dtype=np.int64), "rles": []}
+    return {key: np.concatenate([data[key] for data in data_list]) if key != "rles"
+            else [rle for data in data_list for rle in data[key]] for key in data_list[0]}
+
+
+def nms_keep(boxes, scores, iou_threshold):
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return numpy_nms(boxes.astype(np.float32), scores, iou_threshold).astype(np.int64)
+
+
+class SamAutomaticMaskEngine(SegmentAnythingONNX):
+    mask_threshold: float = 0.0
+
+    def __init__(
+        self,
+        encoder_model_path, decoder_model_path, target_size=1024, input_size=(684, 1024),
+        points_per_side: Optional[int] = 32,
+        points_per_batch: int = 64,
+        pred_iou_thresh: float = 0.88,
+        stability_score_thresh: float = 0.95,
+        stability_score_offset: float = 1.0,
+        box_nms_thresh: float = 0.7,
+        crop_n_layers: int = 0,
+        crop_nms_thresh: float = 0.7,
+        crop_overlap_ratio: float = 512 / 1500,
+        crop_n_points_downscale_factor: int = 1,
+        point_grids: Optional[List[np.ndarray]] = None,
+        min_mask_region_area: int = 0,
+        output_mode: str = "binary_mask",
+        num_workers: Optional[int] = None,
+    ) -> None:
+        super().__init__(encoder_model_path, decoder_model_path, target_size, input_size)
+        if (points_per_side is None) == (point_grids is None):
+            raise ValueError("Exactly one of points_per_side or point_grid must be provided.")
+        if points_per_side is not None:
+            self.point_grids = build_all_layer_point_grids(
+                points_per_side,
+                crop_n_layers,
+                crop_n_points_downscale_factor,
+            )
+        else:
+            self.point_grids = point_grids
+        if output_mode not in ["binary_mask", "uncompressed_rle", "coco_rle"]:
+            raise ValueError(f"Unknown output_mode {output_mode}.")
+
+        self.points_per_batch = points_per_batch
+        self.pred_iou_thresh = pred_iou_thresh
+        self.stability_score_thresh = stability_score_thresh
+        self.stability_score_offset = stability_score_offset
+        self.box_nms_thresh = box_nms_thresh
+        self.crop_n_layers = crop_n_layers
+        self.crop_nms_thresh = crop_nms_thresh
+        self.crop_overlap_ratio = crop_overlap_ratio
+        self.min_mask_region_area = min_mask_region_area
+        self.output_mode = output_mode
+        self.num_workers = num_workers or min(4, os.cpu_count() or 1)
+
+    def predict_masks(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        mask_data = self._generate_masks(image)
+
+        # Filter small disconnected regions and holes in masks
+        if self.min_mask_region_area > 0:
+            mask_data = self.postprocess_small_regions(
+                mask_data,
+                self.min_mask_region_area,
+                max(self.box_nms_thresh, self.crop_nms_thresh),
+            )
+
+        if self.output_mode == "coco_rle":
+            segmentations = [coco_encode_rle(rle) for rle in mask_data["rles"]]
+        elif self.output_mode == "binary_mask":
+            segmentations = [rle_to_mask(rle) for rle in mask_data["rles"]]
+        else:
+            segmentations = mask_data["rles"]
+
+        curr_anns = []
+        for idx, segmentation in enumerate(segmentations):
+            curr_anns.append({
+                "segmentation": segmentation,
+                "area": area_from_rle(mask_data["rles"][idx]),
+                "bbox": box_xyxy_to_xywh(mask_data["boxes"][idx].tolist()),
+                "predicted_iou": float(mask_data["iou_preds"][idx]),
+                "point_coords": [mask_data["points"][idx].tolist()],
+                "stability_score": float(mask_data["stability_score"][idx]),
+                "crop_box": box_xyxy_to_xywh(mask_data["crop_boxes"][idx].tolist()),
+            })
+        return curr_anns
+
+    def _generate_masks(self, image: np.ndarray) -> Dict[str, Any]:
+        orig_size = image.shape[:2]
+        crop_boxes, layer_idxs = generate_crop_boxes(
+            orig_size, self.crop_n_layers, self.crop_overlap_ratio
+        )
+        # 每次调用新建线程池，预装载后fork出的工作进程中不会残留失效的线程
+        with ThreadPoolExecutor(self.num_workers, thread_name_prefix="sam-encode") as encode_executor, \
+                ThreadPoolExecutor(self.num_workers, thread_name_prefix="sam-decode") as decode_executor:
+            embeddings = [
+                encode_executor.submit(self.encode, image[y0:y1, x0:x1, :])
+                for x0, y0, x1, y1 in crop_boxes
+            ]
+            data = cat_data([
+                self._process_crop(decode_executor, embedding.result(), crop_box, layer_idx, orig_size)
+                for crop_box, layer_idx, embedding in zip(crop_boxes, layer_idxs, embeddings)
+            ])
+
+        # Remove duplicate masks between crops, prefer masks from smaller crops
+        if len(crop_boxes) > 1:
+            scores = 1 / box_area(data["crop_boxes"].astype(np.float32))
+            data = filter_data(data, nms_keep(data["boxes"], scores, self.crop_nms_thresh))
+        return data
+
+    def _process_crop(
+        self,
+        executor: ThreadPoolExecutor,
+        embedding: Dict[str, Any],
+        crop_box: List[int],
+        crop_layer_idx: int,
+        orig_size: Tuple[int, ...],
+    ) -> Dict[str, Any]:
+        points_scale = np.array(embedding["original_size"])[None, ::-1]
+        points_for_image = self.point_grids[crop_layer_idx] * points_scale
+        batches = [
+            points_for_image[start: start + self.points_per_batch]
+            for start in range(0, len(points_for_image), self.points_per_batch)
+        ]
+        process = partial(self._process_batch, embedding=embedding, crop_box=crop_box, orig_size=orig_size)
+        data = cat_data(list(executor.map(process, batches)))
+
+        # Remove duplicates within this crop
+        data = filter_data(data, nms_keep(data["boxes"], data["iou_preds"], self.box_nms_thresh))
+        data["crop_boxes"] = np.tile(np.array(crop_box, dtype=np.int64), (len(data["iou_preds"]), 1))
+        return data
+
+    def _process_batch(
+        self,
+        points: np.ndarray,
+        embedding: Dict[str, Any],
+        crop_box: List[int],
+        orig_size: Tuple[int, ...],
+    ) -> Dict[str, Any]:
+        orig_h, orig_w = orig_size
+        x0, y0 = crop_box[:2]
+
+        # 每个点是一组独立的提示
+        prompts = [(point[None, :], np.ones(1, dtype=np.float32)) for point in points]
+        chunks = [prompts] if self.batch_decoding else [[prompt] for prompt in prompts]
+        masks, iou_preds = [], []
+        for chunk in chunks:
+            point_coords, point_labels = pack_prompts(chunk)
+            chunk_masks, chunk_iou_preds, _ = self.run_decoder_batch(
+                embedding["image_embedding"],
+                embedding["transform_matrix"],
+                point_coords,
+                point_labels,
+            )
+            masks.append(chunk_masks)
+            iou_preds.append(chunk_iou_preds)
+        masks = np.concatenate(masks)
+        num_masks = masks.shape[1]
+        masks = masks.reshape(-1, *masks.shape[2:])
+        iou_preds = np.concatenate(iou_preds).reshape(-1)
+        points = np.repeat(points, num_masks, axis=0)
+
+        # 先按预测IoU和稳定性分数筛选(在解码器输出分辨率上进行)，再只变换保留下的掩码
+        keep = iou_preds > self.pred_iou_thresh if self.pred_iou_thresh > 0.0 else np.ones(len(masks), dtype=bool)
+        masks, iou_preds, points = masks[keep], iou_preds[keep], points[keep]
+        stability_score = stability_scores(masks, self.mask_threshold, self.stability_score_offset)
+        if self.stability_score_thresh > 0.0:
+            keep = stability_score >= self.stability_score_thresh
+            masks, iou_preds, points, stability_score = \
+                masks[keep], iou_preds[keep], points[keep], stability_score[keep]
+        if len(masks) == 0:
+            return cat_data([])
+
+        inv_transform_matrix = np.linalg.inv(embedding["transform_matrix"])
+        masks = warp_masks(masks[None], embedding["original_size"], inv_transform_matrix)[0]
+        masks = masks > self.mask_threshold
+        boxes = masks_to_boxes(masks) + np.array([[x0, y0, x0, y0]])
+
+        # Filter boxes that touch crop boundaries
+        keep = ~is_box_near_crop_edge(boxes, crop_box, [0, 0, orig_w, orig_h])
+        return {
+            "iou_preds": iou_preds[keep],
+            "points": points[keep] + np.array([[x0, y0]]),
+            "stability_score": stability_score[keep],
+            "boxes": boxes[keep],
+            "rles": uncrop_mask_to_rle(masks[keep], crop_box, orig_h, orig_w),
+        }
+
+    @staticmethod
+    def postprocess_small_regions(mask_data: Dict[str, Any], min_area: int, nms_thresh: float) -> Dict[str, Any]:
+        """Removes small disconnected regions and holes in masks, then reruns box NMS."""
+        if len(mask_data["rles"]) == 0:
+            return mask_data
+
+        masks = []
+        scores = []
+        for rle in mask_data["rles"]:
+            mask = rle_to_mask(rle)
+            mask, changed = remove_small_regions(mask, min_area, mode="holes")
+            unchanged = not changed
+            mask, changed = remove_small_regions(mask, min_area, mode="islands")
+            unchanged = unchanged and not changed
+            masks.append(mask)
+            # 未修改过的掩码优先保留
+            scores.append(float(unchanged))
+
+        masks = np.stack(masks)
+        boxes = masks_to_boxes(masks)
+        keep = nms_keep(boxes, np.array(scores), nms_thresh)
+        changed = [i for i in keep if scores[i] == 0.0]
+        for i, rle in zip(changed, mask_to_rle(masks[changed]) if changed else []):
+            mask_data["rles"][i] = rle
+            mask_data["boxes"][i] = boxes[i]
+        return filter_data(mask_data, keep)
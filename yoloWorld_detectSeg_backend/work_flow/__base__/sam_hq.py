@@ -6,6 +6,8 @@
 
 from copy import deepcopy
 
+from work_flow.utils.sam_batch import has_dynamic_batch, pack_prompts, warp_masks
+
 
 class SegmentAnythingHQONNX:
     """Segmentation model using SAM-HQ"""
@@ -28,6 +30,8 @@ def __init__(self, encoder_model_path, decoder_model_path, target_size=1024, inp
         self.decoder_session = onnxruntime.InferenceSession(
             decoder_model_path, providers=providers
         )
+        # 解码器导出时提示的批次维为动态才能一次解码多组提示
+        self.batch_decoding = has_dynamic_batch(self.decoder_session, "point_coords")
 
     def get_input_points(self, prompt):
         """Get input points"""
@@ -136,6 +140,43 @@ def run_decoder(
 
         return transformed_masks
 
+    def run_decoder_batch(
+            self,
+            image_embeddings,
+            interm_embeddings,
+            transform_matrix,
+            point_coords,
+            point_labels,
+    ):
+        """Run decoder on packed prompts
+        point_coords: [B, N, 2], point_labels: [B, N], padded with label -1.
+        Returns the low level masks [B, M, H, W] of self.input_size.
+        """
+        onnx_coord = self.apply_coords(
+            point_coords, self.input_size, self.target_size
+        ).astype(np.float32)
+        onnx_coord = np.concatenate(
+            [onnx_coord, np.ones((*onnx_coord.shape[:2], 1), dtype=np.float32)],
+            axis=2,
+        )
+        onnx_coord = np.matmul(onnx_coord, transform_matrix.T)
+        onnx_coord = onnx_coord[:, :, :2].astype(np.float32)
+
+        decoder_inputs = {
+            "image_embeddings": image_embeddings,
+            "interm_embeddings": interm_embeddings,
+            "point_coords": onnx_coord,
+            "point_labels": point_labels.astype(np.float32),
+            "mask_input": np.zeros((1, 1, 256, 256), dtype=np.float32),
+            "has_mask_input": np.zeros(1, dtype=np.float32),
+            "orig_im_size": np.array(self.input_size, dtype=np.float32),
+        }
+        if has_dynamic_batch(self.decoder_session, "mask_input"):
+            decoder_inputs["mask_input"] = np.zeros((len(onnx_coord), 1, 256, 256), dtype=np.float32)
+            decoder_inputs["has_mask_input"] = np.zeros(len(onnx_coord), dtype=np.float32)
+        masks, _, _ = self.decoder_session.run(None, decoder_inputs)
+        return masks
+
     def transform_masks(self, masks, original_size, transform_matrix):
         """Transform masks
         Transform the masks back to the original image size.
@@ -206,4 +247,25 @@ def predict_masks(self, embedding, prompt, transform_prompt=True):
             input_points,
             input_labels,
         )
-        return masks
\ No newline at end of file
+        return masks
+
+    def predict_masks_batch(self, embedding, prompts):
+        """
+        Predict masks for several prompts on the same image.
+        prompts: [(points, labels), ...], returns masks [B, M, H, W] of the original size.
+        """
+        chunk_size = len(prompts) if self.batch_decoding else 1
+        masks = []
+        for start in range(0, len(prompts), chunk_size):
+            point_coords, point_labels = pack_prompts(prompts[start: start + chunk_size])
+            masks.append(self.run_decoder_batch(
+                embedding["image_embeddings"],
+                embedding["interm_embeddings"],
+                embedding["transform_matrix"],
+                point_coords,
+                point_labels,
+            ))
+        inv_transform_matrix = np.linalg.inv(embedding["transform_matrix"])
+        return warp_masks(
+            np.concatenate(masks), embedding["original_size"], inv_transform_matrix
+        )
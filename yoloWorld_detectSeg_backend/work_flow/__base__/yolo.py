@@ -66,7 +66,10 @@ def __init__(self, model_config, on_message) -> None:
             self.input_width = self.config.get("input_width", 640)
             self.input_height = self.config.get("input_height", 640)
         else:
-            self.net = OnnxBaseModel(model_abs_path, __preferred_device__)
+            self.net = OnnxBaseModel(
+                model_abs_path, __preferred_device__,
+                batching=self.config.get("batching"),
+            )
             (
                 _,
                 _,
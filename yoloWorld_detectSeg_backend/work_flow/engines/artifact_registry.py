@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+import onnx
+
+from utils.backend_utils.file_lock import FileLock
+
+'''
+模型文件登记表
+- 每个权重文件只在首次出现或文件变化(大小/修改时间)时计算sha256、执行onnx校验并提取metadata_props
+- 之后的装载只做一次stat比对，校验结果和元数据直接取自登记表
+- 登记表为本地json文件，与权重管理中的WeightModel通过weight_id关联
+- web进程与审核进程池都会写登记表，读改写在跨进程文件锁内进行，写入临时文件后os.replace替换，读取方不会读到写了一半的文件
+'''
+
+ARTIFACT_DIR = os.environ.get(
+    "ARTIFACT_DIR", os.path.join(os.path.expanduser("~"), ".cache", "yanglao_artifacts")
+)
+REGISTRY_NAME = "registry.json"
+LOCK_NAME = "registry.lock"
+
+_registry_lock = threading.Lock()
+
+
+def _registry_path():
+    return os.path.join(ARTIFACT_DIR, REGISTRY_NAME)
+
+
+def _lock_path():
+    return os.path.join(ARTIFACT_DIR, LOCK_NAME)
+
+
+def _load_registry():
+    try:
+        with open(_registry_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_record(file_path, record):
+    with _registry_lock, FileLock(_lock_path()):
+        # 锁内重新读取，保留其他进程在本进程计算期间写入的记录
+        registry = _load_registry()
+        registry[file_path] = record
+        tmp_path = f"{_registry_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(registry, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, _registry_path())
+
+
+def compute_sha256(file_path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def validate_artifact(file_path):
+    """校验模型文件并提取元数据，返回 (是否有效, 错误信息, 元数据)"""
+    if not file_path.lower().endswith(".onnx"):
+        return True, None, {}
+    try:
+        onnx.checker.check_model(file_path)
+        model = onnx.load(file_path, load_external_data=False)
+    except Exception as e:  # noqa
+        return False, str(e), {}
+    return True, None, {prop.key: prop.value for prop in model.metadata_props}
+
+
+def get_artifact(file_path, validate=True, weight_id=None, force=False):
+    """获取文件的登记信息，文件未登记或已变化时重新登记
+
+    validate为False时只保证sha256可用，校验推迟到下一次需要时进行
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    with _registry_lock:
+        record = _load_registry().get(file_path)
+    unchanged = record is not None and record["size"] == stat.st_size \
+        and record["mtime"] == stat.st_mtime_ns and not force
+    if unchanged and (not validate or record["valid"] is not None) \
+            and (weight_id is None or record.get("weight_id") == weight_id):
+        return record
+    if not unchanged:
+        record = {
+            "weight_id": record.get("weight_id") if record else None,
+            "sha256": compute_sha256(file_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "valid": None,
+            "error": None,
+            "metadata": {},
+            "check_time": None,
+        }
+    if weight_id is not None:
+        record["weight_id"] = weight_id
+    if validate and record["valid"] is None:
+        record["valid"], record["error"], record["metadata"] = validate_artifact(file_path)
+        record["check_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if not record["valid"]:
+            logging.warning(f"Invalid model artifact {file_path}: {record['error']}")
+    _save_record(file_path, record)
+    return record
+
+
+def file_sha256(file_path):
+    return get_artifact(file_path, validate=False)["sha256"]
+
+
+def get_artifact_metadata(file_path, field):
+    return get_artifact(file_path)["metadata"].get(field)
+
+
+def find_artifact(file_path):
+    """只查询登记表，不计算也不校验"""
+    if not file_path:
+        return None
+    with _registry_lock:
+        return _load_registry().get(os.path.abspath(file_path))
+
+
+def register_weight(weight, force=False):
+    """登记WeightModel对应的本地文件，返回登记信息，本地文件不存在时返回None"""
+    if not weight.local_path or not os.path.isfile(weight.local_path):
+        return None
+    return get_artifact(weight.local_path, weight_id=weight.id, force=force)
@@ -0,0 +1,155 @@
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+import numpy as np
+
+'''
+动态微批调度
+- 并发调用方提交的单个blob进入队列，调度线程在时间窗口内或凑满最大批量后合并为一次 ort_session.run
+- 仅合并输入形状一致的请求，结果按各请求的批量大小沿第0维切回
+- 仅适用于第0维为动态批量的单输入模型
+- 并发来源：ModelManager中的无状态请求在各自的模型视图上并发推理，视图共享同一个OnnxBaseModel及其调度器；
+  在线推理由版本配置的batching按模型开启(config.INFER_BATCHING为默认值，默认不开启)，审核工作进程为单线程，不开启
+- 队列中只有一个请求时立即推理，不等待时间窗口，单个请求不会因批处理变慢
+'''
+
+_schedulers = weakref.WeakSet()  # 当前进程内所有调度器，用于汇总指标
+
+
+class BatchScheduler:
+    MAX_BATCH_SIZE = 8
+    BATCH_WINDOW = 0.005  # 秒
+
+    def __init__(self, session, input_name, name=None, max_batch_size=None, batch_window=None):
+        self.session = session
+        self.input_name = input_name
+        self.name = name
+        self.max_batch_size = max_batch_size or self.MAX_BATCH_SIZE
+        self.batch_window = self.BATCH_WINDOW if batch_window is None else batch_window
+        self.queue = queue.Queue()
+        self.pending = None  # 形状不一致、留给下一批的请求
+        self.metrics_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_samples = 0
+        self.num_batches = 0
+        self.max_achieved = 0
+        self.last_batch_size = 0
+        self.closed = False
+        self.thread = None
+        self.start()
+        _schedulers.add(self)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop, name=f"batch-{self.name}", daemon=True)
+        self.thread.start()
+
+    def reset_after_fork(self):
+        """fork后子进程中只剩调用fork的线程，需重建队列、锁与调度线程"""
+        self.queue = queue.Queue()
+        self.pending = None
+        self.metrics_lock = threading.Lock()
+        if not self.closed:
+            self.start()
+
+    def submit(self, blob):
+        """提交一个blob并阻塞等待该blob对应的输出列表"""
+        if self.closed:
+            raise RuntimeError(f"Batch scheduler of {self.name} is closed")
+        future = Future()
+        self.queue.put((blob, future))
+        return future.result()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+
+    def collect(self):
+        """取出一批形状一致的请求：首个请求到达时队列中还有其他请求才最多等待batch_window"""
+        first = self.pending if self.pending is not None else self.queue.get()
+        self.pending = None
+        if first is None:
+            return None
+        batch, size = [first], len(first[0])
+        if self.queue.empty():  # 单个请求不等待
+            return batch
+        deadline = time.perf_counter() + self.batch_window
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            if item[0].shape[1:] != first[0].shape[1:] or item[0].dtype != first[0].dtype \
+                    or size + len(item[0]) > self.max_batch_size:
+                self.pending = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.collect()
+            if batch is None:
+                break
+            futures = [future for _, future in batch]
+            try:
+                blobs = [blob for blob, _ in batch]
+                merged = blobs[0] if len(blobs) == 1 else np.concatenate(blobs, axis=0)
+                outs = self.session.run(None, {self.input_name: merged})
+            except Exception as e:  # noqa
+                logging.error(f"Batched inference of {self.name} failed: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.update_metrics(len(merged), len(batch))
+            start = 0
+            for blob, future in batch:
+                stop = start + len(blob)
+                future.set_result([out[start:stop] for out in outs])
+                start = stop
+
+    def update_metrics(self, batch_size, num_requests):
+        with self.metrics_lock:
+            self.num_requests += num_requests
+            self.num_samples += batch_size
+            self.num_batches += 1
+            self.last_batch_size = batch_size
+            self.max_achieved = max(self.max_achieved, batch_size)
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            return {
+                "name": self.name,
+                "queueDepth": self.queue.qsize() + (self.pending is not None),
+                "maxBatchSize": self.max_batch_size,
+                "batchWindow": self.batch_window,
+                "requests": self.num_requests,
+                "batches": self.num_batches,
+                "avgBatchSize": self.num_samples / self.num_batches if self.num_batches else 0,
+                "lastBatchSize": self.last_batch_size,
+                "maxAchievedBatchSize": self.max_achieved,
+            }
+
+
+def _reset_schedulers_after_fork():
+    for scheduler in list(_schedulers):
+        scheduler.reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_schedulers_after_fork)
+
+
+def get_batching_metrics():
+    return [scheduler.get_metrics() for scheduler in list(_schedulers) if not scheduler.closed]
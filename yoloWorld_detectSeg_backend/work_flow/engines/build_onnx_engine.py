@@ -1,11 +1,17 @@
+import logging
 import os
-import onnx
+import numpy as np
 import onnxruntime as ort
 
+from .artifact_registry import get_artifact_metadata
+from .batch_scheduler import BatchScheduler
+from .ort_cache import get_cache_path
+
 
 class OnnxBaseModel:
     def __init__(
-        self, model_path, device_type: str = "cpu", log_severity_level: int = 3
+        self, model_path, device_type: str = "cpu", log_severity_level: int = 3,
+        batching=None, use_cache=True,
     ):
         self.sess_opts = ort.SessionOptions()
         self.sess_opts.log_severity_level = log_severity_level
@@ -13,22 +19,97 @@ def __init__(
             self.sess_opts.inter_op_num_threads = int(
                 os.environ["OMP_NUM_THREADS"]
             )
+        if "ORT_INTRA_OP_NUM_THREADS" in os.environ:
+            # 预装载后fork的部署方式下须设为1，ORT线程池无法跨fork使用
+            self.sess_opts.intra_op_num_threads = int(
+                os.environ["ORT_INTRA_OP_NUM_THREADS"]
+            )
 
         self.providers = ["CPUExecutionProvider"]
         if device_type.lower() == "gpu":
             # 如果设备是 GPU，则优先使用 TensorRT 提供器加速
             self.providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
-        self.ort_session = ort.InferenceSession(
-            model_path,
-            providers=self.providers,
-            sess_options=self.sess_opts,
-        )
         self.model_path = model_path
+        self.cache_path = None  # 实际装载的优化图缓存路径
+        self.ort_session = self.create_session(use_cache)
+        self.scheduler = None
+        if batching:
+            self.enable_batching(**(batching if isinstance(batching, dict) else {}))
+
+    def create_session(self, use_cache=True):
+        """优先装载已缓存的优化图，没有缓存时在本次图优化的同时写入缓存"""
+        cache_path = None
+        if use_cache:
+            try:
+                cache_path = get_cache_path(self.model_path, self.providers)
+            except OSError as e:
+                logging.warning(f"Could not use ORT cache for {self.model_path}: {e}")
+        if cache_path is not None and os.path.exists(cache_path):
+            self.sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                session = ort.InferenceSession(
+                    cache_path, providers=self.providers, sess_options=self.sess_opts,
+                )
+                self.cache_path = cache_path
+                return session
+            except Exception as e:  # noqa
+                logging.warning(f"Invalid ORT cache {cache_path}, rebuilding: {e}")
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+            self.sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if cache_path is not None:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            self.sess_opts.optimized_model_filepath = tmp_path
+            try:
+                session = ort.InferenceSession(
+                    self.model_path, providers=self.providers, sess_options=self.sess_opts,
+                )
+            except Exception as e:  # noqa 部分模型(如外部数据分片)无法序列化优化图
+                logging.warning(f"Could not write ORT cache for {self.model_path}: {e}")
+                self.sess_opts.optimized_model_filepath = ""
+            else:
+                if os.path.exists(tmp_path):
+                    os.replace(tmp_path, cache_path)
+                return session
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return ort.InferenceSession(
+            self.model_path, providers=self.providers, sess_options=self.sess_opts,
+        )
+
+    def enable_batching(self, max_batch_size=None, batch_window=None):
+        """开启动态微批：batch_window单位为毫秒，仅对输入与全部输出的第0维为同一命名动态维的单输入模型生效"""
+        if len(self.ort_session.get_inputs()) != 1:
+            return False
+        batch_dim = self.get_input_shape()[0]
+        if not isinstance(batch_dim, str) or any(
+                not output.shape or output.shape[0] != batch_dim for output in self.ort_session.get_outputs()):
+            logging.info(f"Batching disabled for {self.model_path}: batch dim is not shared by input and outputs")
+            return False
+        self.scheduler = BatchScheduler(
+            self.ort_session, self.get_input_name(),
+            name=os.path.basename(self.model_path),
+            max_batch_size=max_batch_size,
+            batch_window=batch_window / 1000 if batch_window is not None else None,
+        )
+        return True
+
+    def close(self):
+        if getattr(self, "scheduler", None) is not None:
+            self.scheduler.close()
+            self.scheduler = None
+
+    def __del__(self):
+        self.close()
 
     def get_ort_inference(
         self, blob, inputs=None, extract=True, squeeze=False
     ):
-        if inputs is None:
+        if inputs is None and self.scheduler is not None:
+            outs = self.scheduler.submit(blob)
+        elif inputs is None:
             inputs = self.get_input_name()
             outs = self.ort_session.run(None, {inputs: blob})
         else:
@@ -39,6 +120,13 @@ def get_ort_inference(
             outs = outs.squeeze(axis=0)
         return outs
 
+    def get_ort_batch_inference(self, blob, max_batch_size=32):
+        """沿第0维分块推理并拼接第一个输出，第0维为固定值的模型按该值分块"""
+        batch_dim = self.get_input_shape()[0]
+        step = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else max_batch_size
+        outs = [self.get_ort_inference(blob[i:i + step]) for i in range(0, len(blob), step)]
+        return np.concatenate(outs, axis=0)
+
     def get_input_name(self):
         return self.ort_session.get_inputs()[0].name
 
@@ -49,9 +137,7 @@ def get_output_name(self):
         return [out.name for out in self.ort_session.get_outputs()]
 
     def get_metadata_info(self, field):
-        model = onnx.load(self.model_path)
-        metadata = model.metadata_props
-        for prop in metadata:
-            if prop.key == field:
-                return prop.value
-        return None
+        value = self.ort_session.get_modelmeta().custom_metadata_map.get(field)
+        if value is None:  # 优化图缓存可能不保留元数据，回退到源文件的登记信息
+            value = get_artifact_metadata(self.model_path, field)
+        return value
@@ -103,7 +103,6 @@
 conf_model_list = [
     "damo_yolo",
     "gold_yolo",
-    "grounding_dino",
     "rtdetr",
     "rtdetrv2",
     "yolo_nas",
@@ -136,6 +135,14 @@
     "yolox",
 ]
 
+# 阈值等参数通过DetectionRequest随调用传递的模型，实例不可变，可不加锁并发推理
+request_model_list = [
+    "grounding_dino",
+]
+
+# 推理依赖跨请求延续的状态(跟踪器、视频记忆)的模型，超参数须作用于共享实例并在模型锁内串行推理
+stateful_model_list = reset_tracker_model_list
+
 iou_model_list = [
     "damo_yolo",
     "gold_yolo",
@@ -169,7 +176,6 @@
 preserve_existing_annotations_state_model_list = [
     "damo_yolo",
     "gold_yolo",
-    "grounding_dino",
     "rtdetr",
     "rtdetrv2",
     "yolo_nas",
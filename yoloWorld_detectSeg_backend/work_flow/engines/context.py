@@ -0,0 +1,128 @@
+import copy
+
+from utils.backend_utils.image_store import image_store, is_image_ref
+from work_flow.utils import xyxyxyxy_to_xyxy, base64_img_to_rgb_cv_img
+from work_flow.utils.canvas import Canvas
+from .constant import (marks_model_list, reset_tracker_model_list, conf_model_list, iou_model_list,
+                       preserve_existing_annotations_state_model_list, request_model_list, stateful_model_list)
+from .types import DetectionRequest
+
+
+class InferenceContext:
+    """单次推理请求的上下文
+
+    携带解码后的输入、超参数、输出模式与该请求独占的绘制画布，
+    请求之间不再共享ModelManager/Canvas上的可变状态。
+    """
+
+    def __init__(self, model_config, hyper=None):
+        self.model_config = model_config
+        self.hyper = hyper  # 原始超参数，用于生成结果缓存键
+        self.kwargs = {}  # 传给model.predict_shapes的参数
+        self.post_kwargs = {}  # 传给Canvas的绘制参数(裁剪等)
+        self.model_hypers = []  # 需作用于模型实例的超参数 [(setter, value)]
+        self.output_mode = None
+        self.canvas = Canvas()
+        self.result = None
+        self.request = None  # 无状态模型的检测请求，阈值等随调用传递而不作用于模型实例
+        self.acquired = False  # 是否持有模型池中该模型的引用，推理结束后由ModelManager释放
+        if self.model_type in request_model_list:
+            self.request = self.kwargs['request'] = DetectionRequest()
+        if hyper is not None:
+            self.load_hyper(hyper)
+
+    @property
+    def model_type(self):
+        return self.model_config["type"] if self.model_config is not None else None
+
+    def load_hyper(self, hyper):
+        for key, value in hyper.items():
+            if key == 'origin_image':
+                self.kwargs['image'] = self.load_image(value)
+            elif key == 'mask_image':
+                self.kwargs['mask'] = self.load_image(value)
+            elif key == 'minor_image':
+                self.kwargs['minor'] = self.load_image(value)
+            elif key == 'shapes_prompt':
+                self.set_marks(value)
+            elif key == "conf_threshold" and self.request is not None:
+                self.request.box_threshold = value
+            elif key == "conf_threshold":
+                self.add_model_hyper(conf_model_list, 'set_auto_labeling_conf', value)
+            elif key == 'sim_threshold':
+                self.kwargs['sim_threshold'] = value
+            elif key == 'iou_threshold' and self.request is not None:
+                self.request.iou_threshold = value
+            elif key in ['iou_threshold', 'box_threshold']:
+                self.add_model_hyper(iou_model_list, 'set_auto_labeling_iou', value)
+            elif key == 'toggle_preserve_existing_annotations' and self.request is not None:
+                self.request.replace = not value
+            elif key == 'toggle_preserve_existing_annotations':
+                self.add_model_hyper(preserve_existing_annotations_state_model_list,
+                                     'set_auto_labeling_preserve_existing_annotations_state', value)
+            elif key == 'reset_tracker':
+                if value:
+                    self.add_model_hyper(reset_tracker_model_list, 'set_auto_labeling_reset_tracker')
+            elif key == 'output_mode':
+                self.output_mode = value
+            elif key in ['text_prompt', 'run_tracker', 'mask_enhance', 'prompt_mode', 'scale', 'mode']:
+                self.kwargs[key] = value
+            else:  # 裁剪参数
+                self.post_kwargs[key] = value
+
+    @staticmethod
+    def load_image(value):
+        """图像超参数可以是已上传图像的内容引用，也可以是base64字符串"""
+        if is_image_ref(value):
+            return image_store.get(value)
+        return base64_img_to_rgb_cv_img(value)
+
+    def add_model_hyper(self, model_list, setter, *args):
+        if self.model_type not in model_list or (args and args[0] is None):
+            return
+        self.model_hypers.append((setter, args))
+
+    def set_marks(self, value):
+        """Set auto labeling marks
+        (For example, for segment_anything model, it is the marks for)
+        """
+        if value is None:
+            return
+        marks = []
+        for v in value:
+            mark = {'type': v['type']}
+            if v['type'] == 'point':
+                mark['data'] = [v['x'], v['y']]
+            elif v['type'] == 'rectangle':
+                points = [(p['x'], p['y']) for p in v['points']]
+                mark['data'] = xyxyxyxy_to_xyxy(points)
+            marks.append(mark)
+        self.add_model_hyper(marks_model_list, 'set_auto_labeling_marks', marks)
+
+    @property
+    def stateful(self):
+        """跟踪类模型的状态跨请求延续，只能在共享实例上串行推理"""
+        return self.model_type in stateful_model_list
+
+    def apply(self, model):
+        """将本次请求的超参数作用于模型实例，须在模型锁内调用"""
+        for setter, args in self.model_hypers:
+            getattr(model, setter)(*args)
+        if self.output_mode is not None:
+            model.set_output_mode(self.output_mode)
+
+    def bind(self, model):
+        """返回本次请求使用的模型视图
+        视图是共享实例的浅拷贝：权重与推理会话共用，阈值、标记、输出模式等超参数只设置在视图上，
+        共享实例不被修改，多个请求可并发推理
+        """
+        if not self.model_hypers and self.output_mode is None:
+            return model
+        view = copy.copy(model)
+        self.apply(view)
+        return view
+
+    def load_results(self, results):
+        self.result = results
+        self.canvas.remove_results()
+        self.canvas.load_results(results)
@@ -8,7 +8,6 @@
 import cv2
 import numpy as np
 import yaml
-import onnx
 import urllib.request
 from urllib.parse import urlparse
 import re
@@ -31,6 +30,7 @@
 
 from abc import abstractmethod
 
+from .artifact_registry import get_artifact
 from .types import AutoLabelingResult
 
 required_config_names = []
@@ -233,10 +233,9 @@ def get_model_abs_path(self, model_config, model_path_field_name):
                     if os.path.exists(local_model_abs_path):
                         print(local_model_abs_path)
                         if local_model_abs_path.lower().endswith(".onnx"):
-                            try:
-                                onnx.checker.check_model(local_model_abs_path)
-                            except onnx.checker.ValidationError as e:
-                                self.on_message(f"{str(e)}")
+                            artifact = get_artifact(local_model_abs_path)  # 文件未变化时直接取登记的校验结果
+                            if not artifact["valid"]:
+                                self.on_message(f"{artifact['error']}")
                                 self.on_message("Action: Delete and redownload...")
                                 try:
                                     os.remove(local_model_abs_path)
@@ -271,10 +270,9 @@ def get_filename_from_url(url):
             )
             if os.path.exists(model_abs_path):
                 if model_abs_path.lower().endswith(".onnx"):
-                    try:
-                        onnx.checker.check_model(model_abs_path)
-                    except onnx.checker.ValidationError as e:
-                        self.on_message(f"{str(e)}")
+                    artifact = get_artifact(model_abs_path)  # 文件未变化时直接取登记的校验结果
+                    if not artifact["valid"]:
+                        self.on_message(f"{artifact['error']}")
                         self.on_message("Action: Delete and redownload...")
                         try:
                             os.remove(model_abs_path)
@@ -1,3 +1,5 @@
+import gc
+import json
 import logging
 import os
 import copy
@@ -9,21 +11,26 @@
 
 import cv2
 import mmcv
+import numpy as np
 import yaml
 
-from threading import Lock
+from threading import Lock, RLock
+from collections import OrderedDict
+
+import psutil
 
 from torch.fx.experimental.proxy_tensor import track_tensor
 
+import config
 from utils.backend_utils.colorprinter import print_cyan
 from work_flow.engines import load_model_class
 from work_flow.engines.types import AutoLabelingResult
-from work_flow.utils import xyxyxyxy_to_xyxy, base64_img_to_rgb_cv_img
 from work_flow.utils.singal import AutoSignal
 from work_flow.configs.config import get_config, save_config
 from work_flow.configs import auto_labeling as auto_labeling_configs
-from .constant import CUSTOM_MODELS, marks_model_list, reset_tracker_model_list, conf_model_list, iou_model_list, \
-    preserve_existing_annotations_state_model_list, PARAMS
+from .constant import CUSTOM_MODELS, PARAMS
+from .context import InferenceContext
+from .result_cache import ResultCache
 
 CONFIG_ROOT = 'work_flow/configs'
 
@@ -31,23 +38,30 @@
 class ModelManager:
     """Model manager"""
     MAX_NUM_CUSTOM_MODELS = 5
+    MAX_POOL_SOURCES = 64  # 保留装载配置的模型池主键数，超出后丢弃最久未使用的
     model_configs_changed = AutoSignal(list)  # 模型-配置列表
     new_model_status = AutoSignal(str)  # 新载模型-状态
     new_model_status.connect(print_cyan)
     model_loaded = AutoSignal(dict)   # 新载模型-信息
     output_modes_changed = AutoSignal(dict, str)
-    def __init__(self):
+    def __init__(self, max_pool_memory=None, result_cache=None, batching=None):
         super().__init__()
         self.model_index = {}
         self.model_configs = {}
         self.task_configs = {}  # 存放任务配置及其下model_id
         self.loaded_model_config = None
         self.loaded_model_config_lock = Lock()
+        # 常驻模型池：pool_key -> 已装载的model_config，按最近使用排序
+        self.model_pool = OrderedDict()
+        self.model_pool_lock = Lock()
+        # 常驻模型池内存预算(字节)，超出后按LRU淘汰
+        self.max_pool_memory = max_pool_memory if max_pool_memory is not None else config.MODEL_POOL_MAX_MEMORY
         self.model_download_thread = None
-        self.model_execution_thread = None
-        self.model_execution_thread_lock = Lock()
-        self.kwargs = {}
-        self.post_kwargs = {}
+        self.model_loading_lock = Lock()  # 串行装载，避免重复装载并保证内存统计准确
+        self.pool_sources = OrderedDict()  # pool_key -> (model_id, 装载配置)，被淘汰后可按原配置重新装载
+        self.result_cache = result_cache  # 推理结果缓存，为None时不缓存
+        # 默认的动态微批配置：无状态请求并发使用同一实例，单图推理经调度器合并为一批
+        self.batching = batching
 
     def load_model_configs(self, releases):
         """Load model configs"""
@@ -77,45 +91,6 @@ def get_model_hypers_local(self):
         })
         return params
 
-    def set_model_hyper(self, hyper):
-        self.kwargs.clear()
-        for key, value in hyper.items():
-            if key == 'origin_image':
-                self.kwargs['image'] = base64_img_to_rgb_cv_img(value)
-            elif key == 'mask_image':
-                self.kwargs['mask'] = base64_img_to_rgb_cv_img(value)
-            elif key == 'minor_image':
-                self.kwargs['minor'] = base64_img_to_rgb_cv_img(value)
-            elif key == 'shapes_prompt':
-                self.set_auto_labeling_marks(value)
-            elif key == "conf_threshold":
-                self.set_auto_labeling_conf(value)
-            elif key == 'sim_threshold':
-                self.kwargs['sim_threshold'] = value
-            elif key in ['iou_threshold', 'box_threshold']:
-                self.set_auto_labeling_iou(value)
-            elif key == 'toggle_preserve_existing_annotations':
-                self.set_auto_labeling_preserve_existing_annotations_state(value)
-            elif key == 'reset_tracker':
-                if value:
-                    self.set_auto_labeling_reset_tracker()
-            elif key == 'output_mode':
-                self.set_output_mode(value)
-            elif key == 'text_prompt':
-                self.kwargs['text_prompt'] = value
-            elif key == 'run_tracker':
-                self.kwargs['run_tracker'] = value
-            elif key == 'mask_enhance':
-                self.kwargs['mask_enhance'] = value
-            elif key == 'prompt_mode':
-                self.kwargs['prompt_mode'] = value
-            elif key == 'scale':
-                self.kwargs['scale'] = value
-            elif key == 'mode':
-                self.kwargs['mode'] = value
-            else:  # 裁剪参数
-                self.post_kwargs[key] = value
-
     def set_output_mode(self, mode):
         """Set output mode"""
         if self.loaded_model_config and self.loaded_model_config["model"]:
@@ -191,32 +166,206 @@ def find_model_type(self, model_type, configs):
         return 'unkown', 'unkown'
 
 
-    def load_model(self, model_id, config=None):
-        """Run model loading in a thread"""
+    def load_model(self, model_id, config=None, weight_ids=None):
+        """Run model loading in a thread
+        本次装载的配置为版本配置的副本再合并config，共享的版本配置不被修改，并发装载同一版本的不同权重互不影响
+        """
         print_cyan("Loading model: {model_name}. Please wait...".format(
                 model_name=self.model_configs[model_id]['display_name']))
+        snapshot = copy.deepcopy(self.model_configs[model_id])
         if config is not None:
-            self.model_configs[model_id].update(config)
-        self._load_model(model_id)
-
-    def _load_model(self, model_id):
+            snapshot.update(config)
+        pool_key = self.get_pool_key(model_id, weight_ids, snapshot)
+        with self.model_pool_lock:
+            if pool_key in self.model_pool:  # 命中常驻模型池，直接切换
+                self.model_pool.move_to_end(pool_key)
+                self.loaded_model_config = self.model_pool[pool_key]
+                print_cyan("Model hit in pool: {model_name}".format(
+                    model_name=self.loaded_model_config['display_name']))
+                return self.loaded_model_config
+            self.add_pool_source(pool_key, model_id, snapshot)
+        return self._load_model(model_id, pool_key, snapshot)
+
+    def add_pool_source(self, pool_key, model_id, model_config):
+        """记录模型池主键的装载配置，只保留最近使用的MAX_POOL_SOURCES个；须在模型池锁内调用"""
+        self.pool_sources[pool_key] = (model_id, model_config)
+        self.pool_sources.move_to_end(pool_key)
+        while len(self.pool_sources) > self.MAX_POOL_SOURCES:
+            self.pool_sources.popitem(last=False)
+
+    @staticmethod
+    def as_pool_key(pool_key):
+        """会话序列化后主键中的元组可能变为列表，还原为可哈希的主键"""
+        if pool_key is None or isinstance(pool_key, tuple):
+            return pool_key
+        model_id, weight_ids, params = pool_key
+        return model_id, tuple(tuple(item) for item in weight_ids), params
+
+    def get_model(self, pool_key=None, acquire=False, source=None):
+        """按模型池主键获取已装载模型，未指定时返回最近装载的模型
+        acquire为True时在模型池锁内登记引用，引用释放前该模型即使被淘汰也不会卸载，须配对调用release
+        source为可选的回调，返回 (model_id, 装载配置)：本进程从未装载过该主键时(如serve.py下由其他工作进程装载)据此装载
+        """
+        pool_key = self.as_pool_key(pool_key)
+        with self.model_pool_lock:
+            if pool_key is None:
+                model_config = self.loaded_model_config
+            else:
+                model_config = self.model_pool.get(pool_key)
+                if model_config is not None:
+                    self.model_pool.move_to_end(pool_key)
+            if model_config is not None:
+                if acquire:
+                    model_config["refs"] += 1
+                return model_config
+            pooled_source = self.pool_sources.get(pool_key) if pool_key is not None else None
+            if pooled_source is not None:
+                self.pool_sources.move_to_end(pool_key)
+        if pooled_source is None:
+            if pool_key is None or source is None:
+                return None
+            pooled_source = source()
+            if pooled_source is None:
+                return None
+            with self.model_pool_lock:
+                self.add_pool_source(pool_key, *pooled_source)
+        # 已被淘汰或由其他进程装载，按装载配置在本进程装载
+        model_id, model_config = pooled_source
+        return self._load_model(model_id, pool_key, model_config, acquire=acquire)
+
+    def release(self, model_config):
+        """释放get_model(acquire=True)登记的引用，已被淘汰的模型在最后一个引用释放后卸载"""
+        with self.model_pool_lock:
+            model_config["refs"] -= 1
+            retired = model_config["refs"] == 0 and model_config["evicted"]
+        if retired:
+            self.release_model(model_config)
+
+    def get_pool_key(self, model_id, weight_ids=None, model_config=None):
+        """模型池主键：(版本id, 选中权重id, 静态参数)，model_config为本次装载的配置，默认为版本配置"""
+        weight_ids = weight_ids or {}
+        if model_config is None:
+            model_config = self.model_configs[model_id]
+        params = {key: value for key, value in model_config.items()
+                  if key not in weight_ids}
+        return (
+            model_id,
+            tuple(sorted(weight_ids.items())),
+            json.dumps(params, sort_keys=True, ensure_ascii=False, default=str),
+        )
+
+    def _load_model(self, model_id, pool_key=None, model_config=None, acquire=False):
         """Load and return model info"""
-        model_config = copy.deepcopy(self.model_configs[model_id])
-        model_type = model_config.get("type")
+        if pool_key is None:
+            pool_key = self.get_pool_key(model_id)
+        with self.model_loading_lock:
+            with self.model_pool_lock:
+                if pool_key in self.model_pool:  # 等待期间已被其他请求装载
+                    self.loaded_model_config = self.model_pool[pool_key]
+                    if acquire:
+                        self.loaded_model_config["refs"] += 1
+                    return self.loaded_model_config
+            model_config = copy.deepcopy(model_config if model_config is not None
+                                         else self.model_configs[model_id])
+            model_type = model_config.get("type")
+            if self.batching and "batching" not in model_config:
+                model_config["batching"] = copy.deepcopy(self.batching)
+            process = psutil.Process(os.getpid())
+            rss_before = process.memory_info().rss
+            try:
+                ModelClass = load_model_class(model_type)
+                model_config["model"] = ModelClass(model_config, on_message=self.new_model_status.emit)
+                logging.info(f"✅ Model loaded successfully: {model_type}")
+            except Exception as e:
+                error_message = str(e)
+                stack_trace = traceback.format_exc()  # 获取完整的异常堆栈信息
+                self.new_model_status.emit(f"Error in loading model: {error_message}")
+                logging.error(
+                    f"❌ Error in loading model: {model_type} with error: {error_message}\nStack trace:\n{stack_trace}")
+                return
+            # 以装载前后的常驻内存差值估算该模型占用
+            model_config["memory"] = max(process.memory_info().rss - rss_before, 0)
+        model_config["pool_key"] = pool_key
+        model_config["lock"] = RLock()  # 有状态模型的超参数设置与推理须在锁内完成
+        model_config["refs"] = 0  # 正在使用该模型的请求数
+        model_config["evicted"] = False  # 已移出模型池，等待最后一个引用释放后卸载
+
+        with self.model_pool_lock:
+            if acquire:
+                model_config["refs"] += 1
+            self.model_pool[model_config["pool_key"]] = model_config
+            self.model_pool.move_to_end(model_config["pool_key"])
+            self.loaded_model_config = model_config
+            self.evict_model_pool()
+        return self.loaded_model_config
+
+    def warm_up(self, pool_key, image_size=(640, 640)):
+        """用空白图像做一次推理，触发各后端的延迟初始化；需要提示词等输入的模型预热失败不影响装载"""
+        model_config = self.get_model(pool_key, acquire=True)
+        if model_config is None:
+            return False
+        image = np.zeros((*image_size, 3), dtype=np.uint8)
+        start = time.time()
         try:
-            ModelClass = load_model_class(model_type)
-            model_config["model"] = ModelClass(model_config, on_message=self.new_model_status.emit)
-            logging.info(f"✅ Model loaded successfully: {model_type}")
-        except Exception as e:
-            error_message = str(e)
-            stack_trace = traceback.format_exc()  # 获取完整的异常堆栈信息
-            self.new_model_status.emit(f"Error in loading model: {error_message}")
-            logging.error(
-                f"❌ Error in loading model: {model_type} with error: {error_message}\nStack trace:\n{stack_trace}")
-            return
+            with model_config["lock"]:
+                model_config["model"].predict_shapes(image)
+        except Exception as e:  # noqa
+            logging.warning(f"Warm-up of {model_config['type']} skipped: {e}")
+            return False
+        finally:
+            self.release(model_config)
+        logging.info(f"Warm-up of {model_config['type']} finished in {time.time() - start:.2f}s")
+        return True
+
+    def get_pool_memory(self):
+        return sum(item["memory"] for item in self.model_pool.values())
+
+    def evict_model_pool(self):
+        """超出内存预算时淘汰最久未使用的模型，当前模型始终保留；须在模型池锁内调用"""
+        evicted = False
+        while len(self.model_pool) > 1 and self.get_pool_memory() > self.max_pool_memory:
+            pool_key, model_config = next(iter(self.model_pool.items()))
+            if model_config is self.loaded_model_config:
+                self.model_pool.move_to_end(pool_key)
+                continue
+            del self.model_pool[pool_key]
+            self.retire_model(model_config)
+            print_cyan("Model evicted from pool: {model_name}".format(
+                model_name=model_config['display_name']))
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def retire_model(self, model_config):
+        """已移出模型池的模型：没有请求在使用时立即卸载，否则由最后一个请求释放引用时卸载；须在模型池锁内调用"""
+        if model_config["refs"] > 0:
+            model_config["evicted"] = True
+        else:
+            self.release_model(model_config)
 
-        self.loaded_model_config = model_config
-        return self.loaded_model_config
+    @staticmethod
+    def release_model(model_config):
+        """卸载模型实例，调用方保证已没有请求在使用该实例"""
+        try:
+            model_config["model"].unload()
+        except Exception as e:  # noqa
+            logging.warning(f"Error in unloading model {model_config['type']}: {e}")
+
+    def get_model_pool_info(self):
+        """Return resident models from least to most recently used"""
+        with self.model_pool_lock:
+            return {
+                'maxMemory': self.max_pool_memory,
+                'usedMemory': self.get_pool_memory(),
+                'models': [{
+                    'releaseId': model_config['pool_key'][0],
+                    'type': model_config['type'],
+                    'name': model_config['display_name'],
+                    'weights': dict(model_config['pool_key'][1]),
+                    'memory': model_config['memory'],
+                    'current': model_config is self.loaded_model_config,
+                } for model_config in self.model_pool.values()],
+            }
 
     def set_cache_auto_label(self, text, gid):
         """Set cache auto label"""
@@ -229,68 +378,6 @@ def set_cache_auto_label(self, text, gid):
         ):
             self.loaded_model_config["model"].set_cache_auto_label(text, gid)
 
-    def set_auto_labeling_marks(self, value):
-        """Set auto labeling marks
-        (For example, for segment_anything model, it is the marks for)
-        """
-        if (
-            self.loaded_model_config is None
-            or self.loaded_model_config["type"] not in marks_model_list
-            or value is None
-        ):
-            return
-        marks = []
-        for v in value:
-            mark = {'type': v['type']}
-            if v['type'] == 'point':
-                mark['data'] = [v['x'], v['y']]
-            elif v['type'] == 'rectangle':
-                points = [(p['x'], p['y']) for p in v['points']]
-                mark['data'] = xyxyxyxy_to_xyxy(points)
-            marks.append(mark)
-        self.loaded_model_config["model"].set_auto_labeling_marks(marks)
-
-    def set_auto_labeling_reset_tracker(self):
-        """Resets the tracker to its initial state,
-        clearing all tracked objects and internal states.
-        """
-        if (
-            self.loaded_model_config is None
-            or self.loaded_model_config["type"] not in reset_tracker_model_list
-        ):
-            return
-        self.loaded_model_config["model"].set_auto_labeling_reset_tracker()
-
-    def set_auto_labeling_conf(self, value):
-        """Set auto labeling confidences"""
-        if (
-            self.loaded_model_config is None
-            or self.loaded_model_config["type"] not in conf_model_list
-            or value is None
-        ):
-            return
-        self.loaded_model_config["model"].set_auto_labeling_conf(value)
-
-    def set_auto_labeling_iou(self, value):
-        """Set auto labeling iou"""
-        if (
-            self.loaded_model_config is None
-            or self.loaded_model_config["type"] not in iou_model_list
-            or value is None
-        ):
-            return
-        self.loaded_model_config["model"].set_auto_labeling_iou(value)
-
-    def set_auto_labeling_preserve_existing_annotations_state(self, state):
-
-        if (
-            self.loaded_model_config is not None
-            and self.loaded_model_config["type"] in preserve_existing_annotations_state_model_list
-        ):
-            self.loaded_model_config[
-                "model"
-            ].set_auto_labeling_preserve_existing_annotations_state(state)
-
     def set_auto_labeling_prompt(self):
         model_list = ["segment_anything_2_video"]
         if (
@@ -301,44 +388,91 @@ def set_auto_labeling_prompt(self):
 
     def unload_model(self):
         """Unload model"""
-        if self.loaded_model_config is not None:
-            self.loaded_model_config["model"].unload()
+        with self.model_pool_lock:
+            if self.loaded_model_config is not None:
+                self.model_pool.pop(self.loaded_model_config.get("pool_key"), None)
+                self.retire_model(self.loaded_model_config)
+                self.loaded_model_config = None
+
+    def clear_model_pool(self):
+        """Unload all resident models"""
+        with self.model_pool_lock:
+            for model_config in self.model_pool.values():
+                self.retire_model(model_config)
+            self.model_pool.clear()
             self.loaded_model_config = None
+        gc.collect()
 
     def set_auto_labeling_result(self, result):
         self.result = result
 
-    # 之前是qt槽函数，现在是普通的队列设置函数
-    def predict_shapes(self):
+    def build_context(self, hyper=None, pool_key=None, source=None):
+        """Create a request-scoped inference context for a pooled model
+        上下文持有模型引用，predict_shapes结束时释放；解析超参数失败时立即释放；source见get_model
+        """
+        model_config = self.get_model(pool_key, acquire=True, source=source)
+        try:
+            context = InferenceContext(model_config, hyper)
+        except Exception:
+            if model_config is not None:
+                self.release(model_config)
+            raise
+        context.acquired = model_config is not None
+        return context
+
+    def release_context(self, context):
+        if context.acquired:
+            context.acquired = False
+            self.release(context.model_config)
+
+    def predict_shapes(self, context=None):
         """Predict shapes.
-        This function starts a thread to run the prediction.
+        模型实例可被多个请求线程共享，请求自身状态全部保存在context中：
+        超参数设置在本次请求的模型视图上，只有跟踪类有状态模型在模型锁内使用共享实例
         """
-        if self.loaded_model_config is None:
+        if context is None:
+            context = self.build_context()
+        try:
+            return self._predict_shapes(context)
+        finally:
+            self.release_context(context)
+
+    def _predict_shapes(self, context):
+        model_config = context.model_config
+        if model_config is None:
             self.new_model_status.emit("Model is not loaded. Choose a mode to continue.")
             return
-        self.new_model_status.emit("Inferencing AI model. Please wait...")
-        if (
-            self.model_execution_thread is not None
-            and self.model_execution_thread.isRunning()
-        ):
-            self.new_model_status.emit(
-                "Another model is being executed."
-                " Please wait for it to finish."
-            )
-            return
-
-        try:
-            results = self.loaded_model_config["model"].predict_shapes(**self.kwargs)
-            if not hasattr(results, "image") or results.image is None:
-                results.image = self.kwargs.get("image")
-        except Exception as e:  # noqa
-            error_message = str(e)
-            stack_trace = traceback.format_exc()  # 获取完整的异常堆栈信息
-            self.new_model_status.emit(f"Error in loading model: {error_message}")
-            logging.error(f"Error in model prediction: {e}\n{stack_trace}. Please check the model.")
-            raise
-        print(results)
-        results.load_kwargs(**self.post_kwargs)
+        cache_key = self.result_cache.get_key(context) if self.result_cache is not None else None
+        results = None
+        if cache_key is not None:
+            stored, inflight = self.result_cache.lookup(cache_key)
+            if inflight is not None:  # 相同请求正在推理，等待其结果
+                stored = inflight.result()
+            if stored is not None:
+                results = ResultCache.restore(stored, context)
+        if results is None:
+            self.new_model_status.emit("Inferencing AI model. Please wait...")
+            try:
+                if context.stateful:
+                    with model_config["lock"]:
+                        context.apply(model_config["model"])
+                        results = model_config["model"].predict_shapes(**context.kwargs)
+                else:
+                    results = context.bind(model_config["model"]).predict_shapes(**context.kwargs)
+                if not hasattr(results, "image") or results.image is None:
+                    results.image = context.kwargs.get("image")
+            except Exception as e:  # noqa
+                if cache_key is not None:
+                    self.result_cache.resolve(cache_key, error=e)
+                error_message = str(e)
+                stack_trace = traceback.format_exc()  # 获取完整的异常堆栈信息
+                self.new_model_status.emit(f"Error in loading model: {error_message}")
+                logging.error(f"Error in model prediction: {e}\n{stack_trace}. Please check the model.")
+                raise
+            if cache_key is not None:
+                self.result_cache.resolve(cache_key, results)
+        results.load_kwargs(**context.post_kwargs)
+        context.load_results(results)
         return results
 
     def on_next_files_changed(self, next_files):
@@ -0,0 +1,69 @@
+import logging
+import os
+
+import onnxruntime as ort
+
+from .artifact_registry import file_sha256
+
+'''
+ORT优化图缓存
+- 首次装载时将ONNX Runtime图优化后的模型写入缓存目录，之后直接装载优化后的模型并跳过图优化
+- 缓存按 源文件sha256(取自模型文件登记表) + ORT版本 + 执行提供器 区分，源文件、ORT升级或设备变更后自动失效
+- 缓存中可能含有与本机硬件相关的优化，缓存目录不应在机器间共享
+'''
+
+ORT_CACHE_DIR = os.environ.get(
+    "ORT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "yanglao_ort")
+)
+LEGACY_HASH_INDEX_NAME = "hash_index.json"  # 旧版sha256缓存，已由模型文件登记表取代
+
+_legacy_checked = False
+
+
+def remove_legacy_index():
+    """删除旧版遗留的hash_index.json，每个进程只检查一次"""
+    global _legacy_checked
+    if _legacy_checked:
+        return
+    _legacy_checked = True
+    path = os.path.join(ORT_CACHE_DIR, LEGACY_HASH_INDEX_NAME)
+    try:
+        os.remove(path)
+        logging.info(f"Removed legacy ORT hash index {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Could not remove legacy ORT hash index {path}: {e}")
+
+
+def get_cache_path(model_path, providers):
+    remove_legacy_index()
+    providers = "-".join(p.replace("ExecutionProvider", "") for p in providers)
+    name = f"{file_sha256(model_path)[:32]}_ort{ort.__version__}_{providers}.onnx"
+    return os.path.join(ORT_CACHE_DIR, name)
+
+
+def list_cache():
+    if not os.path.isdir(ORT_CACHE_DIR):
+        return []
+    return [
+        {"file": name, "size": os.path.getsize(os.path.join(ORT_CACHE_DIR, name))}
+        for name in sorted(os.listdir(ORT_CACHE_DIR)) if name.endswith(".onnx")
+    ]
+
+
+def clear_cache(model_path=None):
+    """删除优化图缓存，指定model_path时只删除该模型的缓存，返回删除的文件数"""
+    remove_legacy_index()
+    if not os.path.isdir(ORT_CACHE_DIR):
+        return 0
+    prefix = file_sha256(model_path)[:32] if model_path is not None else ""
+    removed = 0
+    for name in os.listdir(ORT_CACHE_DIR):
+        if name.endswith(".onnx") and name.startswith(prefix):
+            try:
+                os.remove(os.path.join(ORT_CACHE_DIR, name))
+                removed += 1
+            except OSError as e:
+                logging.warning(f"Could not remove ORT cache {name}: {e}")
+    return removed
@@ -0,0 +1,193 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+from utils.backend_utils.image_store import is_image_ref
+from .artifact_registry import find_artifact
+from .constant import reset_tracker_model_list
+from .types import AutoLabelingResult
+
+'''
+推理结果缓存
+- 键：(图像内容摘要, 模型池主键[版本id/权重id/静态参数], 权重文件版本, 影响推理的超参数)
+- 内存LRU + 可选磁盘层，磁盘层保存序列化后的AutoLabelingResult(不含原图)
+- 相同请求同时到达时只执行一次推理，其余请求等待并共享结果
+- 跟踪类等有状态的模型不缓存
+'''
+
+UNCACHEABLE_MODEL_LIST = reset_tracker_model_list + ["segment_anything_2_video"]
+IMAGE_HYPERS = ['origin_image', 'mask_image', 'minor_image']
+
+
+class ResultCache:
+    MAX_SIZE = 256
+
+    def __init__(self, maxsize=None, cache_dir=None):
+        self.maxsize = maxsize or self.MAX_SIZE
+        self.cache_dir = cache_dir
+        self.memory = OrderedDict()
+        self.inflight = {}  # 键 -> Future，正在推理中的请求
+        self.lock = Lock()
+        self.versions = {}  # 模型池主键 -> (权重文件(大小, 修改时间), 权重文件版本)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def hash_image(value):
+        if is_image_ref(value):
+            return value
+        return 'b64:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+    def get_model_version(self, model_config):
+        """由各权重文件的登记摘要得到模型版本，未登记或登记已过期时退化为路径+大小+修改时间
+        每次都stat权重文件，文件被原地替换后版本随之变化，旧结果不再命中
+        """
+        pool_key = model_config['pool_key']
+        weights = []
+        for key in sorted(dict(pool_key[1])):
+            weight = model_config.get(key) or {}
+            weights.append((weight, weight.get('local') if isinstance(weight, dict) else None))
+        stats = tuple(self.stat_weight(local) for _, local in weights)
+        cached = self.versions.get(pool_key)
+        if cached is not None and cached[0] == stats:
+            return cached[1]
+        parts = []
+        for (weight, local), stat in zip(weights, stats):
+            artifact = find_artifact(local) if stat is not None else None
+            if artifact is not None and (artifact['size'], artifact['mtime']) == stat:
+                parts.append(artifact['sha256'])
+            elif stat is not None:
+                parts.append(f'{local}@{stat[0]}@{stat[1]}')
+            else:
+                parts.append(str(weight))
+        version = hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+        self.versions[pool_key] = (stats, version)
+        return version
+
+    @staticmethod
+    def stat_weight(local):
+        if not local:
+            return None
+        try:
+            stat = os.stat(local)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def get_key(self, context):
+        """生成缓存键，不可缓存时返回None"""
+        model_config = context.model_config
+        if context.model_type in UNCACHEABLE_MODEL_LIST or context.kwargs.get('run_tracker') \
+                or context.hyper is None or 'pool_key' not in model_config:
+            return None
+        hypers = {}
+        for key, value in context.hyper.items():
+            if key in context.post_kwargs:  # 裁剪等绘制参数不影响推理结果
+                continue
+            hypers[key] = self.hash_image(value) if key in IMAGE_HYPERS and value else value
+        raw = json.dumps([model_config['pool_key'], self.get_model_version(model_config), hypers],
+                         sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.pkl')
+
+    def lookup(self, key):
+        """查找缓存；未命中时若已有相同请求在推理，返回其Future"""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key], None
+            if key in self.inflight:
+                self.coalesced += 1
+                return None, self.inflight[key]
+        result = self.load_disk(key)
+        with self.lock:
+            if result is not None:
+                self.disk_hits += 1
+                self.put_memory(key, result)
+                return result, None
+            if key in self.inflight:
+                self.coalesced += 1
+                return None, self.inflight[key]
+            self.misses += 1
+            self.inflight[key] = Future()
+            return None, None
+
+    def load_disk(self, key):
+        if not self.cache_dir or not os.path.exists(self.get_path(key)):
+            return None
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:  # noqa
+            logging.warning(f"Could not read result cache {key}: {e}")
+            return None
+
+    def put_memory(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def resolve(self, key, results=None, error=None):
+        """结束一次推理：写入缓存并唤醒等待中的相同请求"""
+        stored = None
+        if isinstance(results, AutoLabelingResult):
+            stored = copy.copy(results)
+            stored.image = None  # 原图由请求自身提供，不进入缓存
+            stored = copy.deepcopy(stored)
+        with self.lock:
+            future = self.inflight.pop(key, None)
+            if stored is not None:
+                self.put_memory(key, stored)
+        if stored is not None and self.cache_dir:
+            try:
+                path = self.get_path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(stored, f)
+                os.replace(tmp_path, path)
+            except Exception as e:  # noqa
+                logging.warning(f"Could not write result cache {key}: {e}")
+        if future is not None:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(stored)
+
+    @staticmethod
+    def restore(stored, context):
+        """从缓存副本恢复本次请求的结果"""
+        results = copy.deepcopy(stored)
+        results.image = context.kwargs.get('image')
+        return results
+
+    def get_info(self):
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses + self.coalesced
+            return {
+                'size': len(self.memory),
+                'maxSize': self.maxsize,
+                'diskEnabled': bool(self.cache_dir),
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'hitRate': (total - self.misses) / total if total else 0,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.versions.clear()
@@ -0,0 +1,146 @@
+import base64
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from utils.backend_utils.file_lock import FileLock
+from .artifact_registry import file_sha256
+
+'''
+CLIP文本特征缓存
+- 键：(文本编码器权重sha256, 上下文长度, 规范化后的文本)，类别词表在一次部署内只编码一次
+- 每个编码器一个追加写入的jsonl文件，多进程共享，读取时按文件大小增量载入其他进程写入的行
+- 追加与压缩在跨进程文件锁内进行；文件行数超过上限的COMPACT_RATIO倍时只保留最近使用的max_texts条重写，
+  其他进程发现文件被替换后整体重新载入
+- 规范化只做tokenizer本身也会做的处理(合并空白、转小写)，不会把编码结果不同的文本合并
+'''
+
+
+def normalize_text(text):
+    return " ".join(str(text).split()).lower()
+
+
+def encode_line(text, feat):
+    return json.dumps({"text": text, "vector": base64.b64encode(feat.tobytes()).decode("ascii")},
+                      ensure_ascii=False)
+
+
+class TextFeatureCache:
+    COMPACT_RATIO = 1.5
+
+    def __init__(self, path, max_texts=100000):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.max_texts = max_texts
+        self.lock = threading.Lock()
+        self.features = OrderedDict()  # 规范化文本 -> 特征，按最近使用排序
+        self.offset = 0
+        self.inode = None
+        self.lines = 0  # 文件中的行数，含不同进程重复写入的文本
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self):
+        if not os.path.exists(self.path):
+            return
+        stat = os.stat(self.path)
+        if stat.st_ino != self.inode or stat.st_size < self.offset:  # 文件被压缩替换或删除重建
+            self.features, self.offset, self.lines, self.inode = OrderedDict(), 0, 0, stat.st_ino
+        if stat.st_size == self.offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(stat.st_size - self.offset)
+        end = data.rfind(b"\n") + 1  # 只处理完整的行
+        for line in data[:end].splitlines():
+            self.lines += 1
+            try:
+                item = json.loads(line)
+                self.features[item["text"]] = np.frombuffer(base64.b64decode(item["vector"]), dtype=np.float32)
+            except Exception as e:  # noqa
+                logging.warning(f"Could not read text feature in {self.path}: {e}")
+        self.offset += end
+
+    def get_or_encode(self, texts, encode):
+        """返回texts的特征[N, D]，未命中的文本合并为一批调用encode(texts)编码后写入缓存"""
+        keys = [normalize_text(text) for text in texts]
+        found = {}
+        with self.lock:
+            self.refresh()
+            for key in keys:
+                if key in self.features:
+                    self.features.move_to_end(key)
+                    found[key] = self.features[key]
+            missing = list(dict.fromkeys(key for key in keys if key not in found))
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            feats = np.asarray(encode(missing), dtype=np.float32)
+            found.update(zip(missing, feats))
+            with self.lock:
+                try:
+                    self.append(dict(zip(missing, feats)))
+                except OSError as e:
+                    logging.warning(f"Could not write text feature cache {self.path}: {e}")
+                    self.features.update(zip(missing, feats))
+        return np.stack([found[key] for key in keys])
+
+    def append(self, features):
+        """追加新编码的文本特征，行数超出上限时压缩；须持有self.lock"""
+        with FileLock(self.lock_path):
+            self.refresh()  # 先读入其他进程的写入，已由其他进程写入的文本不再重复写
+            lines = [encode_line(text, feat) for text, feat in features.items() if text not in self.features]
+            if lines:
+                # 一次追加写入全部行，其他进程只会读到完整的行
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                stat = os.stat(self.path)
+                self.offset, self.inode = stat.st_size, stat.st_ino
+                self.lines += len(lines)
+            for text, feat in features.items():
+                self.features[text] = feat
+                self.features.move_to_end(text)
+            if self.lines > self.max_texts * self.COMPACT_RATIO:
+                self.compact()
+
+    def compact(self):
+        """只保留最近使用的max_texts条，写入临时文件后替换；须持有self.lock与文件锁"""
+        while len(self.features) > self.max_texts:
+            self.features.popitem(last=False)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for text, feat in self.features.items():
+                f.write(encode_line(text, feat) + "\n")
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self.offset, self.inode, self.lines = stat.st_size, stat.st_ino, len(self.features)
+
+    def get_info(self):
+        with self.lock:
+            return {"texts": len(self.features), "lines": self.lines, "hits": self.hits, "misses": self.misses,
+                    "bytes": self.offset}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_text_cache(model_path, context_length):
+    """同一编码器与上下文长度的所有CLIP实例共用一个缓存"""
+    name = f"{file_sha256(model_path)[:32]}_{context_length}.jsonl"
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TextFeatureCache(os.path.join(config.TEXT_FEATURE_CACHE_DIR, name),
+                                             config.TEXT_FEATURE_CACHE_MAX_TEXTS)
+        return _caches[name]
+
+
+def get_info():
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.get_info() for name, cache in caches.items()}
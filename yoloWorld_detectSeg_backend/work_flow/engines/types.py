@@ -3,7 +3,7 @@
 
 class AutoLabelingResult:
     def __init__(self, shapes, replace=True, description="", image=None,
-                 visible=True, avatars=[], object="", **kwargs):
+                 visible=True, avatars=None, object="", **kwargs):
         """Initialize AutoLabelingResult
 
         Args:
@@ -19,7 +19,7 @@ def __init__(self, shapes, replace=True, description="", image=None,
         self.replace = replace
         self.description = description
         self.image = image
-        self.avatars = avatars
+        self.avatars = avatars if avatars is not None else []
         self.visible = visible
 
         # 通知canvas
@@ -64,3 +64,24 @@ def __eq__(self, other):
             self.edit_mode == other.edit_mode
             and self.shape_type == other.shape_type
         )
+
+
+class DetectionRequest:
+    """单次开放词汇检测请求
+
+    提示词、阈值和各短语的阈值覆盖随调用传递，模型实例只保存配置中的默认值，
+    同一个已装载的模型可被多个请求并发使用。
+    """
+
+    def __init__(self, text_prompt=None, phrases=None, box_threshold=None, text_threshold=None,
+                 phrase_thresholds=None, iou_threshold=None, replace=None):
+        self.text_prompt = text_prompt
+        self.phrases = list(phrases) if phrases else []
+        self.box_threshold = box_threshold
+        self.text_threshold = text_threshold
+        self.phrase_thresholds = dict(phrase_thresholds or {})  # 短语 -> 框置信度阈值
+        self.iou_threshold = iou_threshold
+        self.replace = replace
+
+    def get_box_threshold(self, phrase=None):
+        return self.phrase_thresholds.get(phrase, self.box_threshold)
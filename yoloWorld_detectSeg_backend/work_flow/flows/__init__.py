@@ -2,7 +2,7 @@
 from work_flow.__base__.sam2 import SegmentAnything2ONNX
 from work_flow.app_info import __preferred_device__
 from work_flow.engines.model import Model
-from work_flow.engines.types import AutoLabelingResult
+from work_flow.engines.types import AutoLabelingResult, DetectionRequest
 from work_flow.utils.shape import Shape
 from work_flow.engines.build_onnx_engine import OnnxBaseModel
 from work_flow.__base__.clip import ChineseClipONNX
@@ -45,6 +45,7 @@ def __init__(self, config_path, on_message) -> None:
             clip_img_model_path,
             model_arch,
             device=__preferred_device__,
+            batching=self.config.get("batching"),
         )
         self.classes = self.config.get("classes", [])
 
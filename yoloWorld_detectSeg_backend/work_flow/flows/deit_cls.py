@@ -3,9 +3,7 @@
 import PIL
 import cv2
 import numpy as np
-import torch
 from PIL import ImageEnhance, Image
-import torch.nn as nn
 from work_flow.app_info import __preferred_device__
 from work_flow.engines.model import Model
 from work_flow.engines.types import AutoLabelingResult
@@ -55,8 +53,9 @@ def __init__(self, model_config, on_message) -> None:
                 f"Could not download or initialize {model_name} model."
             )
         self.classes_names, self.label_names = get_info(self.classes_map)
-        self.net = OnnxBaseModel(model_abs_path, 'CPU')
+        self.net = OnnxBaseModel(model_abs_path, 'CPU', batching=self.config.get("batching"))
         self.input_shape = self.net.get_input_shape()[-2:]
+        self.max_batch_size = self.config.get("max_batch_size", 32)  # 单次推理的最大样本数(含TTA视图)
 
     def preprocess(self, input_image, input_shape):
         """
@@ -77,19 +76,36 @@ def preprocess(self, input_image, input_shape):
             arg_blobs.append(augmented_image)
         return arg_blobs
 
+    def preprocess_batch(self, images):
+        """各图像的全部TTA视图依次作为批次中的样本 -> [N*TTA数, 3, H, W]"""
+        return np.concatenate([
+            np.concatenate(self.preprocess(image, self.input_shape), axis=0)
+            for image in images
+        ], axis=0)
+
     def inference(self, blob):
-        outs = self.net.get_ort_inference(blob, extract=False)
+        outs = self.net.get_ort_batch_inference(blob, self.max_batch_size)
         return outs
 
-    def postprocess(self, all_logits):
+    def postprocess(self, logits):
         """
         Post-processes the network's output.
+        logits: [N, TTA数, 类别数]，任一增强视图超过阈值的类别即保留
         """
-        final_sigmoid = torch.stack(all_logits)
-        tmp = final_sigmoid.gt(self.T)
-        indices = torch.where(tmp)[-1]
+        return [np.flatnonzero((item > self.T).any(axis=0)) for item in logits]
 
-        return indices
+    def predict_batch(self, images):
+        """
+        一次批量推理分类多张图像(TTA视图作为额外的批次样本)，返回与images等长的结果列表
+        """
+        if not images:
+            return []
+        blob = self.preprocess_batch(images)
+        logits = self.inference(blob).reshape(len(images), len(tta_transforms), -1)
+        return [
+            AutoLabelingResult(shapes=[], replace=False, description=self.get_description(indices))
+            for indices in self.postprocess(logits)
+        ]
 
     def predict_shapes(self, image, image_path=None):
         """
@@ -98,17 +114,7 @@ def predict_shapes(self, image, image_path=None):
 
         if image is None:
             return []
-
-        arg_blobs = self.preprocess(image.copy(), self.input_shape)
-        all_logits = [torch.tensor(np.array((self.inference(arg_blob))))
-                      for arg_blob in arg_blobs]
-        # 平均汇总所有增强变换的结果
-        indices = self.postprocess(all_logits)
-        description = self.get_description(indices)
-        result = AutoLabelingResult(
-            shapes=[], replace=False, description=description
-        )
-        return result
+        return self.predict_batch([image])[0]
 
     @staticmethod
     def load_tag_list():
@@ -10,7 +10,7 @@
 from . import AutoLabelingResult
 from . import Shape
 
-from .lru_cache import LRUCache
+from .embedding_store import embedding_store
 from work_flow.engines.model import Model
 from ..__base__.clip import ChineseClipONNX
 from ..__base__.edge_sam import EdgeSAMONNX
@@ -81,7 +81,7 @@ def __init__(self, config_path, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.embedding_cache = embedding_store.bind(encoder_model_abs_path, self.target_length)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -231,18 +231,9 @@ def predict_shapes(self, image, filename=None) -> AutoLabelingResult:
 
         try:
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
-            if cached_data is not None:
-                image_embedding = cached_data
-            else:
-                if self.stop_inference:
-                    return AutoLabelingResult([], replace=False)
-                image_embedding = self.model.encode(image)
-                self.image_embedding_cache.put(
-                    filename,
-                    image_embedding,
-                )
-                "E:\Models\yanglao/xanylabeling_data/flows\Lama_fp32\lama_fp32.onnx"
+            if self.stop_inference:
+                return AutoLabelingResult([], replace=False)
+            image_embedding = self.embedding_cache.get_or_encode(image, self.model.encode)
             if self.stop_inference:
                 return AutoLabelingResult([], replace=False)
             if self.read_mode == 'follow':
@@ -275,19 +266,12 @@ def preload_worker(self, files):
         """
         files = files[: self.preloaded_size]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
             image = self.load_image_from_filename(filename)
             if image is None:
                 continue
             if self.stop_inference:
                 return
-            cv_image = image
-            image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.embedding_cache.get_or_encode(image, self.model.encode)
 
     def on_next_files_changed(self, next_files):
         """
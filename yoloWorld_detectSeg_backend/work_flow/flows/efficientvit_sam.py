@@ -14,7 +14,7 @@
 from . import AutoLabelingResult
 from . import Shape
 
-from .lru_cache import LRUCache
+from .embedding_store import embedding_store
 
 
 class SamEncoder:
@@ -255,7 +255,7 @@ def __init__(self, config_path, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.embedding_cache = embedding_store.bind(encoder_model_abs_path, self.encoder_model.input_size)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -406,18 +406,9 @@ def predict_shapes(self, image, filename=None) -> AutoLabelingResult:
         shapes = []
         try:
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
-            if cached_data is not None:
-                image_embedding = cached_data
-            else:
-                cv_image = image
-                if self.stop_inference:
-                    return AutoLabelingResult([], replace=False)
-                image_embedding = self.encoder_model(cv_image)
-                self.image_embedding_cache.put(
-                    filename,
-                    image_embedding,
-                )
+            if self.stop_inference:
+                return AutoLabelingResult([], replace=False)
+            image_embedding = self.embedding_cache.get_or_encode(image, self.encoder_model)
             if self.stop_inference:
                 return AutoLabelingResult([], replace=False)
 
@@ -453,19 +444,12 @@ def preload_worker(self, files):
         """
         files = files[: self.preloaded_size]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
             image = self.load_image_from_filename(filename)
             if image is None:
                 continue
             if self.stop_inference:
                 return
-            cv_image = image
-            image_embedding = self.encoder_model(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.embedding_cache.get_or_encode(image, self.encoder_model)
 
     def on_next_files_changed(self, next_files):
         """
@@ -0,0 +1,260 @@
+"""Shared image embedding store for SAM-family flows."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+import config
+from work_flow.engines.artifact_registry import file_sha256
+
+'''
+SAM系列图像编码结果的共享缓存
+- 键：(图像内容摘要, 编码器权重sha256, 编码器输入尺寸)，与文件名无关，同一图像换个请求或换个流程都能命中
+- 内存层按数组字节数限额(而非条目数)做LRU淘汰，所有SAM类流程共用一个预算
+- 磁盘层每个数组单独存为.npy，读取时以内存映射方式打开，按访问时间淘汰
+- 相同键同时到达时只编码一次
+'''
+
+META_NAME = "meta.json"
+
+
+def hash_image(image):
+    """图像内容摘要，形状和数据类型也计入，避免同样字节不同排布的图像冲突"""
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.shape}|{image.dtype.str}".encode("utf-8"))
+    digest.update(memoryview(image).cast("B"))
+    return digest.hexdigest()
+
+
+def embedding_nbytes(embedding):
+    if not isinstance(embedding, dict):
+        return 0
+    return sum(value.nbytes for value in embedding.values() if isinstance(value, np.ndarray))
+
+
+class EmbeddingStore:
+    def __init__(self, max_bytes=config.EMBEDDING_MEMORY_BYTES, cache_dir=config.EMBEDDING_CACHE_DIR,
+                 max_disk_bytes=config.EMBEDDING_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()  # 键 -> 编码结果
+        self.memory_bytes = 0
+        self.disk_bytes = None  # 首次写盘时统计
+        self.inflight = {}  # 键 -> Future，正在编码中的图像
+        self.encoders = {}  # 编码器路径 -> 权重sha256
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def encoder_key(self, encoder_path, input_size=None):
+        """编码器标识：权重内容摘要 + 输入尺寸"""
+        if encoder_path not in self.encoders:
+            self.encoders[encoder_path] = file_sha256(encoder_path)
+        size = "x".join(str(v) for v in input_size) if isinstance(input_size, (list, tuple)) else input_size
+        return f"{self.encoders[encoder_path][:32]}_{size}"
+
+    def bind(self, encoder_path, input_size=None):
+        return EmbeddingCache(self, self.encoder_key(encoder_path, input_size))
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get_or_encode(self, key, image, encode):
+        """命中时直接返回，否则调用encode(image)编码并写入缓存"""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+            future = self.inflight.get(key)
+            if future is None:
+                future = self.inflight[key] = Future()
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if not owner:
+            return future.result()
+        try:
+            embedding = self.load_disk(key)
+            if embedding is None:
+                embedding = encode(image)
+                self.save_disk(key, embedding)
+                with self.lock:
+                    self.misses += 1
+            else:
+                with self.lock:
+                    self.disk_hits += 1
+        except BaseException as e:
+            with self.lock:
+                self.inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.inflight.pop(key, None)
+            self.put_memory(key, embedding)
+        future.set_result(embedding)
+        return embedding
+
+    def find(self, key):
+        with self.lock:
+            if key in self.memory:
+                return True
+        return self.cache_dir is not None and os.path.exists(os.path.join(self.get_path(key), META_NAME))
+
+    def put_memory(self, key, embedding):
+        if key in self.memory:
+            self.memory_bytes -= embedding_nbytes(self.memory.pop(key))
+        size = embedding_nbytes(embedding)
+        if size > self.max_bytes:
+            return
+        self.memory[key] = embedding
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= embedding_nbytes(evicted)
+
+    def load_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self.get_path(key)
+        meta_path = os.path.join(path, META_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            embedding = {}
+            for name, item in meta.items():
+                if item["type"] == "ndarray":
+                    # 写时复制映射：只读取用到的页，解码端即便原地修改也不会写回文件
+                    embedding[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+                elif item["type"] == "tuple":
+                    embedding[name] = tuple(item["value"])
+                else:
+                    embedding[name] = item["value"]
+            os.utime(meta_path)  # 以修改时间记录最近访问，供磁盘淘汰使用
+            return embedding
+        except Exception as e:  # noqa
+            logging.warning(f"Could not read embedding cache {key}: {e}")
+            return None
+
+    def save_disk(self, key, embedding):
+        if not self.cache_dir or not isinstance(embedding, dict):
+            return
+        path = self.get_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(tmp_path, exist_ok=True)
+            meta = {}
+            for name, value in embedding.items():
+                if isinstance(value, np.ndarray):
+                    np.save(os.path.join(tmp_path, f"{name}.npy"), value)
+                    meta[name] = {"type": "ndarray"}
+                elif isinstance(value, tuple):
+                    meta[name] = {"type": "tuple", "value": [int(v) for v in value]}
+                else:
+                    meta[name] = {"type": "json", "value": value}
+            with open(os.path.join(tmp_path, META_NAME), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:  # 其他进程已写入同一键
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return
+        except Exception as e:  # noqa
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            logging.warning(f"Could not write embedding cache {key}: {e}")
+            return
+        self.purge_disk(embedding_nbytes(embedding))
+
+    def list_disk(self):
+        """返回 [(修改时间, 字节数, 路径)]"""
+        entries = []
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return entries
+        for prefix in os.listdir(self.cache_dir):
+            prefix_path = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for name in os.listdir(prefix_path):
+                path = os.path.join(prefix_path, name)
+                meta_path = os.path.join(path, META_NAME)
+                if name.endswith(".tmp") or not os.path.exists(meta_path):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(meta_path).st_mtime, size, path))
+        return entries
+
+    def purge_disk(self, added):
+        with self.lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += added
+                if self.disk_bytes <= self.max_disk_bytes:
+                    return
+        entries = sorted(self.list_disk())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        with self.lock:
+            self.disk_bytes = total
+
+    def get_info(self):
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses + self.coalesced
+            return {
+                'size': len(self.memory),
+                'memoryBytes': self.memory_bytes,
+                'maxMemoryBytes': self.max_bytes,
+                'diskEnabled': bool(self.cache_dir),
+                'diskBytes': self.disk_bytes,
+                'maxDiskBytes': self.max_disk_bytes,
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'hitRate': (total - self.misses) / total if total else 0,
+            }
+
+    def clear(self, disk=False):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if disk and self.cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            with self.lock:
+                self.disk_bytes = 0
+
+
+class EmbeddingCache:
+    """绑定到某个编码器的视图，供各流程使用"""
+
+    def __init__(self, store, encoder_key):
+        self.store = store
+        self.encoder_key = encoder_key
+
+    def get_key(self, image):
+        return f"{hash_image(image)}_{self.encoder_key}"
+
+    def find(self, image):
+        return self.store.find(self.get_key(image))
+
+    def get_or_encode(self, image, encode):
+        return self.store.get_or_encode(self.get_key(image), image, encode)
+
+
+embedding_store = EmbeddingStore()
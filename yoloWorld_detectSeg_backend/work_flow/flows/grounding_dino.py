@@ -1,11 +1,26 @@
 import os
+import re
 import cv2
 import numpy as np
 
-from typing import Dict
 from tokenizers import Tokenizer
 import logging
-from . import __preferred_device__, Model, AutoLabelingResult, Shape, OnnxBaseModel, Args, configs
+from . import __preferred_device__, Model, AutoLabelingResult, Shape, OnnxBaseModel, Args, configs, LRUCache, \
+    DetectionRequest
+from work_flow.utils import batched_numpy_nms
+
+'''
+Grounding-DINO开放词汇检测
+- caption的分词结果、文本自注意力掩码和位置id按caption字符串缓存，同一提示词不再重复分词和构造掩码
+- predict_phrases将多个短语拼接为一个caption单次前向推理，按各短语的token区间拆分logits，每个短语按各自的阈值独立过滤
+- 后处理全部向量化：每个caption预先建立token→短语索引，所有查询一次完成阈值过滤和短语匹配，再做一次按类别NMS
+- predict_shapes的提示词先按 , | . ? ; 拆分为短语再拼接caption，标签为命中的短语而不是整句提示词
+- 提示词和阈值通过DetectionRequest随调用传递，实例上的阈值只作为默认值且装载后不再修改，同一实例可并发推理
+'''
+
+TEXT_CACHE_SIZE = 128
+SPECIAL_TOKENS = [101, 102, 1012, 1029]  # [CLS] [SEP] . ?
+PROMPT_SEPARATORS = re.compile(r"[,，|.。?？;；]")
 
 
 class Grounding_DINO(Model):
@@ -52,24 +67,35 @@ def __init__(self, model_config, on_message) -> None:
         self.net.tokenizer = self.get_tokenlizer(
             self.model_configs.text_encoder_type
         )
+        # 默认阈值，装载后不再修改；单次调用的阈值由DetectionRequest给出
         self.box_threshold = self.config["box_threshold"]
         self.text_threshold = self.config["text_threshold"]
+        self.iou_threshold = self.config.get("iou_threshold", 0.7)  # 同一短语重叠框的NMS阈值，0表示不做NMS
         self.target_size = (
             self.config["input_width"],
             self.config["input_height"],
         )
         self.replace = True
+        self.text_cache = LRUCache(maxsize=TEXT_CACHE_SIZE)
 
-    def set_auto_labeling_conf(self, value):
-        """set auto labeling box threshold"""
-        if value > 0:
-            self.box_threshold = value
-
-    def set_auto_labeling_preserve_existing_annotations_state(self, state):
-        """Toggle the preservation of existing annotations based on the checkbox state."""
-        self.replace = not state
+    def get_request(self, request=None, text_prompt=None):
+        """补全请求中未给出的参数(使用配置中的默认值)，返回新的请求，不修改传入的请求"""
+        resolved = DetectionRequest()
+        if request is not None:
+            resolved.__dict__.update(request.__dict__)
+        if text_prompt is not None:
+            resolved.text_prompt = text_prompt
+        if resolved.box_threshold is None or resolved.box_threshold <= 0:
+            resolved.box_threshold = self.box_threshold
+        if resolved.text_threshold is None:
+            resolved.text_threshold = self.text_threshold
+        if resolved.iou_threshold is None:
+            resolved.iou_threshold = self.iou_threshold
+        if resolved.replace is None:
+            resolved.replace = self.replace
+        return resolved
 
-    def preprocess(self, image, text_prompt):
+    def preprocess_image(self, image):
         # Resize the image
         image = cv2.resize(
             image, self.target_size, interpolation=cv2.INTER_LINEAR
@@ -81,10 +107,18 @@ def preprocess(self, image, text_prompt):
         image = (image - mean) / std
         image = np.transpose(image, (2, 0, 1))
         image = np.expand_dims(image, 0).astype(np.float32)
+        return image
 
-        # encoder texts
-        captions = self.get_caption(str(text_prompt))
-        tokenized_raw_results = self.net.tokenizer.encode(captions)
+    def encode_caption(self, caption):
+        """分词并生成文本输入，按caption缓存
+
+        返回 {"inputs": 模型文本输入, "num_tokens": token数, "num_phrases": 短语数,
+              "token_index"/"phrase_starts"/"phrase_ids": token→短语索引, "phrase_names": 各短语文本}
+        """
+        cached = self.text_cache.get(caption)
+        if cached is not None:
+            return cached
+        tokenized_raw_results = self.net.tokenizer.encode(caption)
         tokenized = {
             "input_ids": np.array([tokenized_raw_results.ids], dtype=np.int64),
             "token_type_ids": np.array(
@@ -92,13 +126,12 @@ def preprocess(self, image, text_prompt):
             ),
             "attention_mask": np.array([tokenized_raw_results.attention_mask]),
         }
-        specical_tokens = [101, 102, 1012, 1029]
         (
             text_self_attention_masks,
             position_ids,
-            _,
+            cate_to_token_mask_list,
         ) = self.generate_masks_with_special_tokens_and_transfer_map(
-            tokenized, specical_tokens
+            tokenized, SPECIAL_TOKENS
         )
         if text_self_attention_masks.shape[1] > self.net.max_text_len:
             text_self_attention_masks = text_self_attention_masks[
@@ -116,7 +149,6 @@ def preprocess(self, image, text_prompt):
                 :, : self.net.max_text_len
             ]
         inputs = {}
-        inputs["img"] = image
         inputs["input_ids"] = np.array(tokenized["input_ids"], dtype=np.int64)
         inputs["attention_mask"] = np.array(
             tokenized["attention_mask"], dtype=bool
@@ -128,93 +160,161 @@ def preprocess(self, image, text_prompt):
         inputs["text_token_mask"] = np.array(
             text_self_attention_masks, dtype=bool
         )
-        return image, inputs, captions
+        # token→短语序号索引：短语的token在caption中连续且按短语顺序排列，reduceat一次求出所有短语的得分
+        phrase_masks = cate_to_token_mask_list[0][:, : self.net.max_text_len]
+        token_phrases = np.full(phrase_masks.shape[1], -1, dtype=np.int64)
+        for i, mask in enumerate(phrase_masks):
+            token_phrases[mask] = i
+        token_index = np.flatnonzero(token_phrases >= 0)
+        phrase_ids = token_phrases[token_index]
+        phrase_starts = np.flatnonzero(np.r_[True, phrase_ids[1:] != phrase_ids[:-1]]) \
+            if len(token_index) else np.empty((0,), dtype=np.int64)
+        ids = tokenized_raw_results.ids
+        cached = {
+            "inputs": inputs,
+            "num_tokens": len(ids),
+            "num_phrases": len(phrase_masks),
+            "token_index": token_index,
+            "phrase_starts": phrase_starts,
+            "phrase_ids": phrase_ids[phrase_starts],
+            "phrase_names": [
+                self.net.tokenizer.decode([ids[i] for i in np.flatnonzero(mask)])
+                for mask in phrase_masks
+            ],
+        }
+        self.text_cache.put(caption, cached)
+        return cached
 
-    def postprocess(
-        self, outputs, caption, with_logits=True, token_spans=None
-    ):
+    def postprocess(self, outputs, text, box_thresholds, request, img_h, img_w, multi_label=False):
+        """全部查询一次完成阈值过滤、短语匹配与按类别NMS
+
+        默认每个查询取得分最高的短语(短语内各token概率的最大值)，得分超过该短语的框阈值和文本阈值时保留；
+        multi_label为True时每个短语独立按自己的阈值过滤，一个查询可同时保留在多个短语下，
+        与逐个短语单独推理时一样，不会因为另一个短语得分更高而丢失
+        :param text: encode_caption的结果
+        :param box_thresholds: 各短语的框置信度阈值[P]
+        :return: (boxes[N, 4] xyxy, 短语序号[N], 得分[N])
+        """
         logits, boxes = outputs
-        prediction_logits_ = np.squeeze(
-            logits, 0
-        )  # [0]  # prediction_logits.shape = (nq, 256)
-        logits_filt = self.sig(prediction_logits_)
-        boxes_filt = np.squeeze(
-            boxes, 0
-        )  # [0]  # prediction_boxes.shape = (nq, 4)
-        # filter output
-        if token_spans is None:
-            filt_mask = logits_filt.max(axis=1) > self.box_threshold
-            logits_filt = logits_filt[filt_mask]  # num_filt, 256
-            boxes_filt = boxes_filt[filt_mask]  # num_filt, 4
-
-            # get phrase
-            tokenlizer = self.net.tokenizer
-            tokenized_raw_results = tokenlizer.encode(caption)
-            tokenized = {
-                "input_ids": np.array(
-                    tokenized_raw_results.ids, dtype=np.int64
-                ),
-                "token_type_ids": np.array(
-                    tokenized_raw_results.type_ids, dtype=np.int64
-                ),
-                "attention_mask": np.array(
-                    tokenized_raw_results.attention_mask
-                ),
-            }
-            # build pred
-            pred_phrases = []
-            for logit in logits_filt:
-                posmap = logit > self.text_threshold
-                pred_phrase = self.get_phrases_from_posmap(
-                    posmap, tokenized, tokenlizer
-                )
-                if with_logits:
-                    pred_phrases.append([pred_phrase, logit.max()])
-                else:
-                    pred_phrases.append([pred_phrase, 1.0])
+        logits = self.sig(np.squeeze(logits, 0))  # nq, max_text_len
+        boxes = np.squeeze(boxes, 0)  # nq, 4
+        scores = np.zeros((len(logits), text["num_phrases"]), dtype=logits.dtype)
+        if len(text["token_index"]):
+            scores[:, text["phrase_ids"]] = np.maximum.reduceat(
+                logits[:, text["token_index"]], text["phrase_starts"], axis=1
+            )
+        if multi_label:
+            passed = (scores > box_thresholds[None, :]) & (scores > request.text_threshold)
+            queries, labels = np.nonzero(passed)
+            scores = scores[queries, labels]
         else:
-            # TODO: Using token_spans.
-            raise NotImplementedError
-        return boxes_filt, pred_phrases
+            labels = scores.argmax(axis=1)
+            scores = scores[np.arange(len(scores)), labels]
+            queries = np.flatnonzero((scores > box_thresholds[labels]) & (scores > request.text_threshold))
+            labels, scores = labels[queries], scores[queries]
+        boxes = self.rescale_boxes(boxes[queries], img_h, img_w)
+        if request.iou_threshold and len(boxes) > 1:
+            keep = batched_numpy_nms(
+                boxes.astype(np.float32), scores, labels, request.iou_threshold
+            )
+            boxes, labels, scores = boxes[keep], labels[keep], scores[keep]
+        return boxes, labels, scores
 
-    def predict_shapes(self, image, image_path=None, text_prompt=None, clear_cache=False):
+    def predict_shapes(self, image, image_path=None, text_prompt=None, clear_cache=False, request=None):
         """
         Predict shapes from image
+        :param request: DetectionRequest，未给出的参数使用配置中的默认值
         """
 
         if image is None:
             return []
-        blob, inputs, caption = self.preprocess(image, text_prompt)
-        outputs = self.net.get_ort_inference(
-            blob, inputs=inputs, extract=False
-        )
-        boxes_filt, pred_phrases = self.postprocess(outputs, caption)
-
+        request = self.get_request(request, text_prompt)
+        phrases = self.split_prompt(request.text_prompt)
         shapes = []
-        img_h, img_w, _ = image.shape
-        boxes = self.rescale_boxes(boxes_filt, img_h, img_w)
-        for box, label_info in zip(boxes, pred_phrases):
-            x1, y1, x2, y2 = box
-            label, score = label_info
-            shape = Shape(
-                label=str(label), score=float(score), shape_type="rectangle"
-            )
-            shape.add_point(x1, y1)
-            shape.add_point(x2, y1)
-            shape.add_point(x2, y2)
-            shape.add_point(x1, y2)
-            shapes.append(shape)
+        if phrases:
+            blob = self.preprocess_image(image)
+            img_h, img_w, _ = image.shape
+            box_threshold = request.get_box_threshold(request.text_prompt)
+            for group in self.group_phrases(phrases):
+                text = self.encode_caption(self.get_phrase_caption(group))
+                inputs = {"img": blob, **text["inputs"]}
+                outputs = self.net.get_ort_inference(
+                    blob, inputs=inputs, extract=False
+                )
+                thresholds = np.array(
+                    [request.phrase_thresholds.get(phrase, box_threshold) for phrase in group],
+                    dtype=np.float32,
+                )
+                boxes, labels, scores = self.postprocess(
+                    outputs, text, thresholds, request, img_h, img_w
+                )
+                shapes.extend(
+                    self.box_to_shape(box, group[label], score)
+                    for box, label, score in zip(boxes, labels, scores)
+                )
 
-        result = AutoLabelingResult(shapes, replace=self.replace)
+        result = AutoLabelingResult(shapes, replace=request.replace)
         if clear_cache:
             self.reset_cache()
         return result
 
+    def group_phrases(self, phrases):
+        """拼接后超出max_text_len的短语列表对半拆分，保证每组的caption不被截断"""
+        caption = self.get_phrase_caption(phrases)
+        if len(phrases) == 1 or self.encode_caption(caption)["num_tokens"] <= self.net.max_text_len:
+            return [phrases]
+        middle = len(phrases) // 2
+        return self.group_phrases(phrases[:middle]) + self.group_phrases(phrases[middle:])
+
+    def predict_phrases(self, image, request):
+        """
+        多个短语拼接为一个caption单次前向推理，按短语返回检测结果
+        :param request: DetectionRequest，request.phrases为短语列表，
+            request.phrase_thresholds为各短语的框置信度阈值，未给出的短语使用request.box_threshold
+        :return: {短语: AutoLabelingResult}
+        """
+        request = self.get_request(request)
+        phrases = list(dict.fromkeys(request.phrases))
+        shapes = {phrase: [] for phrase in phrases}
+        if image is None or not phrases:
+            return {phrase: AutoLabelingResult([], replace=request.replace) for phrase in shapes}
+        blob = self.preprocess_image(image)
+        img_h, img_w, _ = image.shape
+        for group in self.group_phrases(phrases):
+            text = self.encode_caption(self.get_phrase_caption(group))
+            inputs = {"img": blob, **text["inputs"]}
+            outputs = self.net.get_ort_inference(
+                blob, inputs=inputs, extract=False
+            )
+            thresholds = np.array(
+                [request.get_box_threshold(phrase) for phrase in group],
+                dtype=np.float32,
+            )
+            boxes, indexes, scores = self.postprocess(
+                outputs, text, thresholds, request, img_h, img_w, multi_label=True
+            )
+            for box, index, score in zip(boxes, indexes, scores):
+                shapes[group[index]].append(self.box_to_shape(box, group[index], score))
+        return {
+            phrase: AutoLabelingResult(phrase_shapes, replace=request.replace)
+            for phrase, phrase_shapes in shapes.items()
+        }
+
     def reset_cache(self):
-        del self.net.tokenizer
-        self.net.tokenizer = self.get_tokenlizer(
-            self.model_configs.text_encoder_type
+        """只清空文本编码缓存；tokenizer由共享同一模型的并发请求共用，不能在推理中替换"""
+        self.text_cache.clear()
+
+    @staticmethod
+    def box_to_shape(box, label, score):
+        x1, y1, x2, y2 = box
+        shape = Shape(
+            label=str(label), score=float(score), shape_type="rectangle"
         )
+        shape.add_point(x1, y1)
+        shape.add_point(x2, y1)
+        shape.add_point(x2, y2)
+        shape.add_point(x1, y2)
+        return shape
 
     @staticmethod
     def sig(x):
@@ -222,15 +322,13 @@ def sig(x):
 
     @staticmethod
     def rescale_boxes(boxes, img_h, img_w):
-        converted_boxes = []
-        for box in boxes:
-            # from 0..1 to 0..W, 0..H
-            converted_box = box * np.array([img_w, img_h, img_w, img_h])
-            # from xywh to xyxy
-            converted_box[:2] -= converted_box[2:] / 2
-            converted_box[2:] += converted_box[:2]
-            converted_boxes.append(converted_box)
-        return np.array(converted_boxes, dtype=int)
+        # from 0..1 to 0..W, 0..H
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * np.array(
+            [img_w, img_h, img_w, img_h], dtype=np.float32
+        )
+        # from xywh to xyxy
+        xy = boxes[:, :2] - boxes[:, 2:] / 2
+        return np.concatenate([xy, xy + boxes[:, 2:]], axis=1).astype(int)
 
     @staticmethod
     def get_configs(model_type):
@@ -333,12 +431,21 @@ def get_configs(model_type):
         return configs
 
     @staticmethod
-    def get_caption(text_prompt):
-        caption = text_prompt.lower()
-        caption = caption.strip()
-        if not caption.endswith("."):
-            caption = caption + "."
-        return caption
+    def split_prompt(text_prompt):
+        """提示词按 , | . ? ; 拆分为短语(去重、保持顺序)，每个短语单独作为一个类别输出标签
+        如 "cat, dog" 或RAM的 "a | b | c" 得到 ["cat", "dog"] / ["a", "b", "c"]，而不是整句作为一个标签
+        """
+        phrases = (phrase.strip().lower() for phrase in PROMPT_SEPARATORS.split(str(text_prompt or "")))
+        return list(dict.fromkeys(phrase for phrase in phrases if phrase))
+
+    @staticmethod
+    def get_phrase_caption(phrases):
+        """短语以" . "拼接，短语内的'.'和'?'会被当作分隔符，替换为空格"""
+        phrases = [
+            phrase.lower().replace(".", " ").replace("?", " ").strip()
+            for phrase in phrases
+        ]
+        return " . ".join(phrases) + " ."
 
     @staticmethod
     def get_tokenlizer(text_encoder_type):
@@ -352,24 +459,6 @@ def get_tokenlizer(text_encoder_type):
             logging.warning(f"Error loading tokenizer: {e}")
             return None
 
-    @staticmethod
-    def get_phrases_from_posmap(
-        posmap: np.ndarray,
-        tokenized: Dict,
-        tokenizer,
-        left_idx: int = 0,
-        right_idx: int = 255,
-    ):
-        assert isinstance(posmap, np.ndarray), "posmap must be numpy.ndarray"
-        if posmap.ndim == 1:
-            posmap[0 : left_idx + 1] = False
-            posmap[right_idx:] = False
-            non_zero_idx = np.where(posmap)[0]
-            token_ids = [tokenized["input_ids"][i] for i in non_zero_idx]
-            return tokenizer.decode(token_ids)
-        else:
-            raise NotImplementedError("posmap must be 1-dim")
-
     @staticmethod
     def generate_masks_with_special_tokens_and_transfer_map(
         tokenized, special_tokens_list
@@ -7,7 +7,8 @@
 from typing import Dict
 from tokenizers import Tokenizer
 from PyQt5.QtCore import QCoreApplication
-from .lru_cache import LRUCache
+from .embedding_store import embedding_store
+from ..utils.sam_batch import binarize_masks, crop_mask
 from . import __preferred_device__, Model, AutoLabelingResult, Shape, OnnxBaseModel, Args, configs, SegmentAnything2ONNX
 
 
@@ -112,8 +113,10 @@ def __init__(self, model_config, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.embedding_cache = embedding_store.bind(encoder_model_abs_path, self.model.encoder.input_shape[2:])
         self.current_image_embedding_cache = {}
+        # 文本检测出的多个框按批送入解码器，每批数量受限以控制原图尺寸掩码的内存
+        self.decode_batch_size = self.config.get("decode_batch_size", 16)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -231,7 +234,7 @@ def postprocess(
             raise NotImplementedError
         return boxes_filt, pred_phrases
 
-    def post_process(self, masks, label=None):
+    def post_process(self, masks, label=None, offset=(0, 0)):
         """
         Post process masks
         """
@@ -240,7 +243,7 @@ def post_process(self, masks, label=None):
         masks[masks <= 0.0] = 0
         masks = masks.astype(np.uint8)
         contours, _ = cv2.findContours(
-            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset
         )
 
         # Refine contours
@@ -340,6 +343,24 @@ def post_process(self, masks, label=None):
 
         return shapes if label is None else shapes[0]
 
+    def post_process_batch(self, masks, labels):
+        """
+        Post process a batch of masks [B, H, W], one shape per non-empty mask
+        """
+        # 整批二值化并求外接框，轮廓只在各自的外接框内提取
+        binary, boxes = binarize_masks(masks)
+        shapes = []
+        for mask, box, label in zip(binary, boxes, labels):
+            if box[0] < 0:
+                continue
+            crop, offset = crop_mask(mask, box)
+            results = self.post_process(crop, offset=offset)
+            if not results:
+                continue
+            results[0].label = label
+            shapes.append(results[0])
+        return shapes
+
     def predict_shapes(self, image, image_path=None, text_prompt=None):
         """
         Predict shapes from image
@@ -350,19 +371,12 @@ def predict_shapes(self, image, image_path=None, text_prompt=None):
         cv_image = image
 
         try:
-            cached_data = self.image_embedding_cache.get(image_path)
-            if cached_data is not None:
-                image_embedding = cached_data
-            else:
-                if self.stop_inference:
-                    return AutoLabelingResult([], replace=False)
-                image_embedding = self.model.encode(cv_image)
-                self.image_embedding_cache.put(
-                    image_path,
-                    image_embedding,
-                )
-                if self.stop_inference:
-                    return AutoLabelingResult([], replace=False)
+            # 按图像内容命中共享的编码缓存，与文件名无关
+            if self.stop_inference:
+                return AutoLabelingResult([], replace=False)
+            image_embedding = self.embedding_cache.get_or_encode(cv_image, self.model.encode)
+            if self.stop_inference:
+                return AutoLabelingResult([], replace=False)
 
             if text_prompt:
                 blob, inputs, caption = self.preprocess(cv_image, text_prompt)
@@ -372,23 +386,23 @@ def predict_shapes(self, image, image_path=None, text_prompt=None):
                 boxes_filt, pred_phrases = self.postprocess(outputs, caption)
                 img_h, img_w, _ = cv_image.shape
                 boxes = self.rescale_boxes(boxes_filt, img_h, img_w)
+                prompts = [
+                    (
+                        np.array([[x1, y1], [x2, y2]], dtype=np.float32),
+                        np.array([2, 3], dtype=np.float32),
+                    )
+                    for x1, y1, x2, y2 in boxes
+                ]
+                labels = [label for label, _ in pred_phrases]
                 shapes = []
-                for box, label_info in zip(boxes, pred_phrases):
-                    label, _ = label_info
-                    marks = [
-                        {
-                            "data": box,
-                            "label": 1,
-                            "type": "rectangle",
-                        }
-                    ]
-                    masks = self.model.predict_masks(image_embedding, marks)
-                    if len(masks.shape) == 4:
-                        masks = masks[0][0]
-                    else:
-                        masks = masks[0]
-                    shape = self.post_process(masks, label=label)
-                    shapes.append(shape)
+                for start in range(0, len(prompts), self.decode_batch_size):
+                    end = start + self.decode_batch_size
+                    masks = self.model.predict_masks_batch(
+                        image_embedding, prompts[start:end]
+                    )
+                    shapes.extend(
+                        self.post_process_batch(masks[:, 0], labels[start:end])
+                    )
                 result = AutoLabelingResult(shapes, replace=False)
             else:
                 masks = self.model.predict_masks(image_embedding, self.marks)
@@ -620,19 +634,12 @@ def preload_worker(self, files):
         """
         files = files[: self.preloaded_size]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
             image = self.load_image_from_filename(filename)
             if image is None:
                 continue
             if self.stop_inference:
                 return
-            cv_image = image
-            image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.embedding_cache.get_or_encode(image, self.model.encode)
 
     def on_next_files_changed(self, next_files):
         """
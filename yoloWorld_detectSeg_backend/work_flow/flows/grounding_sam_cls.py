@@ -84,9 +84,8 @@ def predict_shapes(self, image, image_path=None, text_prompt=None):
             return []
         try:
             sam_results = self.net.predict_shapes(image, text_prompt=text_prompt)
-            for shape in sam_results.shapes:
-                cropped_img = crop_polygon_object(image.copy(), shape.points)
-                results = self.model.predict_shapes(cropped_img)
+            crops = [crop_polygon_object(image, shape.points) for shape in sam_results.shapes]
+            for shape, results in zip(sam_results.shapes, self.model.predict_batch(crops)):
                 shape.description = results.description
             return sam_results
 
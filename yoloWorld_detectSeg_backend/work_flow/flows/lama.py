@@ -1,16 +1,27 @@
 import onnxruntime
 import torch
 from PIL import Image
-from work_flow.utils.lama.lama_util import prepare_img_and_mask
+from work_flow.utils.lama.lama_util import ceil_modulo, prepare_img_and_mask
 import onnxruntime as ort
 import os
 import cv2
 import numpy as np
 from . import __preferred_device__, Model, AutoLabelingResult
 
+'''
+LaMa修复
+- roi(默认)：按掩码连通域外扩上下文裁出原分辨率的ROI，相交的ROI合并，修复后只在掩码及其羽化边缘内融合回原图，
+  掩码以外的像素保持不变；固定输入尺寸的ONNX模型以输入尺寸为窗口，动态尺寸的模型按ROI尺寸分桶后成批推理
+- full：原实现，ONNX模型整图缩放到512×512后再放大贴回，TorchScript模型整图推理
+'''
+
 
 class Lama(Model):
     """Segmentation model using SegmentAnything"""
+    ROI_PADDING = 64  # ROI在连通域外扩的最少像素
+    ROI_CONTEXT = 0.5  # ROI外扩不少于连通域长边的比例
+    ROI_BUCKET = 64  # 动态尺寸模型的ROI边长向上取整到该值的倍数后分组
+    FEATHER = 7  # 融合时掩码向外羽化的像素
 
     def __init__(self, config_path, on_message) -> None:
         # Run the parent class's init method
@@ -42,6 +53,10 @@ def __init__(self, config_path, on_message) -> None:
         else:
             raise ValueError(f"Model file {base} is not supported!")
 
+        self.inpaint_mode = self.config.get("inpaint_mode", "roi")
+        self.roi_padding = self.config.get("roi_padding", self.ROI_PADDING)
+        self.max_batch_size = self.config.get("max_batch_size", 8)
+        self.last_pixels = 0  # 最近一次修复送入模型的像素数
         on_message(f"Model loaded successfully, using device: {__preferred_device__}")
 
     def pre_process(self, image, inpainting_mask):
@@ -72,12 +87,113 @@ def post_process(self, masks, image=None):
         """
         # Find contours
 
-    def predict_shapes(self, image, mask=None) -> AutoLabelingResult:
-        """
-        Predict shapes from image
-        """
-        if image is None or mask is None:
-            return AutoLabelingResult([], replace=False)
+    def get_input_spec(self):
+        """返回 (固定输入尺寸(h, w)或None, 固定批量或None)"""
+        if not self.use_onnx:
+            return None, None
+        shape = self.ort_session.get_inputs()[0].shape
+        tile = (shape[2], shape[3]) if isinstance(shape[2], int) and isinstance(shape[3], int) else None
+        batch = shape[0] if isinstance(shape[0], int) and shape[0] > 0 else None
+        return tile, batch
+
+    def get_rois(self, mask):
+        """掩码连通域外扩上下文，相交的合并，返回互不相交的 [[x0, y0, x1, y1]]"""
+        _, _, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8), connectivity=8)
+        height, width = mask.shape[:2]
+        boxes = []
+        for x, y, w, h, _ in stats[1:]:
+            pad = max(self.roi_padding, int(max(w, h) * self.ROI_CONTEXT))
+            boxes.append([max(x - pad, 0), max(y - pad, 0), min(x + w + pad, width), min(y + h + pad, height)])
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        boxes.pop(j)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return boxes
+
+    @staticmethod
+    def get_window(box, tile, height, width):
+        """固定输入尺寸时，不超过输入尺寸的ROI以其为中心扩成输入尺寸大小的窗口，多看一些上下文且无需缩放"""
+        x0, y0, x1, y1 = box
+        if tile is None or x1 - x0 > tile[1] or y1 - y0 > tile[0]:
+            return box
+        win_w, win_h = min(tile[1], width), min(tile[0], height)
+        wx0 = min(max((x0 + x1 - win_w) // 2, 0), width - win_w)
+        wy0 = min(max((y0 + y1 - win_h) // 2, 0), height - win_h)
+        return [wx0, wy0, wx0 + win_w, wy0 + win_h]
+
+    def run_batch(self, images, masks):
+        """images[N, 3, H, W](0~1)、masks[N, 1, H, W] -> 修复结果[N, H, W, 3](uint8)"""
+        if self.use_onnx:
+            outputs = self.ort_session.run(None, {'image': images, 'mask': masks})[0]
+            return np.clip(outputs.transpose(0, 2, 3, 1), 0, 255).astype(np.uint8)
+        with torch.inference_mode():
+            outputs = self.model(torch.from_numpy(images).to(self.device), torch.from_numpy(masks).to(self.device))
+            outputs = outputs.permute(0, 2, 3, 1).detach().cpu().numpy()
+        return np.clip(outputs * 255, 0, 255).astype(np.uint8)
+
+    def blend(self, result, box, window, patch, mask):
+        """只在ROI内的掩码及羽化边缘融合，窗口内其他ROI的区域不写"""
+        x0, y0, x1, y1 = box
+        patch = patch[y0 - window[1]:y1 - window[1], x0 - window[0]:x1 - window[0]].astype(np.float32)
+        region = (mask[y0:y1, x0:x1] > 0).astype(np.float32)
+        size = 2 * self.FEATHER + 1
+        alpha = cv2.GaussianBlur(cv2.dilate(region, np.ones((size, size), np.uint8)), (size, size), 0)
+        alpha = np.maximum(alpha, region)[..., None]
+        origin = result[y0:y1, x0:x1].astype(np.float32)
+        result[y0:y1, x0:x1] = np.clip(alpha * patch + (1 - alpha) * origin + 0.5, 0, 255).astype(np.uint8)
+
+    def inpaint_rois(self, image, mask):
+        """原分辨率ROI修复，返回修复后的图像，送入模型的像素数记录在self.last_pixels"""
+        image = np.asarray(image)
+        mask = np.asarray(mask)
+        if mask.ndim == 3:
+            mask = mask[..., 0]
+        height, width = image.shape[:2]
+        tile, fixed_batch = self.get_input_spec()
+        groups = {}  # 模型输入尺寸 -> [(ROI, 窗口, 缩放后尺寸, 图像, 掩码)]
+        for box in self.get_rois(mask):
+            window = self.get_window(box, tile, height, width)
+            x0, y0, x1, y1 = window
+            crop, crop_mask = image[y0:y1, x0:x1], mask[y0:y1, x0:x1]
+            h, w = crop.shape[:2]
+            if tile is not None and (h > tile[0] or w > tile[1]):  # 超出固定输入尺寸的ROI才缩放
+                scale = min(tile[0] / h, tile[1] / w)
+                h, w = max(int(h * scale), 1), max(int(w * scale), 1)
+                crop = cv2.resize(crop, (w, h), interpolation=cv2.INTER_AREA)
+                crop_mask = cv2.resize(crop_mask, (w, h), interpolation=cv2.INTER_NEAREST)
+            size = tile or (ceil_modulo(h, self.ROI_BUCKET), ceil_modulo(w, self.ROI_BUCKET))
+            crop = np.pad(crop, ((0, size[0] - h), (0, size[1] - w), (0, 0)), mode="symmetric")
+            crop_mask = np.pad(crop_mask, ((0, size[0] - h), (0, size[1] - w)))
+            groups.setdefault(size, []).append((box, window, (h, w), crop, crop_mask))
+
+        result = image.copy()
+        self.last_pixels = 0
+        step = fixed_batch or self.max_batch_size
+        for size, items in groups.items():
+            for start in range(0, len(items), step):
+                chunk = items[start:start + step]
+                images = np.stack([item[3].transpose(2, 0, 1) for item in chunk]).astype(np.float32) / 255
+                masks = np.stack([(item[4] > 0)[None] for item in chunk]).astype(np.float32)
+                self.last_pixels += size[0] * size[1] * len(chunk)
+                for (box, window, (h, w), _, _), patch in zip(chunk, self.run_batch(images, masks)):
+                    patch = patch[:h, :w]
+                    win_h, win_w = window[3] - window[1], window[2] - window[0]
+                    if (h, w) != (win_h, win_w):
+                        patch = cv2.resize(patch, (win_w, win_h), interpolation=cv2.INTER_CUBIC)
+                    self.blend(result, box, window, patch, mask)
+        return result
+
+    def inpaint_full(self, image, mask):
+        """原实现：整图修复"""
         operator = self.pre_process(image, mask)
         if self.use_onnx:
             outputs = self.ort_session.run(None, operator)
@@ -87,6 +203,7 @@ def predict_shapes(self, image, mask=None) -> AutoLabelingResult:
             output = output.astype(np.uint8)  # 转换为 uint8 类型
             # 调整输出图像大小，恢复原图尺寸
             inpainting = cv2.resize(output, (image.shape[1], image.shape[0]))
+            self.last_pixels = 512 * 512
 
         else:
             # 其他 PyTorch 代码块不变
@@ -95,13 +212,22 @@ def predict_shapes(self, image, mask=None) -> AutoLabelingResult:
             else:
                 orig_height, orig_width = np.array(image).shape[:2]
             image, mask = prepare_img_and_mask(image, mask, self.device)
+            self.last_pixels = image.shape[2] * image.shape[3]
             with torch.inference_mode():
-                print(image.shape, mask.shape)
                 inpainted = self.model(image, mask)
                 cur_res = inpainted[0].permute(1, 2, 0).detach().cpu().numpy()
                 cur_res = np.clip(cur_res * 255, 0, 255).astype('uint8')
                 inpainting = cur_res[:orig_height, :orig_width]
+        return inpainting
 
+    def predict_shapes(self, image, mask=None) -> AutoLabelingResult:
+        """
+        Predict shapes from image
+        """
+        if image is None or mask is None:
+            return AutoLabelingResult([], replace=False)
+        if self.inpaint_mode == "roi":
+            inpainting = self.inpaint_rois(image, mask)
+        else:
+            inpainting = self.inpaint_full(image, mask)
         return AutoLabelingResult([], replace=False, image=inpainting)
-
-
@@ -32,3 +32,8 @@ def find(self, key):
         """Returns True if key is in cache, False otherwise."""
         with self.lock:
             return key in self._cache
+
+    def clear(self):
+        """Remove all items from cache."""
+        with self.lock:
+            self._cache.clear()
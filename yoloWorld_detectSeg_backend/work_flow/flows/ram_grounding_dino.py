@@ -1,6 +1,8 @@
+import copy
 import os
 
-from . import __preferred_device__, AutoLabelingResult, RecognizeAnything, OnnxBaseModel, Grounding_DINO
+from . import __preferred_device__, AutoLabelingResult, RecognizeAnything, OnnxBaseModel, Grounding_DINO, \
+    DetectionRequest
 
 
 class RAM_Grounding_DINO:
@@ -10,6 +12,13 @@ def __init__(self, model_config, on_message) -> None:
         model_config['model_path'] = model_config['tag_model_path']
         self.ram = RecognizeAnything(model_config, on_message)
 
+    def __copy__(self):
+        """请求视图：内部的检测模型同样浅拷贝，输出模式只作用于本次请求"""
+        view = object.__new__(type(self))
+        view.__dict__.update(self.__dict__)
+        view.grounding_dino = copy.copy(self.grounding_dino)
+        return view
+
     def set_output_mode(self, mode):
         self.grounding_dino.set_output_mode(mode)
 
@@ -26,8 +35,8 @@ def predict_shapes(self, image, prompt_mode='split'):
         if prompt_mode == 'split':
             labels = self.ram.get_labels(tags)
             shapes = []
-            for label in labels:
-                results = self.grounding_dino.predict_shapes(image=image, text_prompt=label)
+            # 全部标签拼接为一个caption单次推理，结果按标签拆分
+            for results in self.grounding_dino.predict_phrases(image, DetectionRequest(phrases=labels)).values():
                 shapes.extend(results.shapes)
         elif prompt_mode == 'whole':
             prompt = self.ram.get_results(tags)
@@ -10,7 +10,8 @@
 
 import logging
 
-from . import __preferred_device__, Shape, AutoLabelingResult, ChineseClipONNX, LRUCache
+from . import __preferred_device__, Shape, AutoLabelingResult, ChineseClipONNX
+from .embedding_store import embedding_store
 from ..__base__.sam_hq import SegmentAnythingHQONNX
 from ..engines.model import Model
 
@@ -83,7 +84,7 @@ def __init__(self, config_path, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.embedding_cache = embedding_store.bind(encoder_model_abs_path, self.model.input_size)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -240,17 +241,9 @@ def predict_shapes(self, cv_image, filename=None) -> AutoLabelingResult:
         shapes = []
         try:
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
-            if cached_data is not None:
-                image_embedding = cached_data
-            else:
-                if self.stop_inference:
-                    return AutoLabelingResult([], replace=False)
-                image_embedding = self.model.encode(cv_image)
-                self.image_embedding_cache.put(
-                    filename,
-                    image_embedding,
-                )
+            if self.stop_inference:
+                return AutoLabelingResult([], replace=False)
+            image_embedding = self.embedding_cache.get_or_encode(cv_image, self.model.encode)
             if self.stop_inference:
                 return AutoLabelingResult([], replace=False)
             masks = self.model.predict_masks(image_embedding, self.marks)
@@ -279,18 +272,12 @@ def preload_worker(self, files):
         """
         files = files[: self.preloaded_size]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
             cv_image = self.load_image_from_filename(filename)
             if cv_image is None:
                 continue
             if self.stop_inference:
                 return
-            image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.embedding_cache.get_or_encode(cv_image, self.model.encode)
 
     def on_next_files_changed(self, next_files):
         """
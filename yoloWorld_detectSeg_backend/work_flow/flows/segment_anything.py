@@ -6,8 +6,10 @@
 
 import logging
 
-from . import __preferred_device__, Model, LRUCache, Shape, ChineseClipONNX, AutoLabelingResult
-from work_flow.__base__.sam import SegmentAnythingONNX, SamAutomaticMaskGenerator
+from . import __preferred_device__, Model, Shape, ChineseClipONNX, AutoLabelingResult
+from .embedding_store import embedding_store
+from work_flow.__base__.sam import SegmentAnythingONNX
+from work_flow.__base__.sam_amg import SamAutomaticMaskEngine
 
 
 class SegmentAnything(Model):
@@ -66,8 +68,9 @@ def __init__(self, config_path, on_message) -> None:
         self.automatic = self.config["automatic"]
         # Load sam flows
         if self.automatic:
-            self.model = SamAutomaticMaskGenerator(
-                encoder_model_abs_path, decoder_model_abs_path
+            self.model = SamAutomaticMaskEngine(
+                encoder_model_abs_path, decoder_model_abs_path,
+                num_workers=self.config.get("num_workers"),
             )
         else:
             self.model = SegmentAnythingONNX(
@@ -81,7 +84,7 @@ def __init__(self, config_path, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.embedding_cache = embedding_store.bind(encoder_model_abs_path, self.model.input_size)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -241,18 +244,9 @@ def predict_shapes(self, image, filename=None) -> AutoLabelingResult:
                 masks = [mask_data["segmentation"] for mask_data in data]
             else:
                 # Use cached image embedding if possible
-                cached_data = self.image_embedding_cache.get(filename)
-                if cached_data is not None:
-                    image_embedding = cached_data
-                else:
-                    if self.stop_inference:
-                        return AutoLabelingResult([], replace=False)
-                    image_embedding = self.model.encode(image)
-
-                    self.image_embedding_cache.put(
-                        filename,
-                        image_embedding,
-                    )
+                if self.stop_inference:
+                    return AutoLabelingResult([], replace=False)
+                image_embedding = self.embedding_cache.get_or_encode(image, self.model.encode)
                 if self.stop_inference:
                     return AutoLabelingResult([], replace=False)
                 masks = self.model.predict_masks(image_embedding, self.marks)
@@ -281,19 +275,12 @@ def preload_worker(self, files):
         """
         files = files[: self.preloaded_size]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
             image = self.load_image_from_filename(filename)
             if image is None:
                 continue
             if self.stop_inference:
                 return
-            cv_image = image
-            image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.embedding_cache.get_or_encode(image, self.model.encode)
 
     def on_next_files_changed(self, next_files):
         """
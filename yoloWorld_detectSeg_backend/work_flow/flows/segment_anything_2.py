@@ -6,7 +6,8 @@
 import traceback
 import numpy as np
 
-from . import __preferred_device__, SegmentAnything2ONNX, ChineseClipONNX, Model, LRUCache, AutoLabelingResult, Shape
+from . import __preferred_device__, SegmentAnything2ONNX, ChineseClipONNX, Model, AutoLabelingResult, Shape
+from .embedding_store import embedding_store
 
 
 class SegmentAnything2(Model):
@@ -74,7 +75,7 @@ def __init__(self, config_path, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.embedding_cache = embedding_store.bind(encoder_model_abs_path, self.model.encoder.input_shape[2:])
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -231,17 +232,9 @@ def predict_shapes(self, image, filename=None) -> AutoLabelingResult:
         cv_image = image
         try:
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
-            if cached_data is not None:
-                image_embedding = cached_data
-            else:
-                if self.stop_inference:
-                    return AutoLabelingResult([], replace=False)
-                image_embedding = self.model.encode(cv_image)
-                self.image_embedding_cache.put(
-                    filename,
-                    image_embedding,
-                )
+            if self.stop_inference:
+                return AutoLabelingResult([], replace=False)
+            image_embedding = self.embedding_cache.get_or_encode(cv_image, self.model.encode)
             if self.stop_inference:
                 return AutoLabelingResult([], replace=False)
             masks = self.model.predict_masks(image_embedding, self.marks)
@@ -270,19 +263,12 @@ def preload_worker(self, files):
         """
         files = files[: self.preloaded_size]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
             image = self.load_image_from_filename(filename)
             if image is None:
                 continue
             if self.stop_inference:
                 return
-            cv_image = image
-            image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.embedding_cache.get_or_encode(image, self.model.encode)
 
     def on_next_files_changed(self, next_files):
         """
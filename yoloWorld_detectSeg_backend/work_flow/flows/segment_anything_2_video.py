@@ -10,6 +10,7 @@
 from PyQt5 import QtCore
 from PyQt5.QtCore import QCoreApplication
 from . import Model, print_red, Shape, build_sam2, SAM2ImagePredictor, build_sam2_camera_predictor, AutoLabelingResult
+from ..__base__.sam2_stream import SAM2VideoStream, add_prompts, iter_frames
 
 import torch
 
@@ -115,6 +116,10 @@ def __init__(self, config_path, on_message) -> None:
             device=device, apply_postprocessing=apply_postprocessing
         )
         self.is_first_init = True
+        # 逐帧跟踪与流式分割都只保留窗口内的记忆帧
+        self.video_stream = SAM2VideoStream(
+            self.video_predictor, self.config.get("memory_window")
+        )
 
         # Initialize marking and prompting structures
         self.marks = []
@@ -358,40 +363,13 @@ def video_process(self, cv_image, filename):
 
         if self.is_first_init:
             self.video_predictor.load_first_frame(cv_image)
-            ann_frame_idx = 0
-            for i, prompt in enumerate(self.prompts):
-                ann_obj_id = (
-                    i + 1
-                )  # give a unique id to each object we interact with (it can be any integers)
-                if prompt["type"] == "rectangle":
-                    bbox = prompt["data"]
-                    (
-                        _,
-                        out_obj_ids,
-                        out_mask_logits,
-                    ) = self.video_predictor.add_new_prompt(
-                        frame_idx=ann_frame_idx,
-                        obj_id=ann_obj_id,
-                        bbox=bbox,
-                    )
-                elif prompt["type"] == "point":
-                    points = prompt["data"]["point_coords"]
-                    labels = prompt["data"]["point_labels"]
-                    (
-                        _,
-                        out_obj_ids,
-                        out_mask_logits,
-                    ) = self.video_predictor.add_new_prompt(
-                        frame_idx=ann_frame_idx,
-                        obj_id=ann_obj_id,
-                        points=points,
-                        labels=labels,
-                    )
+            add_prompts(self.video_predictor, self.prompts)
             self.is_first_init = False
             return [], False
         else:
             shapes = []
             out_obj_ids, out_mask_logits = self.video_predictor.track(cv_image)
+            self.video_stream.prune(0)
             for i in range(0, len(out_obj_ids)):
                 masks = out_mask_logits[i].cpu().numpy()
                 if len(masks.shape) == 4:
@@ -401,6 +379,33 @@ def video_process(self, cv_image, filename):
                 shapes.extend(self.post_process(masks, i))
             return shapes, True
 
+    def stream_video(self, source, window=None):
+        """Segment a whole video with the current prompts, frame by frame.
+
+        Args:
+            source: Video path, camera index, cv2.VideoCapture or an iterator of RGB frames.
+            window (int, optional): Frames kept in the memory bank. Defaults to config "memory_window"
+                or the model's memory attention range.
+
+        Yields:
+            tuple: (frame index, list of Shape objects) for every frame, the first frame included.
+        """
+        if not self.prompts:
+            return
+        stream = (
+            SAM2VideoStream(self.video_predictor, window)
+            if window else self.video_stream
+        )
+        try:
+            for frame_idx, obj_ids, mask_logits in stream.run(iter_frames(source), self.prompts):
+                shapes = []
+                for i in range(len(obj_ids)):
+                    shapes.extend(self.post_process(mask_logits[i][0], i))
+                yield frame_idx, shapes
+        finally:
+            # 流式分割占用了预测器状态，之后的逐帧跟踪需重新装载首帧
+            self.is_first_init = True
+
     def predict_shapes(
         self, image, filename=None, run_tracker=False
     ) -> AutoLabelingResult:
@@ -162,6 +162,7 @@ def post_process(self, masks, classes, colors, image=None):
             colors = filtered_colors
         # Contours to shapes
         shapes = []
+        clip_crops = []  # (shape, 区域图像)，循环结束后合并做一次CLIP分类
         for i, (approx, cls, color) in enumerate(zip(approx_contours, classes, colors)):
             if self.output_mode == "polygon":
                 # Scale points
@@ -205,9 +206,7 @@ def post_process(self, masks, classes, colors, image=None):
                     "rectangle" if self.output_mode == "rectangle" else "rotation"
                 )
                 if self.clip_net is not None and self.classes:
-                    img = image[y_min:y_max, x_min:x_max]
-                    out = self.clip_net(img, self.classes)
-                    shape.cache_label = self.classes[int(np.argmax(out))]
+                    clip_crops.append((shape, image[y_min:y_max, x_min:x_max]))
             else:
                 raise ValueError(f"Invalid output mode: {self.output_mode}")
             shape.closed = True
@@ -217,6 +216,12 @@ def post_process(self, masks, classes, colors, image=None):
             shape.selected = False
             shapes.append(shape)
 
+        if clip_crops:
+            labels = self.clip_net.classify_crops([crop for _, crop in clip_crops], self.classes)
+            for (shape, _), label in zip(clip_crops, labels):
+                if label is not None:
+                    shape.cache_label = label
+
         return shapes
 
     def color_mask(self, img, seg):
@@ -42,6 +42,25 @@ def warp_im(img_im, orgi_landmarks, tar_landmarks):
     dst = cv2.warpAffine(img_im, M[:2], (img_im.shape[1], img_im.shape[0]))
     return dst
 
+
+def transformation_from_points_batch(points1, points2):
+    """transformation_from_points的批量版本：points1[N, 5, 2]到points2[5, 2]的相似变换，返回[N, 2, 3]"""
+    points1 = np.asarray(points1, dtype=np.float64)
+    points2 = np.asarray(points2, dtype=np.float64)
+    c1 = points1.mean(axis=1, keepdims=True)
+    c2 = points2.mean(axis=0)
+    points1 = points1 - c1
+    points2 = points2 - c2
+    s1 = points1.std(axis=(1, 2), keepdims=True)
+    s2 = points2.std()
+    points1 = points1 / s1
+    points2 = points2 / s2
+    U, S, Vt = np.linalg.svd(points1.transpose(0, 2, 1) @ points2)
+    R = (U @ Vt).transpose(0, 2, 1)
+    sR = (s2 / s1) * R
+    t = c2[None, :, None] - sR @ c1.transpose(0, 2, 1)
+    return np.concatenate([sR, t], axis=2)
+
 class YOLOv6Face(YOLO):
     class Meta:
         required_config_names = [
@@ -216,6 +235,49 @@ def key_transform(self, img_im, bounding_box, points):
             raise ValueError("scale must be 112x96 or 112x112")
         return crop_im
 
+    def get_target_points(self):
+        if self.scale == '112x96':
+            return coord5point1, imgSize1
+        elif self.scale == '112x112':
+            return coord5point2, imgSize2
+        raise ValueError("scale must be 112x96 or 112x112")
+
+    def align_faces(self, image, lmdks):
+        """批量对齐：lmdks[N, 10]为原图中的五点坐标，一次求出全部仿射矩阵，直接在原图上变换到目标尺寸"""
+        if len(lmdks) == 0:
+            return []
+        tar_points, (tar_h, tar_w) = self.get_target_points()
+        matrices = transformation_from_points_batch(np.asarray(lmdks).reshape(-1, 5, 2), tar_points)
+        return [cv2.warpAffine(image, M, (tar_w, tar_h)) for M in matrices]
+
+    def detect_batch(self, images):
+        """多张图像(如同一工单的人物裁剪)一次推理，返回每张图像按置信度降序的结果[n, 16]，坐标已还原到原图"""
+        if not images:
+            return []
+        blob = np.concatenate([self.preprocess(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)) for image in images])
+        if hasattr(self.net, 'get_ort_batch_inference'):
+            predictions = self.net.get_ort_batch_inference(blob)
+        else:
+            predictions = np.concatenate([self.net.get_ort_inference(blob[i:i + 1]) for i in range(len(blob))])
+        outputs = []
+        for image, results in zip(images, self.postprocess(predictions)):
+            results = results[results[:, 4] >= self.conf_thres]
+            results = results[np.argsort(-results[:, 4])]
+            if len(results) > 0:
+                results[:, :4], results[:, -10:] = rescale_box_and_landmark(
+                    self.input_shape, results[:, :4], results[:, -10:], image.shape
+                )
+            outputs.append(results)
+        return outputs
+
+    def predict_batch(self, images, max_faces=None):
+        """批量检测并对齐，返回每张图像的 (结果[n, 16], 对齐人脸列表)，人脸按置信度降序"""
+        outputs = []
+        for image, results in zip(images, self.detect_batch(images)):
+            results = results[:max_faces]
+            outputs.append((results, self.align_faces(image, results[:, -10:])))
+        return outputs
+
     def predict_shapes(self, image, image_path=None):
         """
         Predict shapes from image
@@ -234,7 +296,7 @@ def predict_shapes(self, image, image_path=None):
             self.input_shape, results[:, :4], results[:, -10:], image.shape
         )
 
-        shapes, avatars = [], []
+        shapes = []
         for i, r in enumerate(reversed(results)):
             xyxy, score, cls_id, lmdks = r[:4], r[4], r[5], r[6:]
             if score < self.conf_thres:
@@ -265,9 +327,10 @@ def predict_shapes(self, image, image_path=None):
                 point_shape.add_point(x, y)
                 kpoints.append((x, y))
                 shapes.append(point_shape)
-            if self.scale is not None:
-                crop_img = self.key_transform(image.copy(), xyxy, lmdks)
-                avatars.append(crop_img)
+        avatars = []
+        if self.scale is not None:
+            kept = results[::-1][results[::-1, 4] >= self.conf_thres]
+            avatars = self.align_faces(image, kept[:, -10:])
         result = AutoLabelingResult(shapes, avatars=avatars, replace=True)
 
         return result
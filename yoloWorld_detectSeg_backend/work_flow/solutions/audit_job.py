@@ -0,0 +1,242 @@
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+from flask import Flask
+
+from database_models import AuditJobModel
+from extensions import db
+from work_flow.engines import load_model_class
+from work_flow.solutions import load_handler_class
+
+'''
+工单审核异步任务
+- 提交审核只落库并返回任务id，由有界的进程池执行handler
+- 整个部署只有一个调度方持有进程池：轮询库中排队的任务，在途任务数不超过工作进程数；
+  app.py单进程运行时调度方是本进程的调度线程，serve.py下web工作进程只落库，由主进程fork出的调度进程执行
+- 任务状态与阶段进度实时写回本地数据库，重启后排队/运行中的任务重新入队
+- 工作进程常驻最近使用的若干套工作流配置，后续任务复用，更早的配置淘汰并卸载
+'''
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# 工作进程内的全局状态
+_worker_app = None
+_worker_flows = OrderedDict()  # 整套工作流配置json -> {(flow_name, 配置json): 已装载的工作流实例}，按最近使用排序
+
+
+_worker_max_flow_sets = 1
+
+
+def init_worker(max_flow_sets=1):
+    """工作进程初始化：仅建立数据库上下文，不导入完整的web应用"""
+    global _worker_app, _worker_max_flow_sets
+    import config
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    _worker_app = app
+    _worker_max_flow_sets = max_flow_sets
+
+
+def dump_config(flow_config):
+    return json.dumps(flow_config, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def get_worker_flows(configs):
+    """复用本进程已装载的工作流，未装载的按配置装载
+    最多常驻_worker_max_flow_sets套配置，配置相同的单个工作流在各套之间共用；
+    淘汰的配置中不再被任何一套引用的工作流立即卸载
+    """
+    key = dump_config(configs)
+    if key in _worker_flows:
+        _worker_flows.move_to_end(key)
+    else:
+        loaded = {flow_key: flow for flow_set in _worker_flows.values() for flow_key, flow in flow_set.items()}
+        flow_set = {}
+        for flow_name, flow_config in configs.items():
+            flow_key = (flow_name, dump_config(flow_config))
+            if flow_key not in loaded:
+                loaded[flow_key] = load_model_class(flow_name)(flow_config, logging.info)
+            flow_set[flow_key] = loaded[flow_key]
+        _worker_flows[key] = flow_set
+        evict_worker_flows()
+    return {flow_name: flow for (flow_name, _), flow in _worker_flows[key].items()}
+
+
+def evict_worker_flows():
+    evicted = []
+    while len(_worker_flows) > _worker_max_flow_sets:
+        evicted.extend(_worker_flows.popitem(last=False)[1].values())
+    resident = {id(flow) for flow_set in _worker_flows.values() for flow in flow_set.values()}
+    for flow in evicted:
+        if id(flow) in resident or not hasattr(flow, 'unload'):
+            continue
+        try:
+            flow.unload()
+        except Exception as e:  # noqa
+            logging.warning(f"Error in unloading flow {type(flow).__name__}: {e}")
+    if evicted:
+        gc.collect()
+
+
+def run_audit_job(job_id):
+    """在工作进程中执行一个审核任务"""
+    with _worker_app.app_context():
+        job = AuditJobModel.query.get(job_id)
+        if job is None or job.status == JOB_FINISHED:
+            return
+        job.status = JOB_RUNNING
+        job.progress = {}
+        job.error = None
+        db.session.commit()
+
+        def on_progress(step, **info):
+            progress = dict(job.progress or {})
+            progress[step] = info
+            job.stage = step
+            job.progress = progress
+            db.session.commit()
+
+        try:
+            handler = load_handler_class(job.service_name)(
+                get_worker_flows(job.config), on_progress=on_progress)
+            log = handler.run(job.order_id)
+            result_path = os.path.join(handler.this_order_path, 'audit_log.json')
+            with open(result_path, 'w', encoding='utf-8') as f:
+                json.dump(log, f, ensure_ascii=False)
+            job.result_path = result_path
+            job.status = JOB_FINISHED
+            job.stage = 'finished'
+        except Exception as e:  # noqa
+            logging.error(f"Audit job {job_id} failed: {e}\n{traceback.format_exc()}")
+            db.session.rollback()
+            job = AuditJobModel.query.get(job_id)
+            job.status = JOB_FAILED
+            job.error = str(e)
+        db.session.commit()
+
+
+class AuditJobManager:
+    """审核任务调度：持久化任务队列 + 有界工作进程池
+    dispatching为True时本进程是调度方(启动调度线程并持有进程池)，否则提交任务只落库，由其他进程调用serve_forever执行
+    """
+    MAX_WORKERS = 2
+    MAX_FLOW_SETS = 1
+    POLL_INTERVAL = 2  # 秒，调度方轮询其他进程落库的任务的间隔
+
+    def __init__(self, max_workers=None, max_flow_sets=None, dispatching=True, poll_interval=None):
+        self.max_workers = max_workers or self.MAX_WORKERS
+        self.max_flow_sets = max_flow_sets or self.MAX_FLOW_SETS  # 每个工作进程常驻的工作流配置套数
+        self.dispatching = dispatching
+        self.poll_interval = poll_interval or self.POLL_INTERVAL
+        self.executor = None
+        self.inflight = set()  # 已交给进程池的任务id
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.dispatcher = None
+
+    def init_app(self, app):
+        """本进程是调度方时启动调度线程"""
+        if multiprocessing.current_process().name != 'MainProcess':
+            return  # spawn方式下工作进程会重新导入主模块，不能在其中再次调度
+        if self.dispatching:
+            self.dispatcher = Thread(target=self.serve_forever, args=(app,), name='audit-dispatcher', daemon=True)
+            self.dispatcher.start()
+
+    @staticmethod
+    def recover(app):
+        """重启后将未完成的任务重新置为排队"""
+        with app.app_context():
+            try:
+                jobs = (AuditJobModel.query
+                        .filter(AuditJobModel.status.in_([JOB_QUEUED, JOB_RUNNING]))
+                        .order_by(AuditJobModel.id).all())
+                for job in jobs:
+                    job.status = JOB_QUEUED
+                db.session.commit()
+            except Exception as e:  # noqa
+                logging.warning(f"Could not recover audit jobs: {e}")
+                return
+            if jobs:
+                logging.info(f"Recovered {len(jobs)} audit jobs")
+
+    def serve_forever(self, app):
+        """调度方主循环：有空闲工作进程时按提交顺序取出排队的任务执行"""
+        self.recover(app)
+        while True:
+            try:
+                with app.app_context():
+                    self.dispatch_queued()
+                    db.session.remove()
+            except Exception as e:  # noqa
+                logging.warning(f"Audit dispatch failed: {e}")
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def dispatch_queued(self):
+        with self.lock:
+            free = self.max_workers - len(self.inflight)
+            inflight = set(self.inflight)
+        if free <= 0:
+            return
+        query = AuditJobModel.query.filter_by(status=JOB_QUEUED)
+        if inflight:
+            query = query.filter(AuditJobModel.id.notin_(inflight))
+        for job in query.order_by(AuditJobModel.id).limit(free).all():
+            self.dispatch(job.id)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker,
+                                                    initargs=(self.max_flow_sets,))
+            return self.executor
+
+    def dispatch(self, job_id):
+        with self.lock:
+            self.inflight.add(job_id)
+        future = self.get_executor().submit(run_audit_job, job_id)
+        future.add_done_callback(lambda done: self.on_job_done(job_id, done))
+        return future
+
+    def on_job_done(self, job_id, future):
+        if future.exception() is not None:
+            logging.error(f"Audit worker crashed: {future.exception()}")
+        with self.lock:
+            self.inflight.discard(job_id)
+            if isinstance(future.exception(), BrokenProcessPool):
+                self.executor = None  # 进程池已损坏，下次调度时重建
+        self.wakeup.set()
+
+    def submit(self, order_id, service_name, configs):
+        """落库并返回任务，由调度方取出执行"""
+        job = AuditJobModel(order_id=order_id, service_name=service_name, config=configs,
+                            status=JOB_QUEUED, create_time=datetime.now())
+        db.session.add(job)
+        db.session.commit()
+        if self.dispatching:
+            self.wakeup.set()
+        return job
+
+    @staticmethod
+    def get_job(job_id):
+        return AuditJobModel.query.get(job_id)
+
+    @staticmethod
+    def get_job_log(job):
+        if job.status != JOB_FINISHED or not job.result_path or not os.path.exists(job.result_path):
+            return None
+        with open(job.result_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
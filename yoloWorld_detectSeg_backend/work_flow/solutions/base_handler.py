@@ -11,22 +11,20 @@
 from geopy import Nominatim
 from sqlalchemy import desc
 
+import config
+from utils.backend_utils.clip_index import clip_retriever
+from utils.backend_utils.duplicate_index import duplicate_index, iter_order_images, load_index_image
+from utils.backend_utils.face_gallery import face_gallery
+from utils.backend_utils.image_fetcher import image_fetcher
 from work_flow.engines import load_model_class
+from work_flow.solutions.crop_stage import CropClassificationStage
+from work_flow.solutions.face_stage import FaceVerificationStage
 from database_models import WorkOrderModel, ServiceModel, ServiceLogModel,MemberModel, EmployeeModel, ExecuteModel
 import requests
 from PIL import Image
 from io import BytesIO
 
 
-def get_access_token(API_KEY, SECRET_KEY):
-    """
-    使用 AK，SK 生成鉴权签名（Access Token）
-    :return: access_token，或是None(如果错误)
-    """
-    url = "https://aip.baidubce.com/oauth/2.0/token"
-    params = {"grant_type": "client_credentials", "client_id": API_KEY, "client_secret": SECRET_KEY}
-    return str(requests.post(url, params=params).json().get("access_token"))
-
 # 获取地址的经纬度范围
 def get_address_bounds(address):
     geolocator = Nominatim(user_agent="geoapiExercises")
@@ -51,35 +49,32 @@ def is_point_in_area(bounds, location):
     # 检查给定的经纬度是否在边界框内
     return min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
 
-def split_images(field: str)->List:
-    # 将 field 字符串按分号分割成 URL 列表
+def split_urls(field: str) -> List:
+    # 将 field 字符串按逗号分割成 URL 列表
     if field is None or not field:
         return []
-    urls = field.split(',')
-    images = []
-    for url in urls:
-        try:
-            # 从 URL 下载图片
-            response = requests.get(url)
-            response.raise_for_status()  # 如果请求失败会抛出异常
-            # 将下载的内容转化为图片
-            img = Image.open(BytesIO(response.content))
-            img = np.array(img)
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-            images.append(img)  # 添加到图片列表
-        except Exception as e:
-            print(f"Error downloading or processing image from {url}: {e}")
-    return images
+    return [url.strip() for url in field.split(',') if url.strip()]
+
+def load_url_images(urls: List) -> List:
+    # 并发下载(或命中本地缓存)并解码，下载失败的图片跳过
+    images = image_fetcher.load_many(urls)
+    return [cv2.cvtColor(images[url], cv2.COLOR_RGB2BGR) for url in urls if url in images]
+
+def split_images(field: str)->List:
+    return load_url_images(split_urls(field))
 
 def get_url_image(url: str):
-    response = requests.get(url)
-    response.raise_for_status()
-    img = Image.open(BytesIO(response.content))
-    img = np.array(img)
+    img = image_fetcher.load(url)
     img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
     return img
 
 
+def encode_image_bytes(data, ext='.jpeg') -> str:
+    # 直接对原始编码字节做base64，不再重新编码
+    mime = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.bmp': 'bmp', '.gif': 'gif',
+            '.tiff': 'tiff', '.webp': 'webp'}.get(ext.lower(), 'jpeg')
+    return f"data:image/{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
 def base64_encode_image(image) -> str:
     buffered = BytesIO()
     image=np.array(image)
@@ -106,6 +101,7 @@ def save_avatar(self, avatar, path):
         else:
             raise ValueError(f"Invalid avatar type: {type(avatar)}")
         cv2.imwrite(path, img)
+        return img
 
     def save(self, path):
         # 创建路径文件夹
@@ -132,14 +128,14 @@ def save(self, path):
                 avatar_folder = os.path.join(avatars_folder, f"{i + 1}")
                 os.makedirs(avatar_folder, exist_ok=True)
                 avatar_file_path = os.path.join(avatars_folder, f"{i + 1}.jpeg")
-                self.save_avatar(img, avatar_file_path)
+                img = self.save_avatar(img, avatar_file_path)
                 # 保存附加信息
                 with open(os.path.join(avatar_folder, "info.txt"), 'w') as f:
                     f.write(str(info))
             else:
                 # 如果是单一图片，直接保存
                 avatar_file_path = os.path.join(avatars_folder, f"{i + 1}.jpeg")
-                self.save_avatar(avatar, avatar_file_path)
+                img = self.save_avatar(avatar, avatar_file_path)
             base_avatars.append(base64_encode_image(img))
 
         self.base_avatars = base_avatars
@@ -148,10 +144,6 @@ def save(self, path):
 class BaseHandler:
     local_order_addr = 'E:\Datasets\exception order'
     local_saver = "E:\Datasets\order_handle_result"
-    request_url = "https://aip.baidubce.com/rest/2.0/image-classify/v1/realtime_search/similar/search"
-    API_KEY = "gwcTSOuEW0M07fMSNb7I62sV"
-    SECRET_KEY = "d75FG1eqS0XL025pbyX5gRf1R20MriGi"
-    access_token = get_access_token(API_KEY, SECRET_KEY)
     time_format = "%Y-%m-%d %H:%M:%S"
     avatar_keys = ['document_photo', 'front_card', 'reverse_card', 'me_photo']
     img_keys = ['start_img', 'middle_img', 'end_img']
@@ -177,10 +169,14 @@ def __init__(self, configs, **kwargs):
         self.log = {}
         self.origin = {}
         self.operators = {stage: [] for stage in self.img_keys}
-        load_type = getattr(kwargs, 'load_type', 'follow')
+        self.on_progress = kwargs.get('on_progress', None)  # 阶段进度回调 on_progress(step, **info)
+        self.crop_stages = {}  # 分类流程名 -> CropClassificationStage
+        self.face_stage = None
+        load_type = kwargs.get('load_type', 'follow')
         if load_type == 'once':
             for key, value in configs.items():
-                self.register_flow(key)
+                if type(value) == dict:
+                    self.register_flow(key)
 
     def register_flow(self, flow_name):
         self.flows[flow_name] = load_model_class(flow_name)(self.flows[flow_name], logging.info)
@@ -192,25 +188,61 @@ def mapping_flow(self, flow_name):
             self.register_flow(flow_name)
         return self.flows[flow_name]
 
-    def get_local_image(self, path):
-        # 定义常见图片文件扩展名
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
-
+    def get_crop_stage(self, flow_name):
+        """检测框裁剪的批量分类阶段"""
+        if flow_name not in self.crop_stages:
+            self.crop_stages[flow_name] = CropClassificationStage(self.mapping_flow(flow_name))
+        return self.crop_stages[flow_name]
+
+    def get_face_stage(self, detector='yolov6_face', embedder='arcface'):
+        """人物框的批量人脸检测与核验阶段"""
+        if self.face_stage is None:
+            self.face_stage = FaceVerificationStage(self.mapping_flow(detector), self.mapping_flow(embedder))
+        return self.face_stage
+
+    def get_face_index(self, embedder='arcface'):
+        """当前特征模型对应的人脸库索引"""
+        flow = self.mapping_flow(embedder)
+        namespace = '_'.join(str(v) for v in (flow.config.get('name', embedder), flow.config.get('model_type')) if v)
+        return face_gallery.get_index(namespace)
+
+    def enroll_avatars(self, kind, identity_id, avatars, sources):
+        """头像检测并对齐人脸后按头像地址入库，已入库的头像不再重复提取；
+        身份没有任何记录且头像都未检测到人脸时，以第一张头像居中的正方形区域入库
+        """
+        face_index = self.get_face_index()
+        pending = [(avatar, source) for avatar, source in zip(avatars, sources)
+                   if not face_index.has(kind, identity_id, source)]
+        if not pending:
+            return face_index
+        face_stage = self.get_face_stage()
+        detected = []
+        for face, (_, source) in zip(face_stage.detect_avatars([avatar for avatar, _ in pending]), pending):
+            if face is None:
+                face_index.skip(kind, identity_id, source)
+            else:
+                detected.append((face[0], face[1], source))
+        if not detected and not face_index.has(kind, identity_id):
+            detected = [(face_stage.center_square(pending[0][0]), 0.0, pending[0][1])]
+        if detected:
+            faces, qualities, sources = zip(*detected)
+            face_index.add(kind, identity_id, face_stage.embed(list(faces)), qualities, sources, origin='avatar')
+        return face_index
+
+    def get_local_image(self, path, with_bytes=False):
         # 创建一个列表，用来存储图片文件的元组
         image_files = []
+        image_bytes = []
 
-        # 遍历目录中的文件
-        for file_name in os.listdir(path):
-            # 获取文件的完整路径
-            file_path = os.path.join(path, file_name)
-            # 判断文件是否为文件且具有有效的图片扩展名
-            if os.path.isfile(file_path) and os.path.splitext(file_name)[1].lower() in image_extensions:
-                # 去除文件扩展名
-                file_base_name = os.path.splitext(file_name)[0]
-                # 将图片名称（去扩展名）和路径作为元组添加到列表中
-                img = cv2.imread(file_path)
-                image_files.append([img, file_base_name])
+        # 与近重复索引、CLIP索引共用同一读取顺序与解码过滤，图像序号一致；解码与后续保存、base64化共用同一份字节
+        for file_name, data, img in iter_order_images(path):
+            file_base_name, ext = os.path.splitext(file_name)
+            # 将图片名称（去扩展名）和路径作为元组添加到列表中
+            image_files.append([img, file_base_name])
+            image_bytes.append((data, ext))
 
+        if with_bytes:
+            return image_files, image_bytes
         return image_files
 
     def field_grab(self, order_id):
@@ -237,15 +269,21 @@ def field_grab(self, order_id):
         self.fields['employee']['avatars'] = []
         self.fields['member']['avatars'] = []
         # 服务对象可能同时为系统中的注册服务者
+        # 服务者与服务对象的全部头像一次并发下载
+        employee_urls = [url for key in self.avatar_keys for url in split_urls(getattr(employee, key))]
+        member_urls = []
         if self.fields['member']['emp_id'] is not None: # 若服务对象同时也是系统中的注册服务者
-            self.fields['member']['avatars'] = []
             member_emp = EmployeeModel.query.get(member.emp_id)
-            for key in self.avatar_keys:
-                self.fields['member']['avatars'].extend(split_images(getattr(member_emp, key)))
-            if len(self.fields['member']['avatars']) > 0:
-                self.hasMebAvatar = True
-        for key in self.avatar_keys:
-            self.fields['employee']['avatars'].extend(split_images(getattr(employee, key)))
+            member_urls = [url for key in self.avatar_keys for url in split_urls(getattr(member_emp, key))]
+        avatars = image_fetcher.load_many(employee_urls + member_urls)
+        self.fields['member']['avatars'] = [cv2.cvtColor(avatars[url], cv2.COLOR_RGB2BGR)
+                                            for url in member_urls if url in avatars]
+        self.fields['member']['avatar_urls'] = [url for url in member_urls if url in avatars]
+        if len(self.fields['member']['avatars']) > 0:
+            self.hasMebAvatar = True
+        self.fields['employee']['avatars'] = [cv2.cvtColor(avatars[url], cv2.COLOR_RGB2BGR)
+                                              for url in employee_urls if url in avatars]
+        self.fields['employee']['avatar_urls'] = [url for url in employee_urls if url in avatars]
         if len(self.fields['employee']['avatars']) > 0:
             self.hasEmpAvatar = True
 
@@ -256,15 +294,15 @@ def field_grab(self, order_id):
             # 读取本地预存图片
             key_img_path = os.path.join(local_order_path, key)
             # self.fields['service_log'][key] = split_images(self.fields['service_log'][key])
-            self.fields['service_log'][key] = self.get_local_image(key_img_path)
+            self.fields['service_log'][key], image_bytes = self.get_local_image(key_img_path, with_bytes=True)
             self.origin[key] = []
-            for idx, item in enumerate(self.fields['service_log'][key]):
-                img = item[0]
-                local_path = os.path.join(origin_path, key, f"{idx}.jpeg")
-                cv2.imwrite(local_path, img.astype(np.uint8))
+            for idx, (data, ext) in enumerate(image_bytes):
+                # 原图字节直接写出与base64化，不再重新编码
+                local_path = os.path.join(origin_path, key, f"{idx}{ext.lower()}")
+                with open(local_path, 'wb') as f:
+                    f.write(data)
                 print(f"Save image to {local_path}")  # 本地路径base64化
-                cvt_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                self.origin[key].append(base64_encode_image(cvt_img.astype(np.uint8)))
+                self.origin[key].append(encode_image_bytes(data, ext))
             self.operators[key].append({})
 
         self.origin['img_url'] = self.origin['middle_img']
@@ -274,24 +312,46 @@ def location_field(self, now_coordinate, target_location):
         bounds = get_address_bounds(target_location)
         return is_point_in_area(bounds, now_coordinate)
 
-    def his_similar(self, img):
+    def his_similar(self, hashes):
         '''
-        相似图检索—检索
+        相似图检索—在本地历史工单图像的近重复索引中检索，返回 [(历史图像, 匹配信息)]
         '''
-        request_url = "https://aip.baidubce.com/rest/2.0/image-classify/v1/realtime_search/similar/search"
-        access_token = ''
-        params = {"image": img, "pn": 200, "rn": 100}
-        request_url = request_url + "?access_token=" + access_token
-        headers = {'content-type': 'application/x-www-form-urlencoded'}
-        response = requests.post(request_url, data=params, headers=headers)
-        if response:
-            results = response.json()
-            sim_urls = []
-            for result in results['result']:
-                if result['score'] >= self.sim_thresh:
-                    sim_urls.append(result['brief']['img_url'])
-        else:
-            return False
+        similar = []
+        for match in duplicate_index.search(hashes=hashes, exclude_order=self.order_id):
+            co_img = load_index_image(self.local_order_addr, match['order_id'], match['stage'], match['index'])
+            if co_img is not None:
+                similar.append((co_img, match))
+        return similar
+
+    def clip_similar(self, images):
+        '''
+        语义相似检索—一个阶段的图像(BGR)合并编码后在历史工单的CLIP索引中检索，
+        返回 (特征[N, D], 每张图像达到阈值的 [(历史图像, 匹配信息)])；未配置CLIP检索模型时特征为None
+        '''
+        if not clip_retriever.enabled or not images:
+            return None, [[] for _ in images]
+        feats = clip_retriever.embed([cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images])
+        similar = []
+        for matches in clip_retriever.search(feats, config.CLIP_INDEX_TOP_K, exclude_order=self.order_id):
+            containers = []
+            for match in matches:
+                if match['score'] < config.CLIP_SIM_THRESHOLD:
+                    break
+                co_img = load_index_image(self.local_order_addr, match['order_id'], match['stage'], match['index'])
+                if co_img is not None:
+                    containers.append((co_img, match))
+            similar.append(containers)
+        return feats, similar
+
+    def index_order_images(self, image_hashes, clip_feats=None):
+        """
+        审核完成的工单图像增量写入近重复索引与CLIP索引，
+        image_hashes为 {阶段: {图像序号: (pHash, dHash)}}，clip_feats为 {阶段: 特征[N, D]}
+        """
+        for stage, hashes in image_hashes.items():
+            duplicate_index.add(self.order_id, stage, list(hashes.items()))
+        for stage, feats in (clip_feats or {}).items():
+            clip_retriever.add(self.order_id, stage, list(range(len(feats))), feats)
 
     def field_processing(self):
         self.log['field'] = []
@@ -380,6 +440,10 @@ def load_local_estimate(self):
                 self.log[key].append(LogItem(msg, type, avatars))
 
 
+    def report_progress(self, step, **info):
+        if self.on_progress is not None:
+            self.on_progress(step, **info)
+
     def opt_processing(self):
         self.log['operator'] = []
         pass
@@ -389,14 +453,21 @@ def post_processing(self):
         pass
 
     def run(self, order_id, **kwargs):
+        self.order_id = order_id
         self.this_order_path = os.path.join(self.local_saver, str(order_id))
         if os.path.exists(self.this_order_path):
+            self.report_progress('load_local_estimate')
             self.load_local_estimate()
         else:
+            self.report_progress('field_grab')
             self.field_grab(order_id)
+            self.report_progress('field_processing')
             self.field_processing()
+            self.report_progress('opt_processing')
             self.opt_processing()
+            self.report_progress('post_processing')
             self.post_processing()
+        self.report_progress('saving')
         result = {}
         result['origin'] = []
         for key in self.out_keys:
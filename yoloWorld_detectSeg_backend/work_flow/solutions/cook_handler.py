@@ -1,4 +1,3 @@
-import base64
 import os
 import re
 from datetime import datetime
@@ -6,16 +5,16 @@
 
 import cv2
 import numpy as np
-import requests
 from PIL import Image
 
+import config
+from utils.backend_utils.duplicate_index import compute_hashes
+from work_flow.engines.types import DetectionRequest
 from work_flow.flows.pixel_analysis import PixelAnalysis
-from work_flow.solutions.base_handler import BaseHandler, LogItem, get_url_image
+from work_flow.solutions.base_handler import BaseHandler, LogItem
 from work_flow.utils.canvas import Canvas
 from work_flow.utils.image import crop_polygon_object
 
-predict_drawer = Canvas()
-
 def time_format(time_str, format="%Y-%m-%d %H:%M:%S"):
     datetime.strptime(time_str, format)
 
@@ -40,7 +39,6 @@ def is_all_true(d):
     'paper receipt': 0.65
 }
 class CookHandler(BaseHandler):
-    sim_score = 0.8
     Flow_Keys = ['grounding_dino', 'ppocr_v4_lama', 'yolov6_face', 'arcface', 'cbiaformer_cls', "deit_cls"]  # 注册工作流
     pixelanalysis = PixelAnalysis()
     Registered_Text_Prompts = { # grounding_dino动态配置
@@ -62,6 +60,7 @@ class CookHandler(BaseHandler):
         }
     }
     Enhanced_Keys = ['ingredient', 'food']
+    dino_single_pass = True  # 同一阶段的全部提示词拼接为一个caption，每张图像只推理一次
     Registered_OCR_Format = {
         '姓名账号': '[\u4e00-\u9fa5]{2,5}/\d{11}',
         '身份证号': '\d{18}',
@@ -72,6 +71,16 @@ def __init__(self, configs, **kwargs):
         super().__init__(configs, **kwargs)
 
 
+    def detect_stage_objects(self, stage, img):
+        """单次前向推理检测该阶段注册的全部提示词，返回 {提示词: 检测结果}"""
+        request = DetectionRequest()
+        for object, text_prompts in self.Registered_Text_Prompts[stage].items():
+            request.phrases.extend(text_prompts)
+            if object in special_thresh_for_dino:
+                for text_prompt in text_prompts:
+                    request.phrase_thresholds[text_prompt] = special_thresh_for_dino[object]
+        return self.mapping_flow('grounding_dino').predict_phrases(img, request)
+
     def opt_processing(self):
         super().opt_processing()
         operator_path = os.path.join(self.this_order_path, 'operator')
@@ -80,6 +89,8 @@ def opt_processing(self):
 
         # 文字水印提取+消除
         self.operators['ppocr_v4_lama'] = {}
+        self.image_hashes = {}
+        self.clip_feats = {}
         ppocr_v4_lama_path = os.path.join(operator_path, 'ppocr_v4_lama')
         os.makedirs(ppocr_v4_lama_path, exist_ok=True)
 
@@ -87,28 +98,22 @@ def opt_processing(self):
             self.operators['ppocr_v4_lama'][stage] = {}
             ppocr_v4_lama_stage_path = os.path.join(ppocr_v4_lama_path, stage)
             os.makedirs(ppocr_v4_lama_stage_path, exist_ok=True)
+            clip_images = []
             for id, item in enumerate(self.fields['service_log'][stage]):
                 img, _ = item
                 print(f'water mark remove and extract Processing {stage} image {id}')
+                self.report_progress('opt_processing', flow='ppocr_v4_lama', img_stage=stage,
+                                     index=id, total=len(self.fields['service_log'][stage]))
                 results = self.mapping_flow('ppocr_v4_lama').predict_shapes(img)
                 if results.image is not None:
                     cv2.imwrite(os.path.join(ppocr_v4_lama_stage_path, f'{id}.jpeg'), results.image)
                 if stage == 'middle_img':
-                    # 重复图像
-                    _, img_encoded = cv2.imencode('.jpeg', results.image)  # 将图片编码为 JPEG 格式
-                    img_base64_str = base64.b64encode(img_encoded.tobytes()).decode('utf-8')  # 编码为 base64 字符串
-                    params = {"image": img_base64_str, "pn": 200, "rn": 100}
-                    request_url = self.request_url + "?access_token=" + self.access_token
-                    headers = {'content-type': 'application/x-www-form-urlencoded'}
-                    response = requests.post(request_url, data=params, headers=headers)
-                    sim_containers = []
-                    for result in response.json()['result']:
-                        if result['score'] >= self.sim_score:
-                            img_url = result['score']['brief']['img_url']
-                            co_img = get_url_image(img_url)
-                            cv2.imshow('123', co_img)
-                            sim_containers.append((co_img, result['score']['brief']))
-                    if not sim_containers:
+                    # 重复图像：在本地历史工单图像的近重复索引中检索
+                    hashes = compute_hashes(results.image)
+                    self.image_hashes.setdefault(stage, {})[id] = hashes
+                    clip_images.append(results.image)
+                    sim_containers = self.his_similar(hashes)
+                    if sim_containers:
                         self.log['operator'].append(LogItem(f"工作流 相似图像数据库 阶段: {stage} 图像id: {id} 识别到相似图片",
                                                              'warning', avatars=sim_containers))
                     # 网图识别
@@ -138,6 +143,18 @@ def opt_processing(self):
                             LogItem(f"工作流: ppocr_v4_lama 阶段: {stage} 图像: {id} 未识别水印信息:手机时间",
                                     'warning'))
 
+            if clip_images:
+                # 语义相似：去水印后的图像合并编码，检索重拍、裁剪或调色后复用的历史图像
+                feats, clip_containers = self.clip_similar(clip_images)
+                if feats is not None:
+                    self.clip_feats[stage] = feats
+                for id, sim_containers in enumerate(clip_containers):
+                    if sim_containers:
+                        orders = sorted({match['order_id'] for _, match in sim_containers})
+                        self.log['operator'].append(
+                            LogItem(f"工作流 CLIP语义检索 阶段: {stage} 图像id: {id} 与历史工单{orders}的图像语义高度相似",
+                                    'warning', avatars=sim_containers))
+
             this_mark_array = list(self.operators['ppocr_v4_lama'][stage].values())
             if len(this_mark_array) > 1 and all(item is not None for item in this_mark_array):  # 确保所有时间不为 None
                 # 获取最早和最晚的时间
@@ -156,6 +173,7 @@ def opt_processing(self):
         self.operators['grounding_dino'] = {}
         self.operators['yolov6_face'] = {}
         self.operators['arcface'] = {}
+        self.operators['face_quality'] = {}
         self.operators['deit_cls'] = {}
         self.operators['cbiaformer_cls'] = {}
 
@@ -180,24 +198,31 @@ def opt_processing(self):
                 for id, item in enumerate(self.fields['service_log'][stage]):
                     img, info = item
                     cbia_idx, deit_idx, face_idx = 0, 0, 0
+                    self.report_progress('opt_processing', flow='grounding_dino', img_stage=stage,
+                                         index=id, total=len(self.fields['service_log'][stage]))
                     dino_stage_id_path = os.path.join(dino_stage_path, str(id))
                     os.makedirs(dino_stage_id_path, exist_ok=True)
 
                     self.operators['grounding_dino'][stage][id] = {}
+                    stage_results = self.detect_stage_objects(stage, img) if self.dino_single_pass else {}
                     for object, text_prompts in self.Registered_Text_Prompts[stage].items():
 
                         dino_stage_id_object_path = os.path.join(dino_stage_id_path, object)
                         os.makedirs(dino_stage_id_object_path, exist_ok=True)
 
-                        if object in special_thresh_for_dino:  # 特殊置信度赋值
-                            self.mapping_flow('grounding_dino').box_threshold = special_thresh_for_dino[object]
+                        # 特殊置信度随请求传递，不修改共享的模型实例
+                        request = DetectionRequest(box_threshold=special_thresh_for_dino.get(object))
                         self.operators['grounding_dino'][stage][id][object] = []
 
                         for text_prompt in text_prompts:
-                            results = self.mapping_flow('grounding_dino').predict_shapes(img, text_prompt=text_prompt)
+                            if self.dino_single_pass:
+                                results = stage_results[text_prompt]
+                            else:
+                                results = self.mapping_flow('grounding_dino').predict_shapes(
+                                    img, text_prompt=text_prompt, request=request)
                             if type(results) is not list and len(results.shapes) > 0:
                                 results.image = img
-                                predict_drawer.remove_results()
+                                predict_drawer = Canvas()
                                 predict_drawer.load_results(results)
                                 pred_img = predict_drawer.draw()
                                 if pred_img is not None:
@@ -214,9 +239,9 @@ def opt_processing(self):
                                     self.operators['deit_cls'][stage] = {}
                                 if id not in self.operators['deit_cls'][stage]:
                                     self.operators['deit_cls'][stage][id] = []
-                                for shape in self.operators['grounding_dino'][stage][id][object]:
-                                    cropped_obj = crop_polygon_object(img.copy(), shape.points)
-                                    ingredient_result = self.mapping_flow('deit_cls').predict_shapes(cropped_obj)
+                                # 该图像全部食材框一次批量分类
+                                for cropped_obj, ingredient_result in self.get_crop_stage('deit_cls').run(
+                                        img, self.operators['grounding_dino'][stage][id][object]):
                                     if type(ingredient_result) is not list:
                                         info = ingredient_result.description
                                         self.operators['deit_cls'][stage][id].append(info)
@@ -233,9 +258,9 @@ def opt_processing(self):
                                     self.operators['cbiaformer_cls'][stage] = {}
                                 if id not in self.operators['cbiaformer_cls'][stage]:
                                     self.operators['cbiaformer_cls'][stage][id] = []
-                                for shape in self.operators['grounding_dino'][stage][id][object]:
-                                    cropped_obj = crop_polygon_object(img.copy(), shape.points)
-                                    food_result = self.mapping_flow('cbiaformer_cls').predict_shapes(cropped_obj)
+                                # 该图像全部食物框一次批量分类
+                                for cropped_obj, food_result in self.get_crop_stage('cbiaformer_cls').run(
+                                        img, self.operators['grounding_dino'][stage][id][object]):
                                     if type(food_result) is not list:
                                         info = food_result.description
                                         self.operators['cbiaformer_cls'][stage][id].append(info)
@@ -255,21 +280,22 @@ def opt_processing(self):
 
                                 if stage not in self.operators['arcface']:
                                     self.operators['arcface'][stage] = {}
+                                    self.operators['face_quality'][stage] = {}
                                 if id not in self.operators['arcface'][stage]:
                                     self.operators['arcface'][stage][id] = []
-
-                                for shape in self.operators["grounding_dino"][stage][id][object]:
-                                    cropped_obj = crop_polygon_object(img.copy(), shape.points)
-                                    face_results = self.mapping_flow('yolov6_face').predict_shapes(cropped_obj)
-                                    if type(face_results) is not list and len(face_results.avatars) > 0:
-                                        face = face_results.avatars[0]  # 只取第一个人脸
-                                        self.operators['yolov6_face'][stage][id].append(face)
-                                        self.operators['arcface'][stage][id].append(self.mapping_flow('arcface').get_embedding(face))
-
-                                        face_save_path = os.path.join(face_path, stage, str(id), str(face_idx))
-                                        os.makedirs(face_save_path, exist_ok=True)
-                                        cv2.imwrite(os.path.join(face_save_path, 'cropper.jpeg'), face)
-                                        face_idx += 1
+                                    self.operators['face_quality'][stage][id] = []
+
+                                # 该图像全部人物框一次批量检测人脸、对齐并提取特征
+                                faces, feats, qualities = self.get_face_stage().run(
+                                    img, self.operators["grounding_dino"][stage][id][object])
+                                self.operators['yolov6_face'][stage][id].extend(faces)
+                                self.operators['arcface'][stage][id].extend(feats)
+                                self.operators['face_quality'][stage][id].extend(qualities)
+                                for face in faces:
+                                    face_save_path = os.path.join(face_path, stage, str(id), str(face_idx))
+                                    os.makedirs(face_save_path, exist_ok=True)
+                                    cv2.imwrite(os.path.join(face_save_path, 'cropper.jpeg'), face)
+                                    face_idx += 1
 
                     # 服务者-厨具-食材同框
                     if stage == 'middle_img':
@@ -409,28 +435,48 @@ def post_processing(self):
                                                 type='error'))
 
         # 判断
-        emp_attr, meb_attr= None, None
+        # 服务者/服务对象的参考特征取自人脸库，头像只在首次出现时提取入库
+        face_stage = self.get_face_stage()
+        identities = {}
         if self.hasEmpAvatar:
-            emp_attr = (self.mapping_flow('arcface')
-                        .get_embedding(self.fields['employee']['avatars'][0]))
+            identities['employee'] = self.fields['employee']['id']
+            self.enroll_avatars('employee', identities['employee'], self.fields['employee']['avatars'],
+                                self.fields['employee']['avatar_urls'])
         if self.hasMebAvatar:
-            meb_attr = (self.mapping_flow('arcface')
-                        .get_embedding(self.fields['member']['avatars'][0]))
+            identities['member'] = self.fields['member']['id']
+            self.enroll_avatars('member', identities['member'], self.fields['member']['avatars'],
+                                self.fields['member']['avatar_urls'])
+        face_index = self.get_face_index()
+
+        index = [(stage, id, k) for stage, faces in self.operators['arcface'].items()
+                 for id, face in faces.items() for k in range(len(face))]
+        feats = face_stage.stack([np.asarray(face) for faces in self.operators['arcface'].values()
+                                  for face in faces.values()])
 
         exist_emp, exist_meb = {}, {}
-        is_emp_live = False
         for stage, faces in self.operators['arcface'].items():
-            exist_emp[stage] = {}
-            exist_meb[stage] = {}
-            for id, face in faces.items():
-                exist_emp[stage][id] = False
-                exist_meb[stage][id] = False
-                for attr in face:
-                    if self.hasEmpAvatar and self.mapping_flow('arcface').predict_embeddings(emp_attr, attr):
-                        is_emp_live = True
-                        exist_emp[stage][id] = True
-                    if self.hasMebAvatar and self.mapping_flow('arcface').predict_embeddings(meb_attr, attr):
-                        exist_meb[stage][id] = True
+            exist_emp[stage] = {id: False for id in faces}
+            exist_meb[stage] = {id: False for id in faces}
+        for kind, exist in (('employee', exist_emp), ('member', exist_meb)):
+            if kind not in identities:
+                continue
+            scores = face_index.verify(feats, kind, identities[kind])
+            if scores is None:
+                continue
+            enroll = []
+            for row, (stage, id, k) in enumerate(index):
+                if scores[row] > face_stage.sim_threshold:
+                    exist[stage][id] = True
+                quality = self.operators['face_quality'][stage][id][k]
+                if config.FACE_ENROLL_FROM_ORDERS and scores[row] > config.FACE_ENROLL_SIM_THRESHOLD \
+                        and quality >= config.FACE_ENROLL_QUALITY_THRESHOLD:
+                    enroll.append((row, quality, f"order:{self.order_id}:{stage}:{id}:{k}"))
+            # 开启后高置信匹配的工单人脸增量入库，后续审核可覆盖更多拍摄条件
+            if enroll:
+                rows, qualities, sources = zip(*enroll)
+                face_index.add(kind, identities[kind], feats[list(rows)], qualities, sources,
+                               origin='order', order_id=self.order_id)
+        is_emp_live = any(any(ids.values()) for ids in exist_emp.values())
 
         if not is_emp_live:
             self.log['estimate'].append(LogItem("志愿者未出现在任何阶段",
@@ -464,3 +510,6 @@ def post_processing(self):
             self.log['estimate'].append(LogItem("服务对象与回执单未同时出现",
                                                  'warning'))
 
+
+        # 本工单图像写入近重复索引，供后续工单检索
+        self.index_order_images(self.image_hashes, self.clip_feats)
@@ -0,0 +1,39 @@
+from work_flow.utils.image import crop_polygon_object
+
+'''
+检测→分类两阶段流程中的分类阶段
+- 收集一张图像或整个工单中全部检测框的裁剪，按批量一次送入分类流程
+- 分类流程提供predict_batch时整批推理(TTA视图作为额外的批次样本)，否则逐个调用predict_shapes
+'''
+
+
+class CropClassificationStage:
+    MAX_CROPS = 16  # 单次predict_batch的裁剪数，实际样本数为 裁剪数×TTA视图数
+
+    def __init__(self, flow, max_crops=None):
+        self.flow = flow
+        self.max_crops = max_crops or self.MAX_CROPS
+
+    @staticmethod
+    def crop(image, shapes):
+        return [crop_polygon_object(image, shape.points) for shape in shapes]
+
+    def classify(self, crops):
+        """分类裁剪图像列表，返回与crops等长的结果列表"""
+        if not hasattr(self.flow, 'predict_batch'):
+            return [self.flow.predict_shapes(crop) for crop in crops]
+        results = []
+        for start in range(0, len(crops), self.max_crops):
+            results.extend(self.flow.predict_batch(crops[start:start + self.max_crops]))
+        return results
+
+    def run(self, image, shapes):
+        """单张图像：返回 [(裁剪图像, 分类结果)]，顺序与shapes一致"""
+        crops = self.crop(image, shapes)
+        return list(zip(crops, self.classify(crops)))
+
+    def run_many(self, items):
+        """多张图像：items为[(图像, shapes)]，全部裁剪合并分类，返回每张图像的 [(裁剪图像, 分类结果)]"""
+        crops = [self.crop(image, shapes) for image, shapes in items]
+        results = iter(self.classify([crop for image_crops in crops for crop in image_crops]))
+        return [[(crop, next(results)) for crop in image_crops] for image_crops in crops]
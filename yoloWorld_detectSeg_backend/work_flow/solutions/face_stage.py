@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+
+from work_flow.utils.image import crop_polygon_object
+
+'''
+人物框→人脸核验流程
+- 收集一张图像或整个工单中全部人物框的裁剪，yolov6_face一次批量检测，每个裁剪取置信度最高的人脸并批量对齐
+- 对齐后的人脸每批一次送入ArcFace得到归一化特征，与服务者/服务对象头像特征一次矩阵乘法得到完整的相似度表
+- 每个人脸附带质量分(检测置信度×人脸尺寸系数)，供人脸库筛选入库样本
+- 头像与工单人脸走同一检测、对齐流程后再提取特征，两边都是112×112对齐人脸，相似度才有可比性
+'''
+
+
+class FaceVerificationStage:
+    MAX_CROPS = 16  # 单次批量检测的裁剪数
+    SIM_THRESHOLD = 0.5
+    FACE_SIZE = 112  # 人脸框短边达到对齐尺寸时尺寸系数为1
+
+    def __init__(self, detector, embedder, max_crops=None, sim_threshold=None):
+        self.detector = detector
+        self.embedder = embedder
+        self.max_crops = max_crops or self.MAX_CROPS
+        self.sim_threshold = sim_threshold if sim_threshold is not None else self.SIM_THRESHOLD
+
+    @staticmethod
+    def crop(image, shapes):
+        return [crop_polygon_object(image, shape.points) for shape in shapes]
+
+    def face_quality(self, result):
+        x1, y1, x2, y2, score = result[:5]
+        return float(score) * min(1.0, min(x2 - x1, y2 - y1) / self.FACE_SIZE)
+
+    def detect(self, crops):
+        """批量检测并对齐，返回与crops等长的 [(人脸, 质量分)]，未检测到人脸的裁剪为None"""
+        faces = []
+        for start in range(0, len(crops), self.max_crops):
+            for results, avatars in self.detector.predict_batch(crops[start:start + self.max_crops], max_faces=1):
+                faces.append((avatars[0], self.face_quality(results[0])) if avatars else None)
+        return faces
+
+    def detect_avatars(self, avatars):
+        """头像检测并对齐，返回与avatars等长的 [(人脸, 质量分)]，未检测到人脸的头像为None
+        头像多为人脸几乎占满画面的近景，检测器容易漏检，漏检的头像四周补边后再检测一次
+        """
+        faces = self.detect(avatars)
+        missed = [i for i, face in enumerate(faces) if face is None]
+        if missed:
+            for i, face in zip(missed, self.detect([self.pad(avatars[i]) for i in missed])):
+                faces[i] = face
+        return faces
+
+    @staticmethod
+    def pad(image, ratio=0.25):
+        h, w = image.shape[:2]
+        top, left = int(h * ratio), int(w * ratio)
+        return cv2.copyMakeBorder(image, top, top, left, left, cv2.BORDER_CONSTANT, value=0)
+
+    @staticmethod
+    def center_square(image):
+        """补边后仍未检测到人脸时的退化处理：取居中的正方形区域，避免整张头像被拉伸后送入特征模型"""
+        h, w = image.shape[:2]
+        size = min(h, w)
+        top, left = (h - size) // 2, (w - size) // 2
+        return image[top:top + size, left:left + size]
+
+    def embed(self, faces):
+        return self.embedder.get_embeddings(faces)
+
+    def run(self, image, shapes):
+        """单张图像：返回 (人脸列表, 特征矩阵[N, 512], 质量分列表)，只包含检测到人脸的人物框"""
+        return self.run_many([(image, shapes)])[0]
+
+    def run_many(self, items):
+        """多张图像：items为[(图像, shapes)]，全部裁剪合并检测、合并提取特征，返回每张图像的 (人脸列表, 特征矩阵, 质量分列表)"""
+        crops = [self.crop(image, shapes) for image, shapes in items]
+        faces = self.detect([crop for image_crops in crops for crop in image_crops])
+        feats = self.embed([face for face, _ in filter(None, faces)])
+        outputs, face_iter, start = [], iter(faces), 0
+        for image_crops in crops:
+            image_faces = [face for face in (next(face_iter) for _ in image_crops) if face is not None]
+            outputs.append(([face for face, _ in image_faces], feats[start:start + len(image_faces)],
+                            [quality for _, quality in image_faces]))
+            start += len(image_faces)
+        return outputs
+
+    def similarity(self, feats, gallery):
+        """feats[N, D]与gallery[M, D]的相似度表[N, M]"""
+        return self.embedder.similarity_matrix(feats, gallery)
+
+    def match(self, feats, gallery):
+        """相似度表按阈值判定，返回bool矩阵[N, M]"""
+        return self.similarity(feats, gallery) > self.sim_threshold
+
+    @staticmethod
+    def stack(feats_list):
+        feats_list = [feats for feats in feats_list if len(feats) > 0]
+        if not feats_list:
+            return np.zeros((0, 512), dtype=np.float32)
+        return np.concatenate(feats_list, axis=0)
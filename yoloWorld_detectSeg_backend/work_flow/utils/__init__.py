@@ -122,11 +122,22 @@ def base64_img_to_rgb_cv_img(base64_img, img_path=None):
             base64_img = base64_img.split(',')[1]
         img_data = base64.b64decode(base64_img)
         # img_data = img_data.split(",")[1]
-        img_array = np.frombuffer(img_data, np.uint8)
-        cv_image = cv2.imdecode(img_array, cv2.IMREAD_UNCHANGED)
-        if cv_image is None:
-            raise ValueError("Could not decode base64 image")
+        return bytes_to_rgb_cv_img(img_data)
+    return normalize_cv_img(cv_image)
+
+
+def bytes_to_rgb_cv_img(img_data):
+    """
+    Decode encoded image bytes (bytes, bytearray or memoryview) without extra copies.
+    """
+    img_array = np.frombuffer(img_data, np.uint8)
+    cv_image = cv2.imdecode(img_array, cv2.IMREAD_UNCHANGED)
+    if cv_image is None:
+        raise ValueError("Could not decode image")
+    return normalize_cv_img(cv_image)
+
 
+def normalize_cv_img(cv_image):
     # Ensure the image is in 8-bit unsigned integer format
     if cv_image.dtype != np.uint8:
         cv_image = cv2.normalize(cv_image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
@@ -55,6 +55,14 @@ def numpy_nms(boxes, scores, iou_threshold):
     return keep
 
 
+def batched_numpy_nms(boxes, scores, classes, iou_threshold):
+    """按类别NMS：各类别的框平移到互不重叠的区域后一次完成"""
+    if len(boxes) == 0:
+        return np.empty((0,), dtype=np.int64)
+    offsets = classes[:, None] * (boxes.max() - boxes.min() + 1)
+    return numpy_nms(boxes + offsets, scores, iou_threshold)
+
+
 def numpy_nms_rotated(boxes, scores, iou_threshold):
     if len(boxes) == 0:
         return np.empty((0,), dtype=np.int8)
@@ -22,23 +22,32 @@ def batch_base64_encode_image(results_images):
         im_base64.save(buffered, format="JPEG")
     return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-def base64_encode_image(image) -> str|None:
-    if image is None:
-        return None
+def encode_image(image, fmt="JPEG", max_size=None, quality=None) -> bytes:
+    """按指定格式编码图像，max_size限制长边(等比缩小)"""
     buffered = io.BytesIO()
     dim = image.ndim
     if image.dtype not in [np.uint8, np.float32]:
         image = image.astype('uint8')  # 转换为 uint8
     if dim == 2:  # 这种一般都是单个张量，未添加mat签名
-        print(image.shape)
         image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
     elif dim == 3:
         image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
     elif dim == 4:
         image = cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
-    im_base64 = Image.fromarray(image)
-    im_base64.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    pil_image = Image.fromarray(image)
+    if max_size:
+        pil_image.thumbnail((max_size, max_size))
+    if quality is None:
+        pil_image.save(buffered, format=fmt)
+    else:
+        pil_image.save(buffered, format=fmt, quality=quality)
+    return buffered.getvalue()
+
+
+def base64_encode_image(image) -> str|None:
+    if image is None:
+        return None
+    img_str = base64.b64encode(encode_image(image)).decode('utf-8')
     return f"data:image/jpeg;base64,{img_str}"
 
 def img_data_to_pil(img_data):
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+'''
+SAM解码器的批量提示工具
+- 多个框/点提示按最长的提示用填充点(label=-1)补齐后打包为一个批次
+- 解码器输入的批次维为动态时一次解码整批，否则退化为逐个解码
+- 掩码的反变换、二值化和外接框计算按整批处理，后续轮廓提取只在各掩码的外接框内进行
+'''
+
+MAX_WARP_CHANNELS = 512  # cv2.warpAffine单次支持的最大通道数
+
+
+def has_dynamic_batch(session, input_name="point_coords"):
+    """判断解码器指定输入的第0维是否为动态维度"""
+    for node in session.get_inputs():
+        if node.name == input_name:
+            dim = node.shape[0] if node.shape else 1
+            return not isinstance(dim, int) or dim <= 0
+    return False
+
+
+def pack_prompts(prompts):
+    """[(points[N_i, 2], labels[N_i]), ...] -> coords[B, N+1, 2], labels[B, N+1]
+
+    每组提示末尾至少带一个填充点，与单个提示的解码输入保持一致
+    """
+    length = max(len(labels) for _, labels in prompts) + 1
+    coords = np.zeros((len(prompts), length, 2), dtype=np.float32)
+    labels = np.full((len(prompts), length), -1, dtype=np.float32)
+    for i, (points, point_labels) in enumerate(prompts):
+        coords[i, :len(point_labels)] = points
+        labels[i, :len(point_labels)] = point_labels
+    return coords, labels
+
+
+def warp_masks(masks, original_size, transform_matrix):
+    """masks[B, M, H, W] 以同一仿射矩阵变换回原图尺寸，多个掩码合并为多通道一次变换"""
+    batch, num = masks.shape[:2]
+    flat = masks.reshape(batch * num, *masks.shape[2:]).transpose(1, 2, 0)
+    output = np.empty((original_size[0], original_size[1], batch * num), dtype=masks.dtype)
+    for start in range(0, batch * num, MAX_WARP_CHANNELS):
+        end = min(start + MAX_WARP_CHANNELS, batch * num)
+        warped = cv2.warpAffine(
+            np.ascontiguousarray(flat[..., start:end]),
+            transform_matrix[:2],
+            (original_size[1], original_size[0]),
+            flags=cv2.INTER_LINEAR,
+        )
+        output[..., start:end] = warped.reshape(original_size[0], original_size[1], -1)
+    return output.transpose(2, 0, 1).reshape(batch, num, original_size[0], original_size[1])
+
+
+def resize_masks(masks, size):
+    """masks[B, h, w] -> [B, H, W]，多个掩码合并为多通道一次缩放"""
+    flat = masks.transpose(1, 2, 0)
+    output = np.empty((size[0], size[1], len(masks)), dtype=masks.dtype)
+    for start in range(0, len(masks), MAX_WARP_CHANNELS):
+        end = min(start + MAX_WARP_CHANNELS, len(masks))
+        resized = cv2.resize(np.ascontiguousarray(flat[..., start:end]), (size[1], size[0]))
+        output[..., start:end] = resized.reshape(size[0], size[1], -1)
+    return output.transpose(2, 0, 1)
+
+
+def binarize_masks(masks, threshold=0.0):
+    """masks[B, H, W] -> (二值掩码uint8[B, H, W] 取值0/255, 外接框int[B, 4] x1y1x2y2，空掩码为-1)"""
+    binary = masks > threshold
+    rows = binary.any(axis=2)
+    cols = binary.any(axis=1)
+    boxes = np.full((len(binary), 4), -1, dtype=np.int64)
+    valid = rows.any(axis=1)
+    if valid.any():
+        height, width = binary.shape[1:]
+        boxes[valid, 0] = cols[valid].argmax(axis=1)
+        boxes[valid, 1] = rows[valid].argmax(axis=1)
+        boxes[valid, 2] = width - 1 - cols[valid][:, ::-1].argmax(axis=1)
+        boxes[valid, 3] = height - 1 - rows[valid][:, ::-1].argmax(axis=1)
+    return binary.astype(np.uint8) * 255, boxes
+
+
+def crop_mask(binary, box, pad=1):
+    """按外接框裁出掩码(四周留出边距以保证轮廓闭合)，返回 (裁剪结果, 偏移(x, y))"""
+    height, width = binary.shape
+    x1, y1 = max(int(box[0]) - pad, 0), max(int(box[1]) - pad, 0)
+    x2, y2 = min(int(box[2]) + pad + 1, width), min(int(box[3]) + pad + 1, height)
+    return binary[y1:y2, x1:x2], (x1, y1)